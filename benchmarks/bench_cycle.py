@@ -0,0 +1,182 @@
+"""
+Runs full polling cycles of the bot against a fake FS22 server farm and a fake discord client,
+and reports cycle latency, event loop blocking, bytes parsed, memory and discord API calls.
+Run with: python3 benchmarks/bench_cycle.py --servers 1,10,100,500
+"""
+import argparse
+import asyncio
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from fakediscord import FakeDiscordClient
+from fakefarm import FakeServerFarm
+
+DEFAULT_MIX = "small=40,modded=20,churn=25,slow=5,dead=5,empty=5"
+
+
+def build_behaviors(count, mix):
+  """Distributes the behaviors over the servers according to their weights"""
+  weights = []
+  for entry in mix.split(","):
+    behavior, weight = entry.split("=")
+    weights.append((behavior, int(weight)))
+  total = sum(weight for _, weight in weights)
+  behaviors = []
+  for behavior, weight in weights:
+    behaviors.extend([behavior] * (count * weight // total))
+  # Fill up the rounding gap with the most common behavior
+  behaviors.extend([weights[0][0]] * (count - len(behaviors)))
+  return behaviors[:count]
+
+
+class LoopLagMonitor:
+  """Measures how long the event loop was blocked, by checking how late a short sleep wakes up"""
+
+  def __init__(self, interval=0.005):
+    self.interval = interval
+    self.blockedSeconds = 0.0
+    self.maxStall = 0.0
+    self.task = None
+
+  async def _run(self):
+    while True:
+      start = time.perf_counter()
+      await asyncio.sleep(self.interval)
+      lag = time.perf_counter() - start - self.interval
+      if lag > 0.001:
+        self.blockedSeconds += lag
+        self.maxStall = max(self.maxStall, lag)
+
+  def start(self):
+    self.blockedSeconds = 0.0
+    self.maxStall = 0.0
+    self.task = asyncio.ensure_future(self._run())
+
+  async def stop(self):
+    self.task.cancel()
+    try:
+      await self.task
+    except asyncio.CancelledError:
+      pass
+
+
+async def drain(scheduler):
+  while scheduler.pending_count() or scheduler.workers:
+    await asyncio.sleep(0.01)
+
+
+async def run_size(main, serverCount, args):
+  from serverconfiguration import ServerConfiguration
+  from serverstatusinfo import ServerStatus
+
+  farm = FakeServerFarm(build_behaviors(serverCount, args.mix),
+                        slowDelay=args.read_timeout * 2)
+  await farm.start()
+  fakeClient = FakeDiscordClient(latency=args.discord_latency,
+                                 rateLimitProbability=args.rate_limit)
+  main.client = fakeClient
+  main.serverRegistry = main.ServerRegistry()
+  main.serverStatus.clear()
+  main.statusMessages.clear()
+  for server in farm.servers:
+    # Every guild which watches the server has its own channels
+    for guildId in range(1, args.guilds + 1):
+      channelBase = guildId * 100000
+      serverConfig = ServerConfiguration("127.0.0.1", str(server.port),
+                                         server.apiCode, "2ECC71", guildId)
+      serverConfig.set_status_embed(channelBase + 1000 + server.index % 10,
+                                    channelBase + 10000 + server.index)
+      serverConfig.set_member_log_channel(channelBase + 2000 +
+                                          server.index % 5)
+      serverConfig.set_voice_channel(str(channelBase + 3000 + server.index),
+                                     "Map %d" % server.index)
+      main.serverRegistry.add(serverConfig)
+    main.serverStatus[serverConfig.identifier] = ServerStatus(
+      main.serverRegistry.primary(serverConfig.identifier))
+
+  # Count the bytes which actually get parsed
+  parsedBytes = [0]
+  parseStatusFeed = main.statusPoller.parseStatusFeed
+
+  def counting_parser(data):
+    parsedBytes[0] += len(data)
+    return parseStatusFeed(data)
+
+  main.statusPoller.parseStatusFeed = counting_parser
+  monitor = LoopLagMonitor()
+
+  print("%d servers, watched by %d guilds" % (serverCount, args.guilds))
+  print("  cycle  latency ms  blocked ms  max stall ms  parsed KB  memory KB  "
+        "sends  edits  renames  429s")
+  try:
+    for cycle in range(args.cycles):
+      farm.cycle = cycle
+      parsedBytes[0] = 0
+      main.firstStart = cycle == 0
+      monitor.start()
+      start = time.perf_counter()
+
+      statuses = await main.get_server_status(main.serverRegistry.hosts())
+      main.update_embeds(statuses)
+      await drain(main.discordScheduler)
+
+      latency = time.perf_counter() - start
+      await monitor.stop()
+      calls = fakeClient.take_calls()
+      memory = tracemalloc.get_traced_memory()[
+        1] if tracemalloc.is_tracing() else 0
+      if hasattr(tracemalloc, "reset_peak") and tracemalloc.is_tracing():
+        tracemalloc.reset_peak()
+      print("  %5d  %10.1f  %10.1f  %12.1f  %9d  %9d  %5d  %5d  %7d  %4d" %
+            (cycle, latency * 1000, monitor.blockedSeconds * 1000,
+             monitor.maxStall * 1000, parsedBytes[0] // 1024, memory // 1024,
+             calls["send_message"], calls["edit_message"],
+             calls["edit_channel"], calls["429"]))
+  finally:
+    main.statusPoller.parseStatusFeed = parseStatusFeed
+    await farm.stop()
+
+
+async def run(args):
+  import main
+  for serverCount in [int(count) for count in args.servers.split(",")]:
+    await run_size(main, serverCount, args)
+  await main.statusPoller.close()
+
+
+def parse_args():
+  parser = argparse.ArgumentParser(description=__doc__)
+  parser.add_argument("--servers", default="1,10,50,100,500")
+  parser.add_argument("--cycles", type=int, default=3)
+  parser.add_argument("--mix", default=DEFAULT_MIX)
+  parser.add_argument("--guilds",
+                      type=int,
+                      default=1,
+                      help="number of guilds which watch every server")
+  parser.add_argument("--read-timeout", type=float, default=1.0)
+  parser.add_argument("--discord-latency", type=float, default=0.05)
+  parser.add_argument("--rate-limit",
+                      type=float,
+                      default=0.02,
+                      help="probability of a 429 per discord request")
+  parser.add_argument("--trace-memory", action="store_true")
+  return parser.parse_args()
+
+
+if __name__ == "__main__":
+  args = parse_args()
+  workDirectory = tempfile.mkdtemp(prefix="fss-bench-")
+  # Keep the benchmark away from the real database and history
+  os.environ["FSS_STORAGE_BACKEND"] = "sqlite"
+  os.environ["FSS_SQLITE_PATH"] = os.path.join(workDirectory, "bench.sqlite3")
+  os.environ["FSS_HISTORY_DIR"] = os.path.join(workDirectory, "history")
+  os.environ["FSS_READ_TIMEOUT"] = str(args.read_timeout)
+  os.environ["FSS_CONNECT_TIMEOUT"] = str(args.read_timeout)
+  if args.trace_memory:
+    tracemalloc.start()
+  asyncio.get_event_loop().run_until_complete(run(args))
@@ -0,0 +1,56 @@
+"""
+Compares the incremental status XML parser with the xmltodict based one, and measures what it
+costs to also summarize the vehicles and farms.
+Run with: python3 benchmarks/bench_parser.py
+"""
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from farmstats import compute_farm_stats
+from feedfixtures import build_feed, build_players
+from statusparser import parse_status_feed, parse_status_feed_xmltodict
+
+FARM_SECTIONS = ("Slots", "Vehicles", "Farms")
+
+FEEDS = {
+  "small":
+  build_feed(capacity=6, players=build_players(2), vehicleCount=20,
+             modCount=10),
+  "large":
+  build_feed(capacity=16,
+             players=build_players(12),
+             vehicleCount=2000,
+             modCount=300,
+             farmCount=8),
+}
+
+
+def run(repetitions=200):
+  for feedName, data in FEEDS.items():
+    streamed = parse_status_feed(data)
+    full = parse_status_feed_xmltodict(data)
+    assert streamed.server == full.server
+    assert streamed.slots == full.slots
+    assert streamed.players == full.players
+
+    print("%s feed (%d KB):" % (feedName, len(data) // 1024))
+    for parserName, parser in (("stream", parse_status_feed),
+                               ("xmltodict", parse_status_feed_xmltodict)):
+      seconds = timeit.timeit(lambda: parser(data), number=repetitions)
+      print("  %-10s %8.3f ms per feed" %
+            (parserName, seconds * 1000 / repetitions))
+
+    feed = parse_status_feed(data, FARM_SECTIONS)
+    for stepName, step in (
+      ("stream, all sections", lambda: parse_status_feed(data, FARM_SECTIONS)),
+      ("farm stats", lambda: compute_farm_stats(feed.vehicles, feed.farms))):
+      seconds = timeit.timeit(step, number=repetitions)
+      print("  %-20s %8.3f ms per feed" %
+            (stepName, seconds * 1000 / repetitions))
+
+
+if __name__ == "__main__":
+  run()
@@ -0,0 +1,163 @@
+"""
+Measures how polling scales with the number of poll worker processes. Each run polls every
+server of a fake server farm once with fresh workers, so every feed gets parsed and compared.
+Run with: python3 benchmarks/bench_shards.py --servers 500 --workers 0,1,2,4
+(0 workers means polling in the bot process itself)
+"""
+import argparse
+import asyncio
+import multiprocessing
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from bench_cycle import build_behaviors
+from fakefarm import FakeServerFarm
+
+DEFAULT_MIX = "modded=50,churn=30,small=20"
+
+
+def serve_farm(behaviors, connection):
+  """Runs a fake server farm in its own process and reports its ports to the parent"""
+  loop = asyncio.get_event_loop()
+  farm = FakeServerFarm(behaviors)
+  loop.run_until_complete(farm.start())
+  connection.send([(server.port, server.apiCode) for server in farm.servers])
+  loop.run_forever()
+
+
+def start_farms(serverCount, args):
+  """Spreads the servers over several processes, so serving them does not limit the benchmark"""
+  behaviors = build_behaviors(serverCount, args.mix)
+  # Forking would copy the running event loop of this process
+  context = multiprocessing.get_context("spawn")
+  processes = []
+  servers = []
+  for index in range(args.farm_processes):
+    parentConnection, childConnection = context.Pipe()
+    process = context.Process(
+      target=serve_farm,
+      args=(behaviors[index::args.farm_processes], childConnection),
+      daemon=True)
+    process.start()
+    servers.extend(parentConnection.recv())
+    processes.append(process)
+  return processes, servers
+
+
+def build_statuses(servers):
+  from serverconfiguration import ServerConfiguration
+  from serverstatusinfo import ServerStatus
+
+  return [
+    ServerStatus(
+      ServerConfiguration("127.0.0.1", str(port), apiCode, "2ECC71", 1))
+    for port, apiCode in servers
+  ]
+
+
+def build_poller(workerCount, args):
+  import functools
+  from hosthealth import HostHealthTracker
+  from shardedpoller import ShardedPoller
+  from statusfetcher import StatusFetcher
+  from statusparser import parse_status_feed, parse_status_feed_xmltodict
+  from statuspoller import StatusPoller
+
+  sections = ["Slots", "Vehicles", "Farms"] if args.farm_stats else ["Slots"]
+  if workerCount > 0:
+    return ShardedPoller(
+      workerCount, {
+        "maxConcurrency": args.concurrency,
+        "connectTimeout": args.timeout,
+        "readTimeout": args.timeout,
+        "failureThreshold": 3,
+        "maxBackoff": 900,
+        "offlineAfterTimeouts": 2,
+        "parser": args.parser,
+        "sections": sections
+      })
+  health = HostHealthTracker()
+  return StatusPoller(
+    StatusFetcher(maxConcurrency=args.concurrency,
+                  connectTimeout=args.timeout,
+                  readTimeout=args.timeout,
+                  health=health), health,
+    functools.partial(
+      parse_status_feed_xmltodict
+      if args.parser == "xmltodict" else parse_status_feed,
+      sections=sections))
+
+
+async def measure(workerCount, servers, args):
+  """Returns the fastest time of polling all servers once"""
+  best = None
+  for _ in range(args.repeat):
+    poller = build_poller(workerCount, args)
+    if workerCount > 0:
+      # Don't count the start of the worker processes
+      await poller.start()
+    statuses = build_statuses(servers)
+    start = time.perf_counter()
+    outcomes = await poller.poll(statuses)
+    elapsed = time.perf_counter() - start
+    await poller.close()
+    if len(outcomes) != len(statuses):
+      print("WARN: Only %d of %d servers were polled" %
+            (len(outcomes), len(statuses)))
+    best = elapsed if best is None else min(best, elapsed)
+  return best
+
+
+async def run(args):
+  print("%d CPU cores, %s parser" % (os.cpu_count(), args.parser))
+  for serverCount in [int(count) for count in args.servers.split(",")]:
+    processes, servers = start_farms(serverCount, args)
+    try:
+      print("%d servers" % serverCount)
+      print("  workers  cycle ms  servers/s  speedup")
+      baseline = None
+      for workerCount in [int(count) for count in args.workers.split(",")]:
+        elapsed = await measure(workerCount, servers, args)
+        baseline = baseline or elapsed
+        print("  %7d  %8.1f  %9.1f  %6.2fx" %
+              (workerCount, elapsed * 1000, serverCount / elapsed,
+               baseline / elapsed))
+    finally:
+      for process in processes:
+        process.terminate()
+
+
+def parse_args():
+  parser = argparse.ArgumentParser(description=__doc__)
+  parser.add_argument("--servers", default="100,500")
+  parser.add_argument("--workers",
+                      default=",".join(
+                        str(count)
+                        for count in sorted({0, 1, 2, 4,
+                                             os.cpu_count() or 1})))
+  parser.add_argument("--mix", default=DEFAULT_MIX)
+  parser.add_argument(
+    "--parser",
+    default="xmltodict",
+    help="xmltodict makes parsing the bottleneck, stream makes it fetching")
+  parser.add_argument("--concurrency",
+                      type=int,
+                      default=10,
+                      help="concurrent requests per process")
+  parser.add_argument("--timeout", type=float, default=5.0)
+  parser.add_argument("--farm-stats",
+                      action="store_true",
+                      help="also summarize the vehicles and farms")
+  parser.add_argument("--repeat", type=int, default=3)
+  parser.add_argument("--farm-processes",
+                      type=int,
+                      default=max(1, (os.cpu_count() or 1) // 2))
+  return parser.parse_args()
+
+
+if __name__ == "__main__":
+  args = parse_args()
+  asyncio.get_event_loop().run_until_complete(run(args))
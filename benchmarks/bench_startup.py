@@ -0,0 +1,94 @@
+"""
+Measures how long it takes to read the server configurations and statuses on startup, with and
+without the snapshot. Every database request is delayed to simulate a remote database.
+Run with: python3 benchmarks/bench_startup.py --servers 1000 --latency 0.05
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from feedfixtures import build_players
+from persistence import SqliteBackend, WriteBehindStore
+from serverconfiguration import ServerConfiguration
+from serverstatusinfo import PlayerStatus, ServerStatus
+
+
+class SlowBackend:
+  """Delays and counts every request to the wrapped backend"""
+
+  def __init__(self, backend, latency):
+    self.backend = backend
+    self.latency = latency
+    self.requests = 0
+
+  def __getattr__(self, name):
+    method = getattr(self.backend, name)
+
+    def request(*args):
+      self.requests += 1
+      time.sleep(self.latency)
+      return method(*args)
+
+    return request
+
+
+def fill(store, serverCount, playerCount):
+  for index in range(serverCount):
+    serverConfig = ServerConfiguration("10.0.%d.%d" % (index // 250, index % 250),
+                                       "8080", "code", "2ECC71", 1)
+    serverData = ServerStatus(serverConfig)
+    serverData.update_attributes("Online", "Server %d" % index, "Map", "16")
+    serverData.set_players({
+      name: PlayerStatus.create(name, uptime, admin)
+      for name, uptime, admin in build_players(playerCount, seed=index)
+    })
+    store.mark_dirty("servers", serverConfig.key,
+                     lambda serverConfig=serverConfig: vars(serverConfig))
+    store.mark_dirty("serverStatus", serverConfig.identifier,
+                     serverData.to_json)
+  store.flush_sync()
+
+
+def measure(path, snapshotNamespaces, latency):
+  backend = SlowBackend(SqliteBackend(path), latency)
+  store = WriteBehindStore(backend, snapshotNamespaces=snapshotNamespaces)
+  start = time.perf_counter()
+  servers = store.load("servers")
+  statuses = store.load("serverStatus")
+  elapsed = time.perf_counter() - start
+  backend.backend.close()
+  return elapsed, backend.requests, len(servers), len(statuses)
+
+
+def run(args):
+  snapshotNamespaces = ("servers", "serverStatus")
+  with tempfile.TemporaryDirectory() as directory:
+    for label, namespaces in (("namespaces", ()), ("snapshot",
+                                                   snapshotNamespaces)):
+      path = os.path.join(directory, label + ".sqlite3")
+      fill(WriteBehindStore(SqliteBackend(path),
+                            snapshotNamespaces=namespaces), args.servers,
+           args.players)
+      elapsed, requests, serverCount, statusCount = measure(
+        path, namespaces, args.latency)
+      print("%-10s  %7.1f ms  %3d requests  %d servers, %d statuses" %
+            (label, elapsed * 1000, requests, serverCount, statusCount))
+
+
+def parse_args():
+  parser = argparse.ArgumentParser(description=__doc__)
+  parser.add_argument("--servers", type=int, default=1000)
+  parser.add_argument("--players", type=int, default=12)
+  parser.add_argument("--latency",
+                      type=float,
+                      default=0.05,
+                      help="Seconds every database request takes")
+  return parser.parse_args()
+
+
+if __name__ == "__main__":
+  run(parse_args())
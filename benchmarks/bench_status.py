@@ -0,0 +1,85 @@
+"""
+Measures the memory held per tracked server and the time it takes to compare player lists.
+Run with: python3 benchmarks/bench_status.py --servers 5000
+"""
+import argparse
+import os
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from feedfixtures import build_players
+from serverconfiguration import ServerConfiguration
+from serverstatusinfo import ServerStatus
+
+
+def player_elements(players, minute):
+  """Turns fixture players into the elements the status parser returns"""
+  return [{
+    "@isUsed": "true",
+    "@isAdmin": "true" if admin else "false",
+    "@uptime": str(uptime + minute),
+    # A new string per poll, like the parser returns
+    "#text": name.encode("utf-8").decode("utf-8")
+  } for name, uptime, admin in players]
+
+
+def run(args):
+  # Every server has its own players, but names repeat across polls like they do in reality
+  playersPerServer = [
+    build_players(args.players, seed=index) for index in range(args.servers)
+  ]
+  # The online time only changes once per minute, but the rest of the feed changes every poll
+  feeds = [[
+    player_elements(players, poll // args.polls_per_minute)
+    for players in playersPerServer
+  ] for poll in range(args.polls)]
+  # Every third server loses one player in the last poll
+  for index in range(0, args.servers, 3):
+    feeds[-1][index] = feeds[-1][index][1:]
+
+  serverConfigs = [
+    ServerConfiguration("127.0.0.1", str(10000 + index), "code", "2ECC71", 1)
+    for index in range(args.servers)
+  ]
+
+  tracemalloc.start()
+  before = tracemalloc.get_traced_memory()[0]
+  statuses = []
+  for index, serverConfig in enumerate(serverConfigs):
+    serverData = ServerStatus(serverConfig)
+    serverData.update_attributes("Online", "Server %d" % index, "Map", "16")
+    statuses.append(serverData)
+  for serverData, elements in zip(statuses, feeds[0]):
+    serverData.update_players(elements)
+  memory = tracemalloc.get_traced_memory()[0] - before
+  tracemalloc.stop()
+
+  start = time.perf_counter()
+  changes = 0
+  for elements in feeds[1:]:
+    for serverData, serverElements in zip(statuses, elements):
+      serverData.update_players(serverElements)
+      changes += len(serverData.recentlyLoggedOut)
+  elapsed = time.perf_counter() - start
+
+  print("%d servers with %d players each" % (args.servers, args.players))
+  print("  memory per server   %8.0f bytes" % (memory / args.servers))
+  print("  update_players      %8.2f us per server and poll" %
+        (elapsed * 1e6 / (args.servers * (args.polls - 1))))
+  print("  logouts detected    %8d" % changes)
+
+
+def parse_args():
+  parser = argparse.ArgumentParser(description=__doc__)
+  parser.add_argument("--servers", type=int, default=5000)
+  parser.add_argument("--players", type=int, default=12)
+  parser.add_argument("--polls", type=int, default=10)
+  parser.add_argument("--polls-per-minute", type=int, default=3)
+  return parser.parse_args()
+
+
+if __name__ == "__main__":
+  run(parse_args())
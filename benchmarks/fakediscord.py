@@ -0,0 +1,98 @@
+"""
+A stand-in for the discord client which records all calls and can simulate rate limits
+"""
+import asyncio
+import collections
+import random
+import discord
+
+
+class FakeResponse:
+  """Mimics the parts of an aiohttp response which discord.HTTPException reads"""
+
+  def __init__(self, status, reason, headers):
+    self.status = status
+    self.reason = reason
+    self.headers = headers
+
+
+class FakeMessage:
+
+  def __init__(self, channel, id):
+    self.channel = channel
+    self.id = id
+
+  async def edit(self, **kwargs):
+    await self.channel.client.request("edit_message")
+
+
+class FakeChannel:
+
+  def __init__(self, client, id):
+    self.client = client
+    self.id = id
+
+  def get_partial_message(self, id):
+    return FakeMessage(self, id)
+
+  async def send(self, content=None, embed=None, embeds=None):
+    await self.client.request("send_message")
+    if self.client.sentMessages is not None:
+      embeds = embeds or ([embed] if embed is not None else [])
+      self.client.sentMessages.append(
+        (self.id, content, [embed.description for embed in embeds]))
+    return FakeMessage(self, self.client.next_message_id())
+
+  async def edit(self, **kwargs):
+    await self.client.request("edit_channel")
+
+
+class FakeDiscordClient:
+  """
+  Records every request. Each request takes `latency` seconds, and fails with a 429 with the
+  given probability.
+  """
+
+  def __init__(self, latency=0.05, rateLimitProbability=0.0, retryAfter=0.2,
+               seed=0):
+    self.latency = latency
+    self.rateLimitProbability = rateLimitProbability
+    self.retryAfter = retryAfter
+    self.rng = random.Random(seed)
+    self.channels = {}
+    self.calls = collections.Counter()
+    self.messageId = 0
+    # Set to a list to keep the channel, content and embed descriptions of every sent message
+    self.sentMessages = None
+
+  def get_channel(self, id):
+    channel = self.channels.get(id)
+    if channel is None:
+      channel = FakeChannel(self, id)
+      self.channels[id] = channel
+    return channel
+
+  def next_message_id(self):
+    self.messageId += 1
+    return self.messageId
+
+  def is_closed(self):
+    return False
+
+  async def wait_until_ready(self):
+    pass
+
+  async def request(self, kind):
+    await asyncio.sleep(self.latency)
+    if self.rng.random() < self.rateLimitProbability:
+      self.calls["429"] += 1
+      raise discord.HTTPException(
+        FakeResponse(429, "Too Many Requests",
+                     {"Retry-After": str(self.retryAfter)}),
+        {"message": "You are being rate limited."})
+    self.calls[kind] += 1
+
+  def take_calls(self):
+    calls = self.calls
+    self.calls = collections.Counter()
+    return calls
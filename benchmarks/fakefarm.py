@@ -0,0 +1,113 @@
+"""
+A local stand-in for many FS22 dedicated servers, each listening on its own port
+"""
+import asyncio
+import socket
+from aiohttp import web
+
+from feedfixtures import build_empty_feed, build_feed, build_players
+
+# A small server with a handful of players and mods
+BEHAVIOR_SMALL = "small"
+# A heavily modded map with thousands of vehicles
+BEHAVIOR_MODDED = "modded"
+# Players log in and out in every cycle, and a mod gets updated every other cycle
+BEHAVIOR_CHURN = "churn"
+# Answers slower than the read timeout of the bot
+BEHAVIOR_SLOW = "slow"
+# Nothing listens on the port
+BEHAVIOR_DEAD = "dead"
+# The host is up, but the game is not running
+BEHAVIOR_EMPTY = "empty"
+
+
+class FakeServer:
+
+  def __init__(self, index, behavior):
+    self.index = index
+    self.behavior = behavior
+    self.apiCode = "code%d" % index
+    # Reserve a port. Dead servers release it again, so connections get refused
+    self.socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    self.socket.bind(("127.0.0.1", 0))
+    self.port = self.socket.getsockname()[1]
+    if behavior == BEHAVIOR_DEAD:
+      self.socket.close()
+      self.socket = None
+
+
+class FakeServerFarm:
+  """
+  Serves dedicated-server-stats.xml fixtures for a list of behaviors (one per simulated server).
+  Increase cycle to make churning servers change their player lists.
+  """
+
+  def __init__(self, behaviors, slowDelay=10.0):
+    self.slowDelay = slowDelay
+    self.cycle = 0
+    self.bytesServed = 0
+    self.requests = 0
+    self.servers = [
+      FakeServer(index, behavior)
+      for index, behavior in enumerate(behaviors)
+    ]
+    self.runner = None
+    self.feeds = {
+      BEHAVIOR_SMALL:
+      build_feed(capacity=6,
+                 players=build_players(2),
+                 vehicleCount=20,
+                 modCount=10),
+      BEHAVIOR_MODDED:
+      build_feed(capacity=16,
+                 players=build_players(10),
+                 vehicleCount=2000,
+                 modCount=300,
+                 farmCount=8),
+      BEHAVIOR_EMPTY:
+      build_empty_feed(),
+    }
+    self.churnFeeds = {}
+
+  async def start(self):
+    app = web.Application()
+    app.router.add_get("/feed/dedicated-server-stats.xml", self._handle)
+    self.runner = web.AppRunner(app, access_log=None)
+    await self.runner.setup()
+    for server in self.servers:
+      if server.socket is not None:
+        await web.SockSite(self.runner, server.socket).start()
+
+  async def stop(self):
+    if self.runner is not None:
+      await self.runner.cleanup()
+
+  def _feed(self, server):
+    if server.behavior == BEHAVIOR_CHURN:
+      # A different subset of players is online in every cycle
+      key = (server.index, self.cycle)
+      if key not in self.churnFeeds:
+        players = build_players(12, seed=server.index)
+        onlinePlayers = [
+          player for i, player in enumerate(players)
+          if (i + self.cycle) % 3 != 0
+        ]
+        self.churnFeeds[key] = build_feed(capacity=16,
+                                          players=onlinePlayers,
+                                          vehicleCount=100,
+                                          modCount=50,
+                                          seed=server.index,
+                                          modRevision=self.cycle // 2)
+      return self.churnFeeds[key]
+    if server.behavior == BEHAVIOR_SLOW:
+      return self.feeds[BEHAVIOR_SMALL]
+    return self.feeds[server.behavior]
+
+  async def _handle(self, request):
+    self.requests += 1
+    server = self.servers[int(request.query["code"][len("code"):])]
+    if server.behavior == BEHAVIOR_SLOW:
+      await asyncio.sleep(self.slowDelay)
+    data = self._feed(server)
+    self.bytesServed += len(data)
+    return web.Response(body=data, content_type="text/xml")
@@ -0,0 +1,86 @@
+"""
+Generates synthetic dedicated-server-stats.xml feeds for the benchmarks
+"""
+import random
+from xml.sax.saxutils import escape, quoteattr
+
+VEHICLE_CATEGORIES = [
+  "tractorsS", "tractorsM", "tractorsL", "harvesters", "trailers", "cars",
+  "forageHarvesters", "mowers", "balers", "sprayers"
+]
+FILL_TYPES = ["DIESEL", "DEF", "WHEAT", "BARLEY", "CANOLA", "GRASS_WINDROW"]
+
+
+def build_feed(serverName="Benchmark Server",
+               capacity=16,
+               players=None,
+               vehicleCount=0,
+               modCount=0,
+               farmCount=1,
+               mapSize=2048,
+               seed=0,
+               modRevision=0):
+  """
+  Builds a feed in the format of the FS22 dedicated server.
+  players is a list of (name, uptime, isAdmin) tuples. Increase modRevision to simulate an update
+  of the first mod.
+  """
+  rng = random.Random(seed)
+  players = players or []
+  half = mapSize / 2
+  lines = [
+    '<?xml version="1.0" encoding="UTF-8" standalone="no" ?>',
+    '<Server game="Farming Simulator 22" version="1.8.2.0" name=%s mapName="Elmcreek" '
+    'dayTime="43200000" mapOverviewFilename="" mapSize="%d">' %
+    (quoteattr(serverName), mapSize),
+    '  <Slots capacity="%d" numUsed="%d">' % (capacity, len(players))
+  ]
+  for name, uptime, isAdmin in players:
+    lines.append(
+      '    <Player isUsed="true" isAdmin="%s" uptime="%d" x="%.1f" y="90.0" z="%.1f">%s</Player>'
+      % ("true" if isAdmin else "false", uptime, rng.uniform(-half, half),
+         rng.uniform(-half, half), escape(name)))
+  for _ in range(capacity - len(players)):
+    lines.append('    <Player isUsed="false"/>')
+  lines.append('  </Slots>')
+
+  lines.append('  <Vehicles>')
+  for i in range(vehicleCount):
+    lines.append(
+      '    <Vehicle name="Vehicle %d" category="%s" type="vehicle" farmId="%d" x="%.1f" y="90.0" z="%.1f">'
+      % (i, rng.choice(VEHICLE_CATEGORIES), rng.randint(1, farmCount),
+         rng.uniform(-half, half), rng.uniform(-half, half)))
+    lines.append('      <Fills><Fill type="%s" level="%.1f"/></Fills>' %
+                 (rng.choice(FILL_TYPES), rng.uniform(0, 10000)))
+    lines.append('    </Vehicle>')
+  lines.append('  </Vehicles>')
+
+  # Servers with the same seed get the same mods, no matter what else is going on
+  modRng = random.Random(seed)
+  lines.append('  <Mods>')
+  for i in range(modCount):
+    lines.append(
+      '    <Mod name="FS22_BenchmarkMod%d" author="Author %d" version="1.0.%d.%d" hash="%032x">Benchmark Mod %d</Mod>'
+      % (i, i, i % 7, modRevision if i == 0 else 0,
+         modRng.getrandbits(128) + (modRevision if i == 0 else 0), i))
+  lines.append('  </Mods>')
+
+  lines.append('  <Farms>')
+  for i in range(1, farmCount + 1):
+    lines.append(
+      '    <Farm name="Farm %d" id="%d" color="%d" loan="0" money="%d"><Players/></Farm>'
+      % (i, i, i, rng.randint(0, 10000000)))
+  lines.append('  </Farms>')
+  lines.append('</Server>')
+  return "\n".join(lines).encode("utf-8")
+
+
+def build_empty_feed():
+  """The feed which is returned while the host is up but the game is not running"""
+  return b'<?xml version="1.0" encoding="UTF-8" standalone="no" ?>\n<Server/>'
+
+
+def build_players(count, seed=0):
+  rng = random.Random(seed)
+  return [("Player%d" % i, rng.randint(0, 600), rng.random() < 0.1)
+          for i in range(count)]
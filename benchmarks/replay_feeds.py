@@ -0,0 +1,199 @@
+"""
+Replays status feeds which were recorded with FSS_RECORD_DIR through the poller, the player
+comparison and the member log notifications of the bot, and prints every member log message the
+bot would have sent. Recordings of several poll workers are merged by their timestamps.
+Run with: python3 benchmarks/replay_feeds.py recordings --speed 60
+(--speed 0 replays as fast as possible)
+"""
+import argparse
+import asyncio
+import datetime
+import heapq
+import itertools
+import os
+import sys
+import tempfile
+import time
+from urllib.parse import urlsplit
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from bench_cycle import drain
+from fakediscord import FakeDiscordClient
+from feedrecorder import RECORD_FAILURE, RECORD_UNCHANGED, read_recording, recording_files
+
+MEMBER_LOG_CHANNEL = 1
+
+
+class RecordedClock:
+  """A clock which follows the timestamps of the recording instead of the time of the replay"""
+
+  def __init__(self):
+    self.now = 0.0
+
+  def __call__(self):
+    return self.now
+
+
+class ReplayFetcher:
+  """Stands in for the StatusFetcher and answers with the results of the current recorded poll"""
+
+  def __init__(self, health):
+    self.health = health
+    self.poll = None
+    # Hosts which were answered before. The first feed of every host is reported as changed,
+    # since the replay may start in the middle of a recording
+    self.seenHosts = set()
+
+  def forget(self, url):
+    pass
+
+  async def close(self):
+    pass
+
+  async def fetch_all(self, urls):
+    return [self._fetch(url) for url in urls]
+
+  def _fetch(self, url):
+    from hosthealth import FAILURE_CIRCUIT_OPEN
+    from statusfetcher import FetchResult
+
+    host = urlsplit(url).netloc
+    recordType, data = self.poll.results[host]
+    if recordType == RECORD_FAILURE:
+      # Hosts which were skipped did not count as failures either
+      if data != FAILURE_CIRCUIT_OPEN:
+        self.health.record_failure(host, data)
+      return FetchResult(url,
+                         error=ConnectionError("Recorded failure: %s" % data),
+                         failureCategory=data)
+
+    self.health.record_success(host)
+    unchanged = recordType == RECORD_UNCHANGED and host in self.seenHosts
+    self.seenHosts.add(host)
+    if data is None:
+      return FetchResult(url, unchanged=True)
+    return FetchResult(url, data=data, unchanged=unchanged)
+
+
+def recorded_polls(paths):
+  """
+  Yields the polls of the given recording files and directories, oldest first. The shard-N
+  subdirectories which the poll workers write are read as well.
+  """
+  streams = []
+  for path in paths:
+    if not os.path.isdir(path):
+      streams.append(read_recording(path))
+      continue
+    directories = [path] + sorted(
+      os.path.join(path, name) for name in os.listdir(path)
+      if os.path.isdir(os.path.join(path, name)))
+    for directory in directories:
+      files = recording_files(directory)
+      if files:
+        streams.append(
+          itertools.chain.from_iterable(read_recording(file) for file in files))
+  return heapq.merge(*streams, key=lambda poll: poll.timestamp)
+
+
+def track_server(main, identifier):
+  from serverconfiguration import ServerConfiguration
+  from serverstatusinfo import ServerStatus
+
+  ip, _, port = identifier.rpartition(":")
+  serverConfig = ServerConfiguration(ip, port, "replay", "2ECC71", 1)
+  serverConfig.set_member_log_channel(MEMBER_LOG_CHANNEL)
+  main.serverRegistry.add(serverConfig)
+  main.serverStatus[identifier] = ServerStatus(
+    main.serverRegistry.primary(identifier))
+
+
+async def replay(paths, speed=0):
+  """
+  Replays the recordings and returns the member log messages as "timestamp  text" lines, along
+  with the number of replayed polls
+  """
+  import main
+  from hosthealth import HostHealthTracker
+  from statuspoller import StatusPoller
+
+  fakeClient = FakeDiscordClient(latency=0)
+  fakeClient.sentMessages = []
+  main.client = fakeClient
+  main.serverRegistry = main.ServerRegistry()
+  main.serverStatus.clear()
+  main.statusMessages.clear()
+  clock = RecordedClock()
+  health = HostHealthTracker(failureThreshold=main.CIRCUIT_FAILURE_THRESHOLD,
+                             maxBackoff=main.CIRCUIT_MAX_BACKOFF,
+                             clock=clock)
+  fetcher = ReplayFetcher(health)
+  main.statusPoller = StatusPoller(fetcher,
+                                   health,
+                                   main.parseStatusFeed,
+                                   main.OFFLINE_AFTER_TIMEOUTS,
+                                   trackPositions=main.HEATMAPS != "off")
+
+  pollCount = 0
+  messages = []
+  previousTimestamp = None
+  for poll in recorded_polls(paths):
+    if speed > 0 and previousTimestamp is not None:
+      await asyncio.sleep(max(0.0, poll.timestamp - previousTimestamp) / speed)
+    previousTimestamp = poll.timestamp
+    clock.now = poll.timestamp
+    for identifier in poll.results:
+      if identifier not in main.serverStatus:
+        track_server(main, identifier)
+
+    fetcher.poll = poll
+    main.firstStart = pollCount == 0
+    statuses = await main.get_server_status(list(poll.results))
+    main.update_embeds(statuses)
+    await drain(main.discordScheduler)
+
+    recordedAt = datetime.datetime.utcfromtimestamp(
+      poll.timestamp).strftime("%Y-%m-%d %H:%M:%S")
+    for _, content, descriptions in fakeClient.sentMessages:
+      for text in ([content] if content else []) + descriptions:
+        messages.append("%s  %s" % (recordedAt, text))
+    del fakeClient.sentMessages[:]
+    pollCount += 1
+  return messages, pollCount
+
+
+async def run(args):
+  import main
+
+  start = time.perf_counter()
+  messages, pollCount = await replay(args.paths, args.speed)
+  for message in messages:
+    print(message)
+  print("Replayed %d polls of %d servers in %.1f s, %d member log messages" %
+        (pollCount, len(main.serverStatus), time.perf_counter() - start,
+         len(messages)))
+
+
+def parse_args():
+  parser = argparse.ArgumentParser(description=__doc__)
+  parser.add_argument("paths",
+                      nargs="+",
+                      help="recording directories or single recording files")
+  parser.add_argument("--speed",
+                      type=float,
+                      default=0,
+                      help="how many times faster than recorded to replay")
+  return parser.parse_args()
+
+
+if __name__ == "__main__":
+  args = parse_args()
+  workDirectory = tempfile.mkdtemp(prefix="fss-replay-")
+  # Keep the replay away from the real database, history and heatmaps
+  os.environ["FSS_STORAGE_BACKEND"] = "sqlite"
+  os.environ["FSS_SQLITE_PATH"] = os.path.join(workDirectory, "replay.sqlite3")
+  os.environ["FSS_HISTORY_DIR"] = os.path.join(workDirectory, "history")
+  os.environ["FSS_HEATMAP_DIR"] = os.path.join(workDirectory, "heatmaps")
+  os.environ["FSS_RECORD_DIR"] = ""
+  asyncio.get_event_loop().run_until_complete(run(args))
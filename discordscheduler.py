@@ -0,0 +1,206 @@
+import asyncio
+import heapq
+import itertools
+import re
+import time
+import traceback
+import discord
+from metrics import DISCORD_REQUESTS, DISCORD_REQUEST_SECONDS, DISCORD_RATE_LIMITS
+
+# Lower values are sent first
+PRIORITY_MEMBER_LOG = 0
+PRIORITY_EMBED = 1
+PRIORITY_RENAME = 2
+
+# The amount of seconds to wait after a 429 response which did not say how long to wait
+DEFAULT_RETRY_AFTER = 5.0
+
+
+def message_send_route(channelId):
+  return "POST /channels/%s/messages" % channelId
+
+
+def message_edit_route(channelId):
+  return "PATCH /channels/%s/messages" % channelId
+
+
+def channel_edit_route(channelId):
+  return "PATCH /channels/%s" % channelId
+
+
+def route_template(route):
+  """The route without its IDs, like discord documents it. Metrics are labelled with this"""
+  return re.sub(r"/channels/\d+", "/channels/{channel_id}", route)
+
+
+class _WriteJob:
+  """
+  A single pending write request
+  """
+
+  def __init__(self, route, priority, sequence, action, key):
+    self.route = route
+    self.priority = priority
+    self.sequence = sequence
+    self.action = action
+    self.key = key
+
+  def __lt__(self, other):
+    return (self.priority, self.sequence) < (other.priority, other.sequence)
+
+
+class _PriorityGate:
+  """
+  Limits the number of concurrent requests. When a slot becomes free, the waiting request with
+  the highest priority gets it.
+  """
+
+  def __init__(self, limit):
+    self.available = limit
+    self.waiters = []
+
+  async def acquire(self, job):
+    if self.available > 0 and not self.waiters:
+      self.available -= 1
+      return
+    future = asyncio.get_event_loop().create_future()
+    heapq.heappush(self.waiters, (job.priority, job.sequence, future))
+    await future
+
+  def release(self):
+    while self.waiters:
+      _, _, future = heapq.heappop(self.waiters)
+      if not future.done():
+        # Hand the slot over directly
+        future.set_result(None)
+        return
+    self.available += 1
+
+
+class DiscordWriteScheduler:
+  """
+  Sends all write requests to discord. Every route (like "edit messages in channel X") has its
+  own queue which is processed in priority order, so a rate limit on one route does not delay
+  the others. If several updates for the same target are pending, only the latest one is sent.
+  While paused, requests are only queued, e.g. while the bot is disconnected from discord.
+  """
+
+  def __init__(self, maxConcurrentRequests=4):
+    self.gate = _PriorityGate(maxConcurrentRequests)
+    self.sequence = itertools.count()
+    # Route => heap of pending jobs
+    self.queues = {}
+    # Route => task which processes the queue of that route
+    self.workers = {}
+    # Target key => pending job for that target
+    self.jobsByKey = {}
+    # Route => time.monotonic() value before which the route must not be used
+    self.routeAvailableAt = {}
+    self.paused = False
+    # Futures of the routes which wait for resume()
+    self.resumeWaiters = []
+
+  def submit(self, route, priority, action, key=None):
+    """
+    Queues a write request. action must be a callable which returns an awaitable, e.g.
+    functools.partial(channel.send, embed=embed). If key is set, any pending request with
+    the same key is replaced by this one.
+    """
+    pendingJob = self.jobsByKey.get(key) if key is not None else None
+    if pendingJob is not None:
+      pendingJob.action = action
+      return
+
+    job = _WriteJob(route, priority, next(self.sequence), action, key)
+    heapq.heappush(self.queues.setdefault(route, []), job)
+    if key is not None:
+      self.jobsByKey[key] = job
+    if route not in self.workers:
+      self.workers[route] = asyncio.ensure_future(self._process_route(route))
+
+  def pending_count(self):
+    return sum(len(queue) for queue in self.queues.values())
+
+  def pause(self):
+    self.paused = True
+
+  def resume(self):
+    """Sends the requests which were queued while paused"""
+    self.paused = False
+    for future in self.resumeWaiters:
+      if not future.done():
+        future.set_result(None)
+    self.resumeWaiters = []
+
+  async def _wait_until_resumed(self):
+    while self.paused:
+      future = asyncio.get_event_loop().create_future()
+      self.resumeWaiters.append(future)
+      await future
+
+  async def _process_route(self, route):
+    queue = self.queues[route]
+    try:
+      while queue:
+        # Wait until a previous rate limit on this route has expired
+        delay = self.routeAvailableAt.get(route, 0) - time.monotonic()
+        if delay > 0:
+          await asyncio.sleep(delay)
+        await self._wait_until_resumed()
+
+        await self.gate.acquire(queue[0])
+        try:
+          # A more important job might have been queued while waiting
+          job = heapq.heappop(queue)
+          if job.key is not None:
+            del self.jobsByKey[job.key]
+          await self._send(job, queue)
+        finally:
+          self.gate.release()
+    finally:
+      del self.workers[route]
+      if not queue:
+        del self.queues[route]
+
+  async def _send(self, job, queue):
+    template = route_template(job.route)
+    try:
+      with DISCORD_REQUEST_SECONDS.time(template):
+        await job.action()
+      DISCORD_REQUESTS.inc(template, "ok")
+    except discord.HTTPException as e:
+      if e.status != 429:
+        DISCORD_REQUESTS.inc(template, "error")
+        print("WARN: Request on %s failed: %s" % (job.route, e))
+        return
+
+      DISCORD_REQUESTS.inc(template, "rate_limited")
+      DISCORD_RATE_LIMITS.inc(template)
+      retryAfter = _retry_after(e)
+      print("WARN: Rate limited on %s, retrying in %.1f seconds" %
+            (job.route, retryAfter))
+      self.routeAvailableAt[job.route] = time.monotonic() + retryAfter
+      # Try again later
+      self._requeue(job, queue)
+    except Exception:
+      DISCORD_REQUESTS.inc(template, "error")
+      if self.paused:
+        # The connection was closed while sending. Send it again once it is back
+        self._requeue(job, queue)
+        return
+      print("WARN: Request on %s failed: %s" %
+            (job.route, traceback.format_exc()))
+
+  def _requeue(self, job, queue):
+    # Unless a newer update for the same target has been queued meanwhile
+    if job.key is None or job.key not in self.jobsByKey:
+      heapq.heappush(queue, job)
+      if job.key is not None:
+        self.jobsByKey[job.key] = job
+
+
+def _retry_after(httpException):
+  try:
+    return float(httpException.response.headers["Retry-After"])
+  except Exception:
+    return DEFAULT_RETRY_AFTER
@@ -0,0 +1,99 @@
+import numpy as np
+
+
+class FarmStats:
+  """
+  Summarizes the vehicles of a server per farm. Rows are farms, sorted by their ID, columns are
+  vehicle categories and fill types
+  """
+  __slots__ = ("farmIds", "farmNames", "money", "categories", "vehicleCounts",
+               "fillTypes", "fillLevels", "unownedVehicles")
+
+  def __init__(self, farmIds, farmNames, money, categories, vehicleCounts,
+               fillTypes, fillLevels, unownedVehicles):
+    self.farmIds = farmIds
+    self.farmNames = farmNames
+    self.money = money
+    self.categories = categories
+    # Farm => category => number of vehicles
+    self.vehicleCounts = vehicleCounts
+    self.fillTypes = fillTypes
+    # Farm => fill type => sum of the fill levels of all vehicles of the farm
+    self.fillLevels = fillLevels
+    # Vehicles which do not belong to any of the farms, e.g. the ones for sale
+    self.unownedVehicles = unownedVehicles
+
+  def farm_vehicle_counts(self):
+    return self.vehicleCounts.sum(axis=1)
+
+  def fleet(self):
+    """Returns the number of vehicles per category over all farms"""
+    return self.vehicleCounts.sum(axis=0)
+
+  def fill_totals(self):
+    """Returns the sum of the fill levels per fill type over all farms"""
+    return self.fillLevels.sum(axis=0)
+
+  def to_json(self):
+    return {
+      "farms": [[int(farmId), name, int(money)] for farmId, name, money in zip(
+        self.farmIds, self.farmNames, self.money)],
+      "categories": list(self.categories),
+      "vehicleCounts": self.vehicleCounts.tolist(),
+      "fillTypes": list(self.fillTypes),
+      "fillLevels": np.round(self.fillLevels).astype(np.int64).tolist(),
+      "unownedVehicles": self.unownedVehicles
+    }
+
+  @staticmethod
+  def from_json(j):
+    farms = j["farms"]
+    categories = j["categories"]
+    fillTypes = j["fillTypes"]
+    return FarmStats(
+      np.array([farm[0] for farm in farms], dtype=np.int64),
+      [farm[1] for farm in farms],
+      np.array([farm[2] for farm in farms], dtype=np.int64), categories,
+      np.array(j["vehicleCounts"], dtype=np.int64).reshape(
+        len(farms), len(categories)), fillTypes,
+      np.array(j["fillLevels"], dtype=np.float64).reshape(
+        len(farms), len(fillTypes)), j["unownedVehicles"])
+
+
+def _group_by_farm(farmIds, ownerIds, labels, weights=None):
+  """
+  Sums up the weights (or counts) per farm and label in a single pass. Returns the distinct
+  labels, the farm x label matrix and the number of entries which belong to no farm
+  """
+  distinctLabels, labelIndexes = np.unique(np.asarray(labels, dtype=str),
+                                           return_inverse=True)
+  ownerIds = np.asarray(ownerIds, dtype=np.int64)
+  farmIndexes = np.searchsorted(farmIds, ownerIds)
+  owned = farmIndexes < len(farmIds)
+  owned[owned] = farmIds[farmIndexes[owned]] == ownerIds[owned]
+
+  cells = farmIndexes[owned] * len(distinctLabels) + labelIndexes.reshape(-1)[owned]
+  sums = np.bincount(cells,
+                     weights=None if weights is None else weights[owned],
+                     minlength=len(farmIds) * len(distinctLabels))
+  return (distinctLabels.tolist(),
+          sums.reshape(len(farmIds), len(distinctLabels)),
+          int(len(ownerIds) - owned.sum()))
+
+
+def compute_farm_stats(vehicles, farms):
+  """Builds the FarmStats from the VehicleColumns and Farm attributes of a status feed"""
+  farms = sorted(farms, key=lambda farm: int(farm.get("id", 0)))
+  farmIds = np.array([int(farm.get("id", 0)) for farm in farms],
+                     dtype=np.int64)
+  money = np.array([float(farm.get("money", 0)) for farm in farms],
+                   dtype=np.float64).astype(np.int64)
+
+  categories, vehicleCounts, unownedVehicles = _group_by_farm(
+    farmIds, vehicles.farmIds, vehicles.categories)
+  fillTypes, fillLevels, _ = _group_by_farm(
+    farmIds, vehicles.fillFarmIds, vehicles.fillTypes,
+    np.asarray(vehicles.fillLevels, dtype=np.float64))
+  return FarmStats(farmIds, [farm.get("name", "") for farm in farms], money,
+                   categories, vehicleCounts.astype(np.int64), fillTypes,
+                   fillLevels, unownedVehicles)
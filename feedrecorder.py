@@ -0,0 +1,168 @@
+"""
+Records the raw responses of the polled servers, so problems can be reproduced later by
+replaying them (see benchmarks/replay_feeds.py).
+
+A recording is a directory of files, each a series of gzip members which together hold a stream
+of records. Every poll appends one member, so a crash loses at most the poll which was being
+written. A payload is only stored the first time it shows up in a file; the results of the
+servers refer to it by its hash.
+"""
+import concurrent.futures
+import datetime
+import gzip
+import hashlib
+import os
+import struct
+import traceback
+
+# The start of a poll. Every following record up to the next one belongs to it
+RECORD_POLL = 0
+# Stores a payload which shows up for the first time in this file: SHA-1 hash + feed
+RECORD_PAYLOAD = 1
+# The server returned a feed which differs from its previous one: SHA-1 hash
+RECORD_CHANGED = 2
+# The feed did not change since the previous poll of the server: SHA-1 hash, or nothing if the
+# server only confirmed that it did not change
+RECORD_UNCHANGED = 3
+# The request failed: the failure category
+RECORD_FAILURE = 4
+
+# Type, unix timestamp, identifier length, body length
+HEADER = struct.Struct(">BdHI")
+HASH_SIZE = 20
+
+
+class FeedRecorder:
+  """
+  Appends the fetch results of every poll to a compressed log, which is rotated once a file
+  gets too large. Compressing and writing happens in a background thread, in order.
+  """
+
+  def __init__(self, directory, maxFileSize=64 * 1024 * 1024, maxFiles=20):
+    self.directory = directory
+    self.maxFileSize = maxFileSize
+    # The oldest files are deleted once there are more than this many
+    self.maxFiles = maxFiles
+    self.path = None
+    # Hashes of the payloads which are stored in the current file
+    self.storedHashes = set()
+    self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=1)
+
+  def record_poll(self, timestamp, identifiers, fetchResults):
+    """Queues the results of a poll, in the same order as the identifiers"""
+    entries = [(identifier, fetchResult.unchanged, fetchResult.data,
+                fetchResult.failureCategory)
+               for identifier, fetchResult in zip(identifiers, fetchResults)]
+    self.executor.submit(self._write, timestamp, entries)
+
+  def close(self):
+    """Waits until everything was written"""
+    self.executor.shutdown(wait=True)
+
+  def _write(self, timestamp, entries):
+    try:
+      # The file is missing if the first write to it failed
+      if (self.path is None or not os.path.exists(self.path)
+          or os.path.getsize(self.path) > self.maxFileSize):
+        self._rotate()
+
+      records = [_record(RECORD_POLL, timestamp, "", b"")]
+      newHashes = set()
+      for identifier, unchanged, data, failureCategory in entries:
+        if failureCategory is not None or (data is None and not unchanged):
+          records.append(
+            _record(RECORD_FAILURE, timestamp, identifier,
+                    (failureCategory or "").encode("utf-8")))
+        elif data is None:
+          records.append(_record(RECORD_UNCHANGED, timestamp, identifier, b""))
+        else:
+          hash = hashlib.sha1(data).digest()
+          # Unchanged feeds are stored as well, so every file can be replayed on its own
+          if hash not in self.storedHashes and hash not in newHashes:
+            newHashes.add(hash)
+            records.append(_record(RECORD_PAYLOAD, timestamp, "", hash + data))
+          records.append(
+            _record(RECORD_UNCHANGED if unchanged else RECORD_CHANGED,
+                    timestamp, identifier, hash))
+
+      # Appending opens a new gzip member, readers see one continuous stream
+      with gzip.open(self.path, "ab", compresslevel=6) as f:
+        f.write(b"".join(records))
+      self.storedHashes.update(newHashes)
+    except Exception:
+      print("WARN: Could not record the feeds: %s" % traceback.format_exc())
+      # Continue in a new file, a partly written one cannot be appended to
+      self.path = None
+
+  def _rotate(self):
+    os.makedirs(self.directory, exist_ok=True)
+    self.path = os.path.join(
+      self.directory, "feeds-%s.gz" %
+      datetime.datetime.utcnow().strftime("%Y%m%d-%H%M%S-%f"))
+    self.storedHashes = set()
+    # Make room for the new file
+    files = recording_files(self.directory)
+    for path in files[:max(0, len(files) - self.maxFiles + 1)]:
+      os.remove(path)
+
+
+def _record(recordType, timestamp, identifier, body):
+  identifierBytes = identifier.encode("utf-8")
+  return HEADER.pack(recordType, timestamp, len(identifierBytes),
+                     len(body)) + identifierBytes + body
+
+
+def recording_files(directory):
+  """Returns the files of a recording, oldest first"""
+  if not os.path.isdir(directory):
+    return []
+  return sorted(
+    os.path.join(directory, name) for name in os.listdir(directory)
+    if name.startswith("feeds-") and name.endswith(".gz"))
+
+
+class RecordedPoll:
+  """
+  The results of a single recorded poll. results maps server identifiers to (record type, data)
+  where data is the feed (None if it is unknown) or the failure category for failures
+  """
+
+  def __init__(self, timestamp):
+    self.timestamp = timestamp
+    self.results = {}
+
+
+def read_recording(path):
+  """
+  Yields the RecordedPoll objects of a recording file in order. If the file was cut off while it
+  was being written, the incomplete poll is left out.
+  """
+  payloads = {}
+  poll = None
+  with gzip.open(path, "rb") as f:
+    while True:
+      try:
+        header = f.read(HEADER.size)
+        if not header:
+          break
+        recordType, timestamp, identifierLength, bodyLength = HEADER.unpack(
+          header)
+        identifier = f.read(identifierLength).decode("utf-8")
+        body = f.read(bodyLength)
+        if len(body) < bodyLength:
+          return
+      except (EOFError, OSError, struct.error):
+        return
+
+      if recordType == RECORD_POLL:
+        if poll is not None:
+          yield poll
+        poll = RecordedPoll(timestamp)
+      elif recordType == RECORD_PAYLOAD:
+        payloads[body[:HASH_SIZE]] = body[HASH_SIZE:]
+      elif recordType in (RECORD_CHANGED, RECORD_UNCHANGED):
+        poll.results[identifier] = (recordType, payloads.get(body))
+      elif recordType == RECORD_FAILURE:
+        poll.results[identifier] = (RECORD_FAILURE, body.decode("utf-8"))
+  if poll is not None:
+    yield poll
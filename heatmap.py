@@ -0,0 +1,199 @@
+import os
+import re
+import struct
+import zlib
+import numpy as np
+
+# The number of cells along each side of the map
+GRID_SIZE = 128
+# Every cell is drawn as a square of this many pixels
+PIXELS_PER_CELL = 4
+# The image is only rendered again once this fraction of all positions was added since
+RERENDER_FRACTION = 0.02
+
+# Colors from no activity to the most activity
+PALETTE = np.array([(0, 0, 0), (30, 40, 140), (200, 30, 30), (250, 200, 40),
+                    (255, 255, 255)],
+                   dtype=np.float64)
+
+
+def bin_positions(xs, zs, mapSize, gridSize=GRID_SIZE):
+  """
+  Returns the flat grid indexes of the cells which contain the given coordinates. Coordinates
+  are relative to the center of the map, positions outside of the map are dropped.
+  """
+  xs = np.asarray(xs, dtype=np.float64)
+  zs = np.asarray(zs, dtype=np.float64)
+  columns = np.floor((xs / mapSize + 0.5) * gridSize)
+  rows = np.floor((zs / mapSize + 0.5) * gridSize)
+  inside = (columns >= 0) & (columns < gridSize) & (rows >= 0) & (rows <
+                                                                    gridSize)
+  return (rows[inside] * gridSize + columns[inside]).astype(np.int32)
+
+
+def moved_cells(previousCells, cells, gridSize=GRID_SIZE):
+  """
+  Returns the cells which contain more vehicles than in the previous poll, once per additional
+  vehicle. Parked vehicles would outshine everything else otherwise.
+  """
+  if previousCells is None:
+    return np.zeros(0, dtype=np.int32)
+  gained = np.bincount(cells, minlength=gridSize * gridSize) - np.bincount(
+    previousCells, minlength=gridSize * gridSize)
+  gainedCells = np.flatnonzero(gained > 0)
+  return np.repeat(gainedCells, gained[gainedCells]).astype(np.int32)
+
+
+def encode_png(pixels):
+  """Encodes an RGB image given as a (height, width, 3) uint8 array"""
+  height, width, _ = pixels.shape
+  # Every row starts with the filter type, 0 means none
+  rows = np.zeros((height, width * 3 + 1), dtype=np.uint8)
+  rows[:, 1:] = pixels.reshape(height, width * 3)
+
+  def chunk(chunkType, data):
+    return struct.pack(">I", len(data)) + chunkType + data + struct.pack(
+      ">I", zlib.crc32(chunkType + data) & 0xffffffff)
+
+  return b"\x89PNG\r\n\x1a\n" + chunk(
+    b"IHDR", struct.pack(">IIBBBBB", width, height, 8, 2, 0, 0, 0)) + chunk(
+      b"IDAT", zlib.compress(rows.tobytes(), 6)) + chunk(b"IEND", b"")
+
+
+class Heatmap:
+  """
+  Counts how often players and moving vehicles were seen in each cell of a fixed grid over the
+  map of a server. Takes the same amount of memory no matter how many polls were added.
+  """
+
+  def __init__(self, mapName, gridSize=GRID_SIZE):
+    self.mapName = mapName
+    self.grid = np.zeros(gridSize * gridSize, dtype=np.uint32)
+    self.total = 0
+    # Positions which were added since the image was rendered
+    self.addedSinceRender = 0
+    self.png = None
+    # True if the grid changed since it was saved
+    self.unsaved = False
+
+  def add(self, cells):
+    if len(cells) == 0:
+      return
+    self.grid += np.bincount(cells,
+                             minlength=len(self.grid)).astype(np.uint32)
+    self.total += len(cells)
+    self.addedSinceRender += len(cells)
+    self.unsaved = True
+
+  def render(self):
+    """Returns the heatmap as a PNG image, which is cached until enough positions were added"""
+    if self.png is None or self.addedSinceRender > RERENDER_FRACTION * self.total:
+      self.png = self._render()
+      self.addedSinceRender = 0
+    return self.png
+
+  def _render(self):
+    gridSize = int(np.sqrt(len(self.grid)))
+    # A logarithmic scale keeps quiet places visible next to the farm yards
+    intensity = np.log1p(self.grid.astype(np.float64))
+    if intensity.max() > 0:
+      intensity /= intensity.max()
+    stops = np.linspace(0, 1, len(PALETTE))
+    pixels = np.stack(
+      [np.interp(intensity, stops, PALETTE[:, channel]) for channel in range(3)],
+      axis=-1).astype(np.uint8).reshape(gridSize, gridSize, 3)
+    pixels = np.repeat(np.repeat(pixels, PIXELS_PER_CELL, axis=0),
+                       PIXELS_PER_CELL,
+                       axis=1)
+    return encode_png(pixels)
+
+
+class HeatmapStore:
+  """
+  Keeps the heatmap of every server, and stores them in a directory, one file per server
+  """
+
+  def __init__(self, directory, gridSize=GRID_SIZE):
+    self.directory = directory
+    self.gridSize = gridSize
+    # Server identifier => Heatmap
+    self.heatmaps = {}
+    # Server identifier => [(map name, cells)] which arrived while its stored heatmap was read
+    self.pendingCells = {}
+
+  def _path(self, identifier):
+    return os.path.join(self.directory,
+                        re.sub(r"[^\w.-]", "_", identifier) + ".npz")
+
+  def _stored(self, identifier):
+    return self.directory and os.path.exists(self._path(identifier))
+
+  def read(self, identifier):
+    """Returns the stored heatmap of a server, or None. Can be called from a thread"""
+    if not self._stored(identifier):
+      return None
+    with np.load(self._path(identifier)) as stored:
+      heatmap = Heatmap(str(stored["mapName"]), self.gridSize)
+      if len(stored["grid"]) == len(heatmap.grid):
+        heatmap.grid = stored["grid"].astype(np.uint32)
+        heatmap.total = int(heatmap.grid.sum())
+    return heatmap
+
+  def get(self, identifier):
+    """Returns the heatmap of a server, or None if nothing was recorded for it yet"""
+    heatmap = self.heatmaps.get(identifier)
+    if heatmap is None:
+      heatmap = self.read(identifier)
+      if heatmap is not None:
+        # May be read in a background thread while the event loop adds positions
+        heatmap = self.heatmaps.setdefault(identifier, heatmap)
+    return heatmap
+
+  def add(self, identifier, mapName, cells):
+    """
+    Adds positions to the heatmap of a server. Returns True if its stored heatmap needs to be
+    read first, which the caller does in the background and passes to finish_loading(). The
+    positions are added then
+    """
+    if identifier in self.pendingCells or (identifier not in self.heatmaps
+                                           and self._stored(identifier)):
+      pending = self.pendingCells.setdefault(identifier, [])
+      pending.append((mapName, cells))
+      return len(pending) == 1
+    self._add(identifier, mapName, cells)
+    return False
+
+  def _add(self, identifier, mapName, cells):
+    heatmap = self.heatmaps.get(identifier)
+    # Positions on different maps can't be compared
+    if heatmap is None or heatmap.mapName != mapName:
+      heatmap = self.heatmaps[identifier] = Heatmap(mapName, self.gridSize)
+    heatmap.add(cells)
+
+  def finish_loading(self, identifier, heatmap):
+    """Keeps the heatmap which read() returned, and adds the positions which arrived meanwhile"""
+    if identifier not in self.pendingCells:
+      # The server was removed meanwhile
+      return
+    if heatmap is not None:
+      self.heatmaps.setdefault(identifier, heatmap)
+    for mapName, cells in self.pendingCells.pop(identifier):
+      self._add(identifier, mapName, cells)
+
+  def remove(self, identifier):
+    self.heatmaps.pop(identifier, None)
+    self.pendingCells.pop(identifier, None)
+    if self.directory and os.path.exists(self._path(identifier)):
+      os.remove(self._path(identifier))
+
+  def save(self):
+    """Writes the heatmaps which changed. Can be called from a thread"""
+    if not self.directory:
+      return
+    os.makedirs(self.directory, exist_ok=True)
+    for identifier, heatmap in list(self.heatmaps.items()):
+      if heatmap.unsaved:
+        heatmap.unsaved = False
+        np.savez(self._path(identifier),
+                 grid=heatmap.grid.copy(),
+                 mapName=np.array(heatmap.mapName))
@@ -0,0 +1,150 @@
+import asyncio
+import socket
+import time
+import aiohttp
+
+# Why a request to a host failed
+FAILURE_DNS = "dns"
+FAILURE_REFUSED = "refused"
+FAILURE_CONNECT_TIMEOUT = "connect_timeout"
+FAILURE_READ_TIMEOUT = "read_timeout"
+FAILURE_CONNECTION = "connection"
+FAILURE_CIRCUIT_OPEN = "circuit_open"
+FAILURE_OTHER = "other"
+
+# Timeouts might be caused by a single slow response, everything else means the host is down
+TIMEOUT_FAILURES = (FAILURE_CONNECT_TIMEOUT, FAILURE_READ_TIMEOUT)
+
+FAILURE_DESCRIPTIONS = {
+  FAILURE_DNS: "host name could not be resolved",
+  FAILURE_REFUSED: "connection refused",
+  FAILURE_CONNECT_TIMEOUT: "connection timed out",
+  FAILURE_READ_TIMEOUT: "no response",
+  FAILURE_CONNECTION: "connection failed",
+  FAILURE_CIRCUIT_OPEN: "host unreachable",
+  FAILURE_OTHER: "request failed",
+}
+
+STATE_CLOSED = "closed"
+STATE_OPEN = "open"
+STATE_HALF_OPEN = "half_open"
+
+
+class CircuitOpenError(Exception):
+  """Raised instead of sending a request to a host which is known to be down"""
+
+
+def classify_failure(error):
+  """Finds out why a request failed, based on the exception aiohttp raised"""
+  if isinstance(error, CircuitOpenError):
+    return FAILURE_CIRCUIT_OPEN
+  if isinstance(error, aiohttp.ServerTimeoutError):
+    # Newer aiohttp versions have separate exception types, older ones only differ in the message
+    connectionTimeoutError = getattr(aiohttp, "ConnectionTimeoutError", None)
+    if connectionTimeoutError is not None and isinstance(
+        error, connectionTimeoutError):
+      return FAILURE_CONNECT_TIMEOUT
+    if str(error).startswith("Connection timeout"):
+      return FAILURE_CONNECT_TIMEOUT
+    return FAILURE_READ_TIMEOUT
+  if isinstance(error, asyncio.TimeoutError):
+    return FAILURE_READ_TIMEOUT
+  if isinstance(error, aiohttp.ClientConnectorError):
+    if isinstance(error.os_error, socket.gaierror):
+      return FAILURE_DNS
+    if isinstance(error.os_error, ConnectionRefusedError):
+      return FAILURE_REFUSED
+    return FAILURE_CONNECTION
+  if isinstance(error, (aiohttp.ClientConnectionError, OSError)):
+    return FAILURE_CONNECTION
+  return FAILURE_OTHER
+
+
+class _HostState:
+
+  def __init__(self):
+    self.state = STATE_CLOSED
+    self.consecutiveFailures = 0
+    self.lastFailure = None
+    self.openedCount = 0
+    self.probeAt = 0.0
+
+
+class HostHealthTracker:
+  """
+  Keeps track of the health of every host and acts as a circuit breaker: After a number of
+  failed requests in a row, no more requests are sent to a host until a backoff time has passed.
+  Then a single probe request is allowed. If it succeeds, the host is considered healthy again,
+  otherwise the backoff time is doubled.
+  """
+
+  def __init__(self,
+               failureThreshold=3,
+               baseBackoff=60,
+               maxBackoff=900,
+               clock=time.monotonic):
+    self.failureThreshold = failureThreshold
+    self.baseBackoff = baseBackoff
+    self.maxBackoff = maxBackoff
+    self.clock = clock
+    self.hosts = {}
+
+  def _host(self, host):
+    hostState = self.hosts.get(host)
+    if hostState is None:
+      hostState = _HostState()
+      self.hosts[host] = hostState
+    return hostState
+
+  def allow_request(self, host):
+    """Returns False if the circuit of the host is open and no probe is due yet"""
+    hostState = self._host(host)
+    if hostState.state == STATE_CLOSED:
+      return True
+    if hostState.state == STATE_OPEN and self.clock() >= hostState.probeAt:
+      # Let a single probe through
+      hostState.state = STATE_HALF_OPEN
+      return True
+    return False
+
+  def record_success(self, host):
+    hostState = self._host(host)
+    if hostState.state != STATE_CLOSED:
+      print("INFO: %s is reachable again" % host)
+    hostState.state = STATE_CLOSED
+    hostState.consecutiveFailures = 0
+    hostState.lastFailure = None
+    hostState.openedCount = 0
+
+  def record_failure(self, host, category):
+    hostState = self._host(host)
+    hostState.consecutiveFailures += 1
+    hostState.lastFailure = category
+    if hostState.state == STATE_HALF_OPEN or hostState.consecutiveFailures >= self.failureThreshold:
+      backoff = min(self.baseBackoff * 2**hostState.openedCount,
+                    self.maxBackoff)
+      if hostState.state != STATE_OPEN:
+        print("INFO: %s is unreachable (%s), next probe in %d seconds" %
+              (host, category, backoff))
+      hostState.state = STATE_OPEN
+      hostState.openedCount += 1
+      hostState.probeAt = self.clock() + backoff
+
+  def consecutive_failures(self, host):
+    return self._host(host).consecutiveFailures
+
+  def last_failure(self, host):
+    return self._host(host).lastFailure
+
+  def seconds_until_probe(self, host):
+    """Returns the time until the next probe is allowed, or None if the circuit is closed"""
+    hostState = self._host(host)
+    if hostState.state != STATE_OPEN:
+      return None
+    return max(0.0, hostState.probeAt - self.clock())
+
+  def snapshot(self):
+    """Returns a list of (host, state, consecutive failures, last failure category)"""
+    return [(host, hostState.state, hostState.consecutiveFailures,
+             hostState.lastFailure)
+            for host, hostState in self.hosts.items()]
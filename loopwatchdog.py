@@ -0,0 +1,117 @@
+import asyncio
+import collections
+import os
+import sys
+import threading
+import time
+import traceback
+from metrics import registry
+
+EVENT_LOOP_STALLS = registry.counter(
+  "fss_event_loop_stalls_total",
+  "Times the event loop did not tick for longer than the stall threshold")
+
+
+class StallReport:
+  """
+  Describes a single stall of the event loop, and what the loop was doing at that time
+  """
+
+  def __init__(self, detectedAt, stack):
+    self.detectedAt = detectedAt
+    self.stack = stack
+    # Updated once the loop ticks again
+    self.duration = None
+
+
+class LoopWatchdog:
+  """
+  Detects when the event loop does not tick for longer than a threshold. A coroutine updates a
+  timestamp regularly, and a background thread captures the stack of the event loop thread if
+  that timestamp gets too old.
+  """
+
+  def __init__(self, threshold=1.0, tickInterval=0.1, maxReports=20):
+    self.threshold = threshold
+    self.tickInterval = tickInterval
+    self.reports = collections.deque(maxlen=maxReports)
+    self.loopThreadId = None
+    self.lastTick = time.monotonic()
+    self.currentStall = None
+    self.thread = None
+
+  async def run(self):
+    """Ticks on the event loop and starts the watching thread"""
+    self.loopThreadId = threading.get_ident()
+    self.lastTick = time.monotonic()
+    if self.thread is None:
+      self.thread = threading.Thread(target=self._watch, daemon=True)
+      self.thread.start()
+    while True:
+      await asyncio.sleep(self.tickInterval)
+      now = time.monotonic()
+      stall = self.currentStall
+      if stall is not None:
+        stall.duration = now - self.lastTick
+        print("WARN: The event loop was blocked for %.1f seconds" %
+              stall.duration)
+        self.currentStall = None
+      self.lastTick = now
+
+  def _watch(self):
+    while True:
+      time.sleep(self.threshold / 2)
+      blockedFor = time.monotonic() - self.lastTick
+      if blockedFor <= self.threshold or self.currentStall is not None:
+        continue
+      frame = sys._current_frames().get(self.loopThreadId)
+      if frame is None:
+        continue
+      stack = "".join(traceback.format_stack(frame))
+      stall = StallReport(time.time(), stack)
+      self.reports.append(stall)
+      self.currentStall = stall
+      EVENT_LOOP_STALLS.inc()
+      print("WARN: The event loop has been blocked for %.1f seconds in:\n%s" %
+            (blockedFor, stack))
+
+
+def _frame_label(frame):
+  return "%s:%d %s" % (os.path.basename(frame.f_code.co_filename),
+                       frame.f_lineno, frame.f_code.co_name)
+
+
+def sample_profile(threadId, duration, interval=0.005, top=15):
+  """
+  Samples the stack of the given thread for the given number of seconds and returns a summary
+  of the hottest frames. Meant to be run in a background thread.
+  """
+  ownTime = collections.Counter()
+  totalTime = collections.Counter()
+  samples = 0
+  end = time.monotonic() + duration
+  while time.monotonic() < end:
+    frame = sys._current_frames().get(threadId)
+    if frame is not None:
+      samples += 1
+      ownTime[_frame_label(frame)] += 1
+      seen = set()
+      while frame is not None:
+        # Count each function only once per sample, even when it is recursive
+        label = "%s %s" % (os.path.basename(
+          frame.f_code.co_filename), frame.f_code.co_name)
+        if label not in seen:
+          seen.add(label)
+          totalTime[label] += 1
+        frame = frame.f_back
+    time.sleep(interval)
+
+  if samples == 0:
+    return "No samples collected"
+  lines = ["%d samples over %g seconds" % (samples, duration), "", "Own time:"]
+  lines.extend("%5.1f%%  %s" % (100.0 * count / samples, label)
+               for label, count in ownTime.most_common(top))
+  lines.extend(["", "Total time:"])
+  lines.extend("%5.1f%%  %s" % (100.0 * count / samples, label)
+               for label, count in totalTime.most_common(top))
+  return "\n".join(lines)
@@ -1,16 +1,45 @@
 import os
 import discord
-import urllib3
-import xmltodict
 import asyncio
 import datetime
+import functools
+import hashlib
+import inspect
+import io
+import ipaddress
+import json
+import socket
+import threading
 import traceback
 import time
 from serverconfiguration import ServerConfiguration
+from serverregistry import ServerRegistry
 from serverstatusinfo import ServerStatus, PlayerStatus
-from replit import db
+from statusfetcher import StatusFetcher
+from hosthealth import HostHealthTracker
+from statusparser import parse_status_feed, parse_status_feed_xmltodict
+from statuspoller import StatusPoller
+from feedrecorder import FeedRecorder
+from shardedpoller import ShardedPoller
+from memberlog import MemberLogBatcher, MAX_CHARACTERS_PER_MESSAGE
+from modlist import ModList, ModListCache, diff_mods, describe_mod_changes
+from statusembed import StatusEmbedTracker, render_status_description, embed_fingerprint, \
+  dashboard_fingerprint, fit_descriptions
+from statusquery import StatusQueryCache
+from discordscheduler import DiscordWriteScheduler, PRIORITY_MEMBER_LOG, PRIORITY_EMBED, PRIORITY_RENAME, \
+  message_send_route, message_edit_route, channel_edit_route
+from playerhistory import PlayerHistory
+from heatmap import HeatmapStore
+from playtime import PlaytimeLedger, PERIOD_DAY, PERIOD_WEEK, PERIOD_ALL
+from pollscheduler import PollPolicy, PollScheduler
+from metrics import CYCLE_SECONDS, measure_event_loop_lag, start_metrics_server
+from loopwatchdog import LoopWatchdog, sample_profile
+from persistence import WriteBehindStore, create_backend
 from discord import app_commands
 
+# Used to report how long it took until the embeds were first updated
+PROCESS_START_TIME = time.monotonic()
+
 # Create a discord client to allow interacting with a discord server
 intents = discord.Intents.default()
 intents.message_content = True
@@ -18,13 +47,260 @@ client = discord.Client(intents=intents)
 tree = app_commands.CommandTree(client)
 firstStart = True
 
-MY_GUILD = 1012809878701613157
+# The guild the bot was originally made for. Servers which were added before the bot supported
+# several guilds belong to it
+LEGACY_GUILD_ID = 1012809878701613157
+
+# The maximum number of FS22 servers which get polled at the same time (per worker, see below)
+MAX_CONCURRENT_POLLS = int(os.environ.get("FSS_MAX_CONCURRENT_POLLS", "10"))
+CONNECT_TIMEOUT = float(os.environ.get("FSS_CONNECT_TIMEOUT", "2"))
+READ_TIMEOUT = float(os.environ.get("FSS_READ_TIMEOUT", "3"))
+# Hosts which fail this many times in a row are only probed occasionally until they recover
+CIRCUIT_FAILURE_THRESHOLD = int(
+  os.environ.get("FSS_CIRCUIT_FAILURE_THRESHOLD", "3"))
+CIRCUIT_MAX_BACKOFF = int(os.environ.get("FSS_CIRCUIT_MAX_BACKOFF", "900"))
+# A single timeout could just be a slow response, so a server only counts as offline after
+# this many timeouts in a row
+OFFLINE_AFTER_TIMEOUTS = int(os.environ.get("FSS_OFFLINE_AFTER_TIMEOUTS", "2"))
+
+# "stream" only reads the parts of the XML the bot needs, "xmltodict" parses the whole document
+XML_PARSER = os.environ.get("FSS_XML_PARSER", "stream")
+# Set FSS_FARM_STATS to "true" to summarize the vehicles and farms for /fss_farms. This means the
+# whole feed has to be parsed instead of stopping after the player list, which takes a lot longer
+# on maps with many vehicles
+FARM_STATS = os.environ.get("FSS_FARM_STATS", "false") == "true"
+# Where players were seen is collected into a heatmap per server for /fss_heatmap ("off",
+# "players" or "vehicles"). "vehicles" adds vehicles which moved, which also means parsing more
+# of the feed
+HEATMAPS = os.environ.get("FSS_HEATMAPS", "players")
+if FARM_STATS:
+  FEED_SECTIONS = ["Slots", "Vehicles", "Farms"]
+elif HEATMAPS == "vehicles":
+  FEED_SECTIONS = ["Slots", "Vehicles"]
+else:
+  FEED_SECTIONS = ["Slots"]
+parseStatusFeed = functools.partial(
+  parse_status_feed_xmltodict
+  if XML_PARSER == "xmltodict" else parse_status_feed,
+  sections=FEED_SECTIONS)
+
+# Set FSS_RECORD_DIR to record every fetched status XML there, so problems can be replayed with
+# benchmarks/replay_feeds.py. Files are rotated after FSS_RECORD_FILE_SIZE megabytes, and only the
+# newest FSS_RECORD_FILES are kept
+RECORD_DIR = os.environ.get("FSS_RECORD_DIR", "")
+RECORD_FILE_SIZE = int(os.environ.get("FSS_RECORD_FILE_SIZE",
+                                      "64")) * 1024 * 1024
+RECORD_FILES = int(os.environ.get("FSS_RECORD_FILES", "20"))
+
+# Set FSS_POLL_WORKERS to fetch, parse and compare the status XMLs in that many worker processes.
+# By default, everything happens in this process
+POLL_WORKERS = int(os.environ.get("FSS_POLL_WORKERS", "0"))
+# Mod lists are parsed once per distinct modpack and shared by all servers which run it
+modListCache = ModListCache()
+if POLL_WORKERS > 0:
+  statusPoller = ShardedPoller(POLL_WORKERS, {
+    "maxConcurrency": MAX_CONCURRENT_POLLS,
+    "connectTimeout": CONNECT_TIMEOUT,
+    "readTimeout": READ_TIMEOUT,
+    "failureThreshold": CIRCUIT_FAILURE_THRESHOLD,
+    "maxBackoff": CIRCUIT_MAX_BACKOFF,
+    "offlineAfterTimeouts": OFFLINE_AFTER_TIMEOUTS,
+    "parser": XML_PARSER,
+    "sections": FEED_SECTIONS,
+    "trackPositions": HEATMAPS != "off",
+    "recordDirectory": RECORD_DIR,
+    "recordFileSize": RECORD_FILE_SIZE,
+    "recordFiles": RECORD_FILES
+  },
+                               modCache=modListCache)
+else:
+  hostHealth = HostHealthTracker(failureThreshold=CIRCUIT_FAILURE_THRESHOLD,
+                                 maxBackoff=CIRCUIT_MAX_BACKOFF)
+  statusFetcher = StatusFetcher(maxConcurrency=MAX_CONCURRENT_POLLS,
+                                connectTimeout=CONNECT_TIMEOUT,
+                                readTimeout=READ_TIMEOUT,
+                                health=hostHealth)
+  statusPoller = StatusPoller(statusFetcher,
+                              hostHealth,
+                              parseStatusFeed,
+                              OFFLINE_AFTER_TIMEOUTS,
+                              modCache=modListCache,
+                              trackPositions=HEATMAPS != "off",
+                              recorder=FeedRecorder(
+                                RECORD_DIR, RECORD_FILE_SIZE, RECORD_FILES)
+                              if RECORD_DIR else None)
+
+# All messages, embed edits and channel renames are sent through this scheduler
+discordScheduler = DiscordWriteScheduler(maxConcurrentRequests=int(
+  os.environ.get("FSS_MAX_CONCURRENT_DISCORD_REQUESTS", "4")))
+
+# Configurations and statuses are written to the database in batches in the background
+# ("replit" or "sqlite"). Both are kept in a single snapshot, so they can be read at once on startup
+store = WriteBehindStore(create_backend(
+  os.environ.get("FSS_STORAGE_BACKEND", "replit"),
+  sqlitePath=os.environ.get("FSS_SQLITE_PATH", "fss.sqlite3")),
+                         flushInterval=int(
+                           os.environ.get("FSS_FLUSH_INTERVAL", "30")),
+                         snapshotNamespaces=("servers", "serverStatus"))
+FLUSH_ON_SHUTDOWN = os.environ.get("FSS_FLUSH_ON_SHUTDOWN", "true") == "true"
+storeFlushTask = None
+pollTask = None
+# True once the restart was announced in the status channel
+startAnnounced = False
+# True if the bot reconnected after a failure, or the shell was killed to recover. Kept in memory,
+# so reconnects don't need to ask the database
+recovering = False
+# The fingerprint of the slash commands which discord knows about, once it was checked
+syncedCommandTreeFingerprint = None
+
+# If the connection to discord fails, the bot reconnects within the same process, so the server
+# states are kept and the servers are still polled meanwhile. The delay starts at
+# RECONNECT_MIN_DELAY seconds and doubles with every failed attempt. The process is only
+# restarted after FSS_MAX_RECONNECT_ATTEMPTS failed attempts in a row
+RECONNECT_MIN_DELAY = 5
+RECONNECT_MAX_DELAY = int(os.environ.get("FSS_RECONNECT_MAX_DELAY", "600"))
+MAX_RECONNECT_ATTEMPTS = int(os.environ.get("FSS_MAX_RECONNECT_ATTEMPTS", "8"))
+# A connection which lasted at least this many seconds resets the failed attempts
+STABLE_CONNECTION_TIME = 600
+# The mod lists are not needed for the first cycle, so they are only loaded afterwards. A failed
+# load is retried once it is needed again, after MOD_LISTS_RETRY_DELAY seconds at first and up to
+# MOD_LISTS_MAX_RETRY_DELAY seconds after several failures in a row
+modListsLoadTask = None
+modListsLoadFailures = 0
+modListsRetryAt = 0
+MOD_LISTS_RETRY_DELAY = 30
+MOD_LISTS_MAX_RETRY_DELAY = 900
+
+# Every server gets polled at its own pace, depending on what is happening on it
+pollScheduler = PollScheduler(
+  PollPolicy(
+    defaultInterval=int(os.environ.get("FSS_POLL_INTERVAL", "60")),
+    activeInterval=int(os.environ.get("FSS_ACTIVE_POLL_INTERVAL", "20")),
+    emptyInterval=int(os.environ.get("FSS_EMPTY_POLL_INTERVAL", "180")),
+    maxBackoffInterval=int(os.environ.get("FSS_MAX_POLL_BACKOFF", "900")),
+    jitter=float(os.environ.get("FSS_POLL_JITTER", "0.1"))))
+# The longest time the polling loop sleeps, so newly added servers get picked up quickly
+MAX_POLL_LOOP_SLEEP = 5
+
+# The number of online players and all logins/logouts are recorded here. Set FSS_HISTORY_DIR to
+# an empty string to disable this
+HISTORY_DIR = os.environ.get("FSS_HISTORY_DIR", "history")
+playerHistory = PlayerHistory(HISTORY_DIR) if HISTORY_DIR else None
+
+# How long each player played, per server and per guild. Sessions are added when players log
+# out. The stored totals are loaded after the first cycle, sessions which end before that are
+# added to them
+playtimeLedger = PlaytimeLedger()
+playtimeLoaded = False
+# Loading is retried in every cycle until it worked
+playtimeLoadTask = None
+# Changed boards are only written every FSS_PLAYTIME_FLUSH_INTERVAL seconds, since the replit
+# database stores the whole namespace in a single key
+PLAYTIME_FLUSH_INTERVAL = int(
+  os.environ.get("FSS_PLAYTIME_FLUSH_INTERVAL", "300"))
+changedPlaytimeKeys = set()
+playtimeMarkedAt = 0
+# The most players /fss_leaderboard shows
+MAX_LEADERBOARD_SIZE = 25
+
+# The heatmaps are stored in this directory every few minutes
+heatmapStore = HeatmapStore(os.environ.get(
+  "FSS_HEATMAP_DIR", "heatmaps")) if HEATMAPS != "off" else None
+HEATMAP_SAVE_INTERVAL = 600
+
+# Reports what the bot was doing whenever the event loop is blocked for longer than this
+loopWatchdog = LoopWatchdog(
+  threshold=float(os.environ.get("FSS_STALL_THRESHOLD", "1.0")))
+# The longest profile which can be requested through /fss_profile, in seconds
+MAX_PROFILE_DURATION = 60
+
+# Member log events of a cycle are collected and sent in as few messages as possible
+# ("off", "embeds" or "compact")
+memberLogBatcher = MemberLogBatcher(
+  os.environ.get("FSS_MEMBER_LOG_BATCHING", "embeds"))
+
+# Status embeds are only edited if their content changed, or to refresh the "Last Update" field
+statusEmbedTracker = StatusEmbedTracker(lastUpdateRefreshInterval=int(
+  os.environ.get("FSS_LAST_UPDATE_REFRESH_INTERVAL", "600")))
+# Configuration key => handle for the status embed message, which can be edited without fetching it
+statusMessages = {}
+
+# /fss_status answers from memory. If the shown status is older than this many seconds, the
+# server is polled early in the background
+STATUS_MAX_AGE = int(os.environ.get("FSS_STATUS_MAX_AGE", "120"))
+# The most embeds discord allows in a single message
+MAX_STATUS_EMBEDS = 10
+statusQueryCache = StatusQueryCache()
+
+
+def store_server_config(serverConfig):
+  """Makes sure the server configuration gets written to the database with the next flush"""
+  store.mark_dirty("servers", serverConfig.key,
+                   functools.partial(vars, serverConfig))
+
+
+def may_manage_bot(interaction):
+  """
+  Commands which affect the bot as a whole, and not just one guild, are only available to the
+  owner of the bot and to the administrators of the guild it was originally made for
+  """
+  if interaction.guild_id == LEGACY_GUILD_ID and interaction.permissions.administrator:
+    return True
+  application = client.application
+  if application is None:
+    return False
+  if application.team is not None:
+    return any(member.id == interaction.user.id
+               for member in application.team.members)
+  return application.owner is not None and application.owner.id == interaction.user.id
+
+
+async def is_public_host(ip, port):
+  """
+  True if the port is valid and every address the host resolves to is reachable from the internet.
+  Every guild can add servers, so the bot must not be made to send requests into its own network
+  """
+  if not port.isdigit() or not 0 < int(port) < 65536:
+    return False
+  try:
+    addresses = await asyncio.get_event_loop().getaddrinfo(
+      ip, int(port), type=socket.SOCK_STREAM)
+  except (OSError, UnicodeError):
+    return False
+  for _, _, _, _, sockaddr in addresses:
+    address = ipaddress.ip_address(sockaddr[0].partition("%")[0])
+    if getattr(address, "ipv4_mapped", None) is not None:
+      address = address.ipv4_mapped
+    if not address.is_global or address.is_multicast:
+      return False
+  return len(addresses) > 0
+
+
+async def is_valid_api_code(serverConfig):
+  """
+  Fetches the status XML with the API code of a new subscription. Only a code which returns the
+  feed of a running server may share the status which other guilds already receive
+  """
+  fetcher = StatusFetcher(maxConcurrency=1, connectTimeout=1, readTimeout=1)
+  try:
+    fetchResult, = await fetcher.fetch_all(
+      [ServerStatus(serverConfig).status_xml_url()])
+  finally:
+    await fetcher.close()
+  if not fetchResult.succeeded():
+    return False
+  try:
+    feed = await asyncio.get_event_loop().run_in_executor(
+      None, parseStatusFeed, fetchResult.data)
+  except:
+    return False
+  return feed.is_server_running()
 
 
 #Allows adding a server through a slash command
 @tree.command(name="fss_add",
-              description="Adds an embed for a new server to this channel",
-              guild=discord.Object(id=MY_GUILD))
+              description="Adds an embed for a new server to this channel")
+@app_commands.guild_only()
 @app_commands.describe(
   ip="The IP of the FS22 server",
   port="The port of the FS22 server",
@@ -37,22 +313,59 @@ async def fss_add(interaction, ip: str, port: str, code: str, color: str):
       "Only administrators are allowed to add servers")
     return
 
-  # Currently, only a single panel is allowed per ip:port combination
-  new_server_config = ServerConfiguration(ip, port, code, color)
-  if new_server_config.identifier in serverConfigs:
+  # Currently, only a single panel is allowed per ip:port combination and guild
+  new_server_config = ServerConfiguration(ip, port, code, color,
+                                          interaction.guild_id)
+  if new_server_config.key in serverRegistry:
     await interaction.response.send_message("There already is a panel for %s" %
                                             new_server_config.identifier)
     return
 
-  # Create an embed and remember its details
-  embed = discord.Embed(title="Pending...",
-                        color=int(new_server_config.color, 16))
-  message = await interaction.channel.send(embed=embed)
-  new_server_config.set_status_embed(message.channel.id, message.id)
+  if not await is_public_host(ip, port):
+    await interaction.response.send_message(
+      "%s:%s is not a public address" % (ip, port), ephemeral=True)
+    return
+
+  # Guilds which watch the same server share its status, so the API code has to be right
+  primary = serverRegistry.primary(new_server_config.identifier)
+  if primary is not None and code != primary.apiCode and not await is_valid_api_code(
+      new_server_config):
+    await interaction.response.send_message(
+      "Could not get the status of %s with this API code. The server needs to be running to "
+      "check it" % new_server_config.identifier,
+      ephemeral=True)
+    return
+
+  # Create an embed and remember its details. If the channel has a dashboard, the server is added
+  # to its last message as long as there is room
+  dashboard = dashboard_configs(interaction.guild_id, interaction.channel_id)
+  lastMessageConfigs = [
+    serverConfig for serverConfig in dashboard
+    if serverConfig.statusEmbedId == dashboard[-1].statusEmbedId
+  ] if dashboard else []
+  if 0 < len(lastMessageConfigs) < MAX_STATUS_EMBEDS:
+    new_server_config.set_status_embed(
+      interaction.channel_id, lastMessageConfigs[-1].statusEmbedId,
+      lastMessageConfigs[-1].statusEmbedIndex + 1)
+  else:
+    embed = discord.Embed(title="Pending...",
+                          color=int(new_server_config.color, 16))
+    message = await interaction.channel.send(embed=embed)
+    new_server_config.set_status_embed(message.channel.id, message.id,
+                                       0 if dashboard else None)
 
   # Store the server description in the cache and in the database
-  serverConfigs[new_server_config.identifier] = new_server_config
-  db["servers"][new_server_config.identifier] = vars(new_server_config)
+  serverRegistry.add(new_server_config)
+  store_server_config(new_server_config)
+  identifier = new_server_config.identifier
+  if identifier in serverStatus:
+    # Another guild already watches this server, so its last status can be shown right away
+    update_embeds([serverStatus[identifier]])
+  else:
+    serverStatus[identifier] = ServerStatus(new_server_config)
+    if new_server_config.is_on_dashboard():
+      update_dashboard(new_server_config.statusChannelId,
+                       new_server_config.statusEmbedId)
 
   # Confirm the successful creation of the embed
   # (only the one who used the slash command will see this, and only for 10 seconds)
@@ -63,8 +376,8 @@ async def fss_add(interaction, ip: str, port: str, code: str, color: str):
 
 
 @tree.command(name="fss_remove",
-              description="Removes an embed for a server",
-              guild=discord.Object(id=MY_GUILD))
+              description="Removes an embed for a server")
+@app_commands.guild_only()
 @app_commands.describe(ip="The IP of the FS22 server",
                        port="The port of the FS22 server")
 async def fss_remove(interaction, ip: str, port: str):
@@ -78,7 +391,8 @@ async def fss_remove(interaction, ip: str, port: str):
 
   # Check if the server is known at all
   identifier = ServerConfiguration.build_identifier(ip, port)
-  if identifier not in serverConfigs:
+  server = serverRegistry.get(interaction.guild_id, identifier)
+  if server is None:
     print("INFO: Could not find server %s" % identifier)
     await interaction.response.send_message(
       content="No server registered for IP %s and port %s" % (ip, port),
@@ -86,19 +400,47 @@ async def fss_remove(interaction, ip: str, port: str):
       delete_after=10)
     return
 
-  # Remove the status embed if it exists
-  server = serverConfigs[identifier]
-  if server.has_status_embed():
+  # Remove the status embed if it exists. A dashboard message is only removed along with its last
+  # server
+  dashboardNeighbors = [
+    serverConfig
+    for serverConfig in dashboard_configs(server.guildId, server.statusChannelId)
+    if serverConfig.statusEmbedId == server.statusEmbedId
+    and serverConfig is not server
+  ] if server.is_on_dashboard() else []
+  if server.has_status_embed() and not dashboardNeighbors:
     try:
       channel = client.get_channel(server.statusChannelId)
       embedMessage = await channel.fetch_message(server.statusEmbedId)
-      embedMessage.delete()
+      await embedMessage.delete()
     except:
       print("WARN: Could not remove embed for IP %s and port %s" % (ip, port))
 
   # Remove the server from the cache and database
-  del serverConfigs[identifier]
-  del db["servers"][identifier]
+  message = statusMessages.pop(server.key, None)
+  if message is not None:
+    statusEmbedTracker.forget(message.id)
+  statusQueryCache.forget(server)
+  serverRegistry.remove(server)
+  store.delete("servers", server.key)
+
+  # Only stop polling once no guild watches the server anymore
+  primary = serverRegistry.primary(identifier)
+  if primary is None:
+    pollScheduler.remove(identifier)
+    statusQueryCache.forget_server(identifier)
+    if heatmapStore is not None:
+      heatmapStore.remove(identifier)
+    if playerHistory is not None:
+      playerHistory.remove(identifier)
+    serverStatus.pop(identifier, None)
+    store.delete("serverStatus", identifier)
+  elif serverStatus[identifier].serverConfig is server:
+    # Poll with the API code of one of the remaining guilds
+    statusPoller.forget(serverStatus[identifier])
+    serverStatus[identifier].serverConfig = primary
+  if dashboardNeighbors:
+    update_dashboard(server.statusChannelId, server.statusEmbedId)
 
   print("INFO: Removed server %s" % identifier)
   await interaction.response.send_message(
@@ -107,11 +449,80 @@ async def fss_remove(interaction, ip: str, port: str):
     delete_after=10)
 
 
+@tree.command(
+  name="fss_dashboard",
+  description="Combines the status embeds in this channel into as few messages as possible")
+@app_commands.guild_only()
+@app_commands.describe()
+async def fss_dashboard(interaction):
+  """
+  Moves the status embeds of all servers in the current channel into dashboard messages with up
+  to 10 embeds each, and deletes the old messages. Servers which are added later join the
+  dashboard
+  """
+  if not interaction.permissions.administrator:
+    await interaction.response.send_message(
+      "Only administrators are allowed to run commands on this bot")
+    return
+
+  # Keep the order in which the embeds are shown now
+  serverConfigs = sorted(
+    [
+      serverConfig
+      for serverConfig in serverRegistry.for_channel(interaction.channel_id)
+      if serverConfig.guildId == interaction.guild_id
+      and serverConfig.has_status_embed()
+      and int(serverConfig.statusChannelId) == interaction.channel_id
+    ],
+    key=lambda serverConfig:
+    (int(serverConfig.statusEmbedId), serverConfig.statusEmbedIndex or 0))
+  if not serverConfigs:
+    await interaction.response.send_message(
+      content="There are no status embeds in this channel",
+      ephemeral=True,
+      delete_after=10)
+    return
+
+  # Sending the messages can take longer than discord waits for an answer
+  await interaction.response.defer(ephemeral=True)
+  oldMessageIds = set(serverConfig.statusEmbedId
+                      for serverConfig in serverConfigs)
+  for start in range(0, len(serverConfigs), MAX_STATUS_EMBEDS):
+    group = serverConfigs[start:start + MAX_STATUS_EMBEDS]
+    message = await interaction.channel.send(embeds=[
+      discord.Embed(title="Pending...", color=int(serverConfig.color, 16))
+      for serverConfig in group
+    ])
+    for index, serverConfig in enumerate(group):
+      statusMessages.pop(serverConfig.key, None)
+      serverConfig.set_status_embed(message.channel.id, message.id, index)
+      store_server_config(serverConfig)
+
+  for messageId in oldMessageIds:
+    statusEmbedTracker.forget(messageId)
+    try:
+      await interaction.channel.get_partial_message(messageId).delete()
+    except:
+      print("WARN: Could not remove status message %s" % messageId)
+
+  update_embeds(
+    [serverStatus[identifier] for identifier in set(
+      serverConfig.identifier for serverConfig in serverConfigs)])
+  messageCount = (len(serverConfigs) + MAX_STATUS_EMBEDS -
+                  1) // MAX_STATUS_EMBEDS
+  print("INFO: Moved %d status embeds in channel %s into %d messages" %
+        (len(serverConfigs), interaction.channel_id, messageCount))
+  await interaction.followup.send(
+    content="Combined %d status embeds into %d messages" %
+    (len(serverConfigs), messageCount),
+    ephemeral=True)
+
+
 @tree.command(
   name="fss_enable_member_log",
   description=
-  "Makes the bot post a message in the current channel when a member logs in or out",
-  guild=discord.Object(id=MY_GUILD))
+  "Makes the bot post a message in the current channel when a member logs in or out")
+@app_commands.guild_only()
 @app_commands.describe(ip="The IP of the FS22 server",
                        port="The port of the FS22 server")
 async def fss_enable_member_log(interaction, ip: str, port: str):
@@ -125,36 +536,38 @@ async def fss_enable_member_log(interaction, ip: str, port: str):
 
   # Check if the given server is known at all
   identifier = ServerConfiguration.build_identifier(ip, port)
-  if identifier not in serverConfigs:
+  server = serverRegistry.get(interaction.guild_id, identifier)
+  if server is None:
     await interaction.response.send_message(
       content="No server registered for IP %s and port %s" % (ip, port),
       ephemeral=True,
       delete_after=10)
     return
 
-  server = serverConfigs[identifier]
   server.set_member_log_channel(interaction.channel_id)
+  serverRegistry.reindex(server)
   await interaction.response.send_message(
     content="Activated member log messages for %s" % identifier,
     ephemeral=True,
     delete_after=10)
 
   # Update the database
-  db["servers"][server.identifier] = vars(server)
+  store_server_config(server)
 
 
 @tree.command(
   name="fss_set_status_channel",
-  description="Registers the current channel for status messages of the bot",
-  guild=discord.Object(id=MY_GUILD))
+  description="Registers the current channel for status messages of the bot")
+@app_commands.guild_only()
 @app_commands.describe()
 async def fss_set_status_channel(interaction):
-  if not interaction.permissions.administrator:
+  if not may_manage_bot(interaction):
     await interaction.response.send_message(
-      "Only administrators are allowed to run commands on this bot")
+      "Only the owner of the bot is allowed to set its status channel",
+      ephemeral=True)
     return
 
-  db["statuschannel"] = interaction.channel_id
+  store.set_value("statuschannel", interaction.channel_id)
   statusChannel = interaction.channel_id
   await interaction.response.send_message(
     content="Successfully set this channel for bot status messages")
@@ -163,8 +576,8 @@ async def fss_set_status_channel(interaction):
 @tree.command(
   name="fss_register_voice_channel",
   description=
-  "Makes the bot display the online state and number of online players on a server",
-  guild=discord.Object(id=MY_GUILD))
+  "Makes the bot display the online state and number of online players on a server")
+@app_commands.guild_only()
 @app_commands.describe(
   ip="The IP of the FS22 server",
   port="The port of the FS22 server",
@@ -183,296 +596,1113 @@ async def fss_register_voice_channel(interaction, ip: str, port: str,
 
   # Check if the given server is known at all
   identifier = ServerConfiguration.build_identifier(ip, port)
-  if identifier not in serverConfigs:
+  server = serverRegistry.get(interaction.guild_id, identifier)
+  if server is None:
     await interaction.response.send_message(
       content="No server registered for IP %s and port %s" % (ip, port),
       ephemeral=True,
       delete_after=10)
     return
 
-  server = serverConfigs[identifier]
   server.set_voice_channel(channel_id, map_name)
+  serverRegistry.reindex(server)
   await interaction.response.send_message(
     content="Registered voice channel for %s" % identifier,
     ephemeral=True,
     delete_after=10)
 
   # Update the database
-  db["servers"][server.identifier] = vars(server)
+  store_server_config(server)
 
 
-async def update_status_embeds():
+@tree.command(name="fss_status",
+              description="Shows the current status of a server")
+@app_commands.guild_only()
+@app_commands.describe(
+  server="The IP and port or the name of the server. All servers if omitted")
+async def fss_status(interaction, server: str = None):
   """
-  Update the registered embeds every minute
+  Answers from the last known status. The servers are never polled while the user waits
   """
-  await client.wait_until_ready()
-  while not client.is_closed():
+  serverConfigs = find_servers(interaction.guild_id, server)
+  if not serverConfigs:
+    await interaction.response.send_message(
+      content="No server found for %s" %
+      server if server else "No servers were added yet",
+      ephemeral=True)
+    return
+
+  embeds = []
+  ages = []
+  for serverConfig in serverConfigs[:MAX_STATUS_EMBEDS]:
+    identifier = serverConfig.identifier
+    serverData = serverStatus.get(identifier)
+    if serverData is None:
+      continue
+    embeds.append(
+      statusQueryCache.get(serverConfig, serverData, render_status_answer))
+    age = pollScheduler.seconds_since_last_poll(identifier)
+    if age is None or age > STATUS_MAX_AGE:
+      # Requests of other users are answered from the same poll
+      pollScheduler.request_poll(identifier)
+    if age is not None:
+      ages.append(age)
+
+  content = "Last updated %d seconds ago" % max(ages) if ages else None
+  if len(serverConfigs) > MAX_STATUS_EMBEDS:
+    content = (content + ". " if content else "") + \
+      "Only the first %d servers are shown" % MAX_STATUS_EMBEDS
+  await interaction.response.send_message(content=content,
+                                          embeds=embeds,
+                                          ephemeral=True)
+
+
+@fss_status.autocomplete("server")
+async def fss_status_server_autocomplete(interaction, current):
+  choices = []
+  for serverConfig in find_servers(interaction.guild_id, current)[:25]:
+    serverData = serverStatus.get(serverConfig.identifier)
+    name = serverData.display_name(
+      serverConfig) if serverData is not None else serverConfig.identifier
+    choices.append(
+      app_commands.Choice(name=name.strip()[:100],
+                          value=serverConfig.identifier))
+  return choices
+
+
+def find_servers(guildId, query):
+  """Finds the servers of a guild by their IP and port or a part of their name"""
+  serverConfigs = serverRegistry.for_guild(guildId)
+  if not query:
+    return serverConfigs
+  serverConfig = serverRegistry.get(guildId, query.strip())
+  if serverConfig is not None:
+    return [serverConfig]
+  query = query.strip().lower()
+  return [
+    serverConfig for serverConfig in serverConfigs
+    if serverConfig.identifier in serverStatus and query in serverStatus[
+      serverConfig.identifier].display_name(serverConfig).lower()
+  ]
+
+
+def render_status_answer(title, description, color):
+  return discord.Embed(title=title, description=description, color=color)
+
+
+@tree.command(name="fss_farms",
+              description="Shows the farms of a server and their vehicles")
+@app_commands.guild_only()
+@app_commands.describe(
+  server="The IP and port or the name of the server. All servers if omitted")
+async def fss_farms(interaction, server: str = None):
+  """
+  Answers from the vehicles and farms of the last poll
+  """
+  if not FARM_STATS:
+    await interaction.response.send_message(
+      content="Farm statistics are not enabled on this bot", ephemeral=True)
+    return
+
+  embeds = []
+  length = 0
+  for serverConfig in find_servers(interaction.guild_id, server):
+    serverData = serverStatus.get(serverConfig.identifier)
+    if serverData is None or serverData.farmStats is None:
+      continue
+    embed = render_farm_stats(serverData.display_name(serverConfig).strip(),
+                              serverData.farmStats, int(serverConfig.color,
+                                                        16))
+    # Discord limits the number of embeds and the text of all of them per message
+    length += len(embed)
+    if len(embeds) == MAX_STATUS_EMBEDS or (embeds and length > 6000):
+      break
+    embeds.append(embed)
+
+  if not embeds:
+    await interaction.response.send_message(
+      content="No farm statistics available yet", ephemeral=True)
+    return
+  await interaction.response.send_message(embeds=embeds, ephemeral=True)
+
+
+@fss_farms.autocomplete("server")
+async def fss_farms_server_autocomplete(interaction, current):
+  return await fss_status_server_autocomplete(interaction, current)
+
+
+def render_farm_stats(title, farmStats, color):
+  """Shows one field per farm, the farms with the most vehicles first"""
+  vehicleCounts = farmStats.farm_vehicle_counts()
+  fleet = farmStats.fleet()
+  embed = discord.Embed(
+    title=title,
+    description="%d vehicles, %d of them owned by %d farms" %
+    (int(vehicleCounts.sum()) + farmStats.unownedVehicles,
+     int(vehicleCounts.sum()), len(farmStats.farmIds)),
+    color=color)
+  # FS22 has up to 8 farms, but keep the embed short in any case
+  for farm in vehicleCounts.argsort(kind="stable")[::-1][:10]:
+    lines = ["💰 %s | 🚜 %d vehicles" %
+             (format(int(farmStats.money[farm]), ","), vehicleCounts[farm])]
+    categories = farmStats.vehicleCounts[farm]
+    lines.append(", ".join("%s %d" % (farmStats.categories[index],
+                                      categories[index])
+                           for index in categories.argsort()[::-1][:5]
+                           if categories[index] > 0))
+    fills = farmStats.fillLevels[farm]
+    lines.append(", ".join("%s %s" % (farmStats.fillTypes[index],
+                                      format(int(fills[index]), ","))
+                           for index in fills.argsort()[::-1][:5]
+                           if fills[index] > 0))
+    embed.add_field(name=farmStats.farmNames[farm] or "Farm %d" %
+                    farmStats.farmIds[farm],
+                    value="\n".join(line for line in lines if line)[:1024],
+                    inline=False)
+  embed.add_field(name="Fleet",
+                  value=", ".join(
+                    "%s %d" % (farmStats.categories[index], fleet[index])
+                    for index in fleet.argsort()[::-1][:10])[:1024] or "-",
+                  inline=False)
+  return embed
+
+
+@tree.command(name="fss_heatmap",
+              description="Shows where on the map players were active")
+@app_commands.guild_only()
+@app_commands.describe(server="The IP and port or the name of the server")
+async def fss_heatmap(interaction, server: str = None):
+  """
+  Sends the heatmap of a server as an image. It is only rendered again if it changed noticeably
+  """
+  serverConfigs = find_servers(interaction.guild_id, server)
+  if len(serverConfigs) != 1:
+    await interaction.response.send_message(
+      content="Please pick one of the servers" if serverConfigs else
+      "No server found", ephemeral=True)
+    return
+  serverConfig = serverConfigs[0]
+  # Reading a stored heatmap from disk would block the event loop
+  heatmap = await asyncio.get_event_loop().run_in_executor(
+    None, heatmapStore.get,
+    serverConfig.identifier) if heatmapStore is not None else None
+  serverData = serverStatus.get(serverConfig.identifier)
+  if heatmap is None or heatmap.total == 0 or serverData is None:
+    await interaction.response.send_message(
+      content="No positions were recorded for this server yet", ephemeral=True)
+    return
+
+  png = await asyncio.get_event_loop().run_in_executor(None, heatmap.render)
+  embed = discord.Embed(title="Activity on %s" % heatmap.mapName,
+                        description=serverData.display_name(serverConfig),
+                        color=int(serverConfig.color, 16))
+  embed.set_image(url="attachment://heatmap.png")
+  await interaction.response.send_message(
+    embed=embed, file=discord.File(io.BytesIO(png), filename="heatmap.png"))
+
+
+@fss_heatmap.autocomplete("server")
+async def fss_heatmap_server_autocomplete(interaction, current):
+  return await fss_status_server_autocomplete(interaction, current)
+
+
+async def load_heatmap(identifier):
+  """Reads the stored heatmap of a server in the background, the first time positions arrive"""
+  try:
+    heatmap = await asyncio.get_event_loop().run_in_executor(
+      None, heatmapStore.read, identifier)
+  except:
+    print("WARN: Could not read the heatmap of %s: %s" %
+          (identifier, traceback.format_exc()))
+    heatmap = None
+  heatmapStore.finish_loading(identifier, heatmap)
+
+
+async def save_heatmaps():
+  """Writes the heatmaps which changed to disk regularly"""
+  while True:
+    await asyncio.sleep(HEATMAP_SAVE_INTERVAL)
     try:
-      serverStatus = await get_server_status()
-      for serverData in serverStatus:
-        serverConfig = serverData.serverConfig
+      await asyncio.get_event_loop().run_in_executor(None, heatmapStore.save)
+    except:
+      print("WARN: Could not save the heatmaps: %s" % traceback.format_exc())
 
-        # Try finding the message for the embed
-        try:
-          channel = client.get_channel(serverConfig.statusChannelId)
-          embedMessage = await channel.fetch_message(serverConfig.statusEmbedId
-                                                     )
-        except:
-          print("WARN: Could not find embed for server %s." %
-                (serverData.serverConfig.name))
-          continue
 
-        # Build the description
-        replyMessage = \
-          "**Map: **" + serverData.map + "\r\n" + \
-          "**Status: **" + serverData.status + "\r\n" + \
-          "**Mods Link: **" + serverData.mods_link() + "\r\n" + \
-          "**Players Online: **" + str(serverData.online_player_count()) + "/" + serverData.maxPlayers + "\r\n" + \
-          "**Players: **"
+@tree.command(name="fss_leaderboard",
+              description="Shows who played the most")
+@app_commands.guild_only()
+@app_commands.describe(
+  period="The time span to show",
+  server="The IP and port or the name of the server. All servers if omitted",
+  count="How many players to show")
+@app_commands.choices(period=[
+  app_commands.Choice(name="Today", value=PERIOD_DAY),
+  app_commands.Choice(name="This week", value=PERIOD_WEEK),
+  app_commands.Choice(name="All time", value=PERIOD_ALL)
+])
+async def fss_leaderboard(interaction,
+                          period: str = PERIOD_WEEK,
+                          server: str = None,
+                          count: int = 10):
+  """
+  Lists the players with the most playtime. Only finished sessions count
+  """
+  if server:
+    serverConfigs = find_servers(interaction.guild_id, server)
+    if len(serverConfigs) != 1:
+      await interaction.response.send_message(
+        content="No single server found for %s" % server, ephemeral=True)
+      return
+    scope = serverConfigs[0].identifier
+    serverData = serverStatus.get(scope)
+    title = serverData.display_name(
+      serverConfigs[0]).strip() if serverData is not None else scope
+  else:
+    scope = playtime_guild_scope(interaction.guild_id)
+    title = "All servers"
+
+  entries = playtimeLedger.top(scope, period,
+                               max(1, min(count, MAX_LEADERBOARD_SIZE)),
+                               time.time())
+  lines = [
+    "%d. %s: %d h %02d min" % (rank, playerName, minutes // 60, minutes % 60)
+    for rank, (playerName, minutes) in enumerate(entries, start=1)
+  ]
+  periodNames = {
+    PERIOD_DAY: "today",
+    PERIOD_WEEK: "this week",
+    PERIOD_ALL: "all time"
+  }
+  embed = discord.Embed(title="Playtime %s: %s" %
+                        (periodNames.get(period, period), title),
+                        description="\n".join(lines)
+                        or "Nobody finished a session yet")
+  await interaction.response.send_message(embed=embed)
+
+
+@fss_leaderboard.autocomplete("server")
+async def fss_leaderboard_server_autocomplete(interaction, current):
+  return await fss_status_server_autocomplete(interaction, current)
+
+
+@tree.command(name="fss_schedule",
+              description="Shows when each server will be polled next")
+@app_commands.guild_only()
+async def fss_schedule(interaction):
+  if not interaction.permissions.administrator:
+    await interaction.response.send_message(
+      "Only administrators are allowed to run commands on this bot")
+    return
+
+  # Only show the servers of this guild
+  identifiers = set(serverConfig.identifier
+                    for serverConfig in serverRegistry.for_guild(
+                      interaction.guild_id))
+  lines = [
+    "%s: in %d s (%s)" % (identifier, max(0, seconds), reason)
+    for identifier, seconds, reason in pollScheduler.snapshot()
+    if identifier in identifiers
+  ]
+  content = "\n".join(lines) or "No servers are scheduled"
+  # Stay below discord's message length limit
+  if len(content) > 1900:
+    content = content[:1900] + "\n..."
+  await interaction.response.send_message(content=content, ephemeral=True)
 
-        if not serverData.players:
-          replyMessage = replyMessage + "(none)"
-        else:
-          for playerName in serverData.players:
-            replyMessage = replyMessage + "\r\n - %s (%s min)" % (
-              playerName, serverData.players[playerName].onlineTime)
-
-        # Update the embed
-        embed = discord.Embed(title=serverData.name,
-                              description=replyMessage,
-                              color=int(serverConfig.color, 16))
-        embed.add_field(name="Last Update",
-                        value="%s" % datetime.datetime.now())
-        await embedMessage.edit(embed=embed)
-
-        # Wait five seconds before updating the next embed so we don't flood discord
-        await asyncio.sleep(5)
+
+@tree.command(
+  name="fss_profile",
+  description="Samples what the bot is busy with and posts the hottest code locations")
+@app_commands.guild_only()
+@app_commands.describe(seconds="How long to sample, in seconds")
+async def fss_profile(interaction, seconds: int = 10):
+  if not may_manage_bot(interaction):
+    await interaction.response.send_message(
+      "Only the owner of the bot is allowed to profile it", ephemeral=True)
+    return
+
+  seconds = max(1, min(seconds, MAX_PROFILE_DURATION))
+  await interaction.response.defer(ephemeral=True)
+
+  # Sample the event loop thread from a background thread
+  summary = await asyncio.get_event_loop().run_in_executor(
+    None, sample_profile, threading.get_ident(), seconds)
+
+  stalls = list(loopWatchdog.reports)
+  if stalls:
+    lastStall = stalls[-1]
+    summary += "\n\n%d stalls recorded. Last one at %s (%s):\n%s" % (
+      len(stalls), datetime.datetime.fromtimestamp(lastStall.detectedAt),
+      "%.1f s" % lastStall.duration
+      if lastStall.duration is not None else "ongoing",
+      "".join(lastStall.stack.splitlines(True)[-6:]))
+
+  # Stay below discord's message length limit
+  if len(summary) > 1900:
+    summary = summary[:1900] + "\n..."
+  await interaction.followup.send(content="```\n%s\n```" % summary,
+                                  ephemeral=True)
+
+
+def get_messageable_channel(channelId):
+  """
+  Returns the channel with the given ID, or None if it does not exist. While the bot is not
+  connected the channel cache is empty, so a handle which only knows the ID is returned
+  instead, and the messages for it are sent after reconnecting
+  """
+  channel = client.get_channel(channelId)
+  if channel is None and not client.is_ready():
+    channel = client.get_partial_messageable(channelId)
+  return channel
+
+
+def get_status_message(serverConfig):
+  """
+  Returns a handle for the status embed of a server. The message itself is never fetched.
+  """
+  message = statusMessages.get(serverConfig.key)
+  if message is None or message.id != serverConfig.statusEmbedId:
+    channel = get_messageable_channel(serverConfig.statusChannelId)
+    message = channel.get_partial_message(serverConfig.statusEmbedId)
+    statusMessages[serverConfig.key] = message
+  return message
+
+
+def update_embeds(serverStatuses):
+  """
+  Queues an update of the status embeds of each of the given servers in every guild which
+  watches them, if anything changed
+  """
+  # Server identifier => status description
+  descriptions = {}
+  # (channel ID, message ID) of the dashboards which show any of the servers
+  dashboards = set()
+  for serverData in serverStatuses:
+    # The description is the same for all guilds
+    description = render_status_description(serverData)
+    descriptions[serverData.serverConfig.identifier] = description
+    statusQueryCache.update(serverData.serverConfig.identifier, description)
+
+    for serverConfig in serverRegistry.subscribers(
+        serverData.serverConfig.identifier):
+      if not serverConfig.has_status_embed():
+        continue
+      if serverConfig.is_on_dashboard():
+        # Dashboards show several servers, so they are only updated once all of them are known
+        dashboards.add(
+          (serverConfig.statusChannelId, serverConfig.statusEmbedId))
+        continue
+
+      # Try finding the message for the embed
+      try:
+        embedMessage = get_status_message(serverConfig)
+      except:
+        print("WARN: Could not find embed for server %s." % serverConfig.key)
+        continue
+
+      # Skip the update if nothing changed
+      title = serverData.display_name(serverConfig)
+      color = int(serverConfig.color, 16)
+      fingerprint = embed_fingerprint(title, description, color)
+      if not statusEmbedTracker.needs_update(embedMessage.id, fingerprint):
+        continue
+      statusEmbedTracker.mark_pending(embedMessage.id, fingerprint)
+
+      # Update the embed
+      embed = discord.Embed(title=title, description=description, color=color)
+      embed.add_field(name="Last Update",
+                      value="%s" % datetime.datetime.now())
+      # Queue the update. The scheduler takes care of discord's rate limits
+      discordScheduler.submit(message_edit_route(embedMessage.channel.id),
+                              PRIORITY_EMBED,
+                              functools.partial(edit_status_message,
+                                                embedMessage,
+                                                fingerprint,
+                                                embed=embed),
+                              key=("embed", embedMessage.id))
+
+  for statusChannelId, statusEmbedId in dashboards:
+    update_dashboard(statusChannelId, statusEmbedId, descriptions)
+
+
+def dashboard_configs(guildId, channelId):
+  """Returns the configurations which are shown on the dashboard of a channel, in order"""
+  return sorted(
+    [
+      serverConfig for serverConfig in serverRegistry.for_channel(channelId)
+      if serverConfig.guildId == guildId and serverConfig.is_on_dashboard()
+      and int(serverConfig.statusChannelId) == int(channelId)
+    ],
+    key=lambda serverConfig:
+    (int(serverConfig.statusEmbedId), serverConfig.statusEmbedIndex))
+
+
+def update_dashboard(statusChannelId, statusEmbedId, descriptions=None):
+  """
+  Queues an edit of a dashboard message, which shows an embed for each of its servers, if any of
+  them changed. descriptions can provide status descriptions which were already rendered
+  """
+  serverConfigs = [
+    serverConfig for serverConfig in serverRegistry.for_channel(statusChannelId)
+    if serverConfig.is_on_dashboard()
+    and serverConfig.statusEmbedId == statusEmbedId
+    and serverConfig.identifier in serverStatus
+  ]
+  if not serverConfigs:
+    return
+  serverConfigs.sort(key=lambda serverConfig: serverConfig.statusEmbedIndex)
+
+  # Try finding the message for the dashboard
+  try:
+    embedMessage = get_status_message(serverConfigs[0])
+  except:
+    print("WARN: Could not find dashboard %s." % statusEmbedId)
+    return
+
+  lastUpdate = "%s" % datetime.datetime.now()
+  embeds = []
+  unfittedDescriptions = []
+  for serverConfig in serverConfigs:
+    serverData = serverStatus[serverConfig.identifier]
+    embed = discord.Embed(title=serverData.display_name(serverConfig),
+                          color=int(serverConfig.color, 16))
+    embed.add_field(name="Last Update", value=lastUpdate)
+    embeds.append(embed)
+    description = (descriptions or {}).get(serverConfig.identifier)
+    unfittedDescriptions.append(description if description is not None else
+                                render_status_description(serverData))
+
+  # Shorten the player lists if the embeds would not fit into the message otherwise
+  fittedDescriptions = fit_descriptions(
+    unfittedDescriptions,
+    MAX_CHARACTERS_PER_MESSAGE - sum(len(embed) for embed in embeds))
+
+  # Skip the update if nothing changed
+  fingerprint = dashboard_fingerprint(
+    (embed.title, description, embed.color.value)
+    for embed, description in zip(embeds, fittedDescriptions))
+  if not statusEmbedTracker.needs_update(embedMessage.id, fingerprint):
+    return
+  statusEmbedTracker.mark_pending(embedMessage.id, fingerprint)
+
+  for embed, description in zip(embeds, fittedDescriptions):
+    embed.description = description
+  discordScheduler.submit(message_edit_route(embedMessage.channel.id),
+                          PRIORITY_EMBED,
+                          functools.partial(edit_status_message,
+                                            embedMessage,
+                                            fingerprint,
+                                            embeds=embeds),
+                          key=("embed", embedMessage.id))
+
+
+async def edit_status_message(embedMessage, fingerprint, **kwargs):
+  """
+  Edits a status message, and only remembers what it shows once discord confirmed the edit. If it
+  failed, e.g. since the message was deleted, the next update is sent again
+  """
+  try:
+    await embedMessage.edit(**kwargs)
+  except discord.HTTPException as e:
+    # Rate limited edits are retried by the scheduler
+    if e.status != 429:
+      statusEmbedTracker.forget(embedMessage.id)
+    raise
+  except:
+    statusEmbedTracker.forget(embedMessage.id)
+    raise
+  statusEmbedTracker.mark_updated(embedMessage.id, fingerprint)
+
+
+async def update_status_embeds():
+  """
+  Polls the servers when they are due and updates their embeds. Every host is polled once, no
+  matter how many guilds watch it. Keeps running while the bot reconnects to discord
+  """
+  global playtimeLoadTask
+  await client.wait_until_ready()
+  while True:
+    try:
+      identifiers = pollScheduler.due(serverRegistry.hosts())
+      if identifiers:
+        isFirstCycle = firstStart
+        with CYCLE_SECONDS.time():
+          update_embeds(await get_server_status(identifiers))
+        if isFirstCycle:
+          print("INFO: First status update %.1f seconds after start" %
+                (time.monotonic() - PROCESS_START_TIME))
+          asyncio.ensure_future(preload_mod_lists())
+        if not playtimeLoaded and (playtimeLoadTask is None
+                                   or playtimeLoadTask.done()):
+          playtimeLoadTask = asyncio.ensure_future(load_playtime())
     except:
       print(traceback.format_exc())
-      print("Waiting 60 seconds because of exception")
-      # Most likely "429 Too Many Requests". Ignore this and try again after 60 seconds
-      pass
 
-    # Repeat after 60 seconds
-    await asyncio.sleep(60)
+    # Wait until the next server is due
+    await asyncio.sleep(
+      min(pollScheduler.seconds_until_next_poll(), MAX_POLL_LOOP_SLEEP))
 
 
-async def get_server_status():
+def send_member_log_messages():
   """
-  Retrieves the server status from each server
+  Queues the member log events which were collected during this cycle. Messages for the same
+  channel are sent in order.
   """
-  global firstStart
-  http = urllib3.PoolManager()
+  for channel, embeds in memberLogBatcher.take_messages():
+    discordScheduler.submit(message_send_route(channel.id),
+                            PRIORITY_MEMBER_LOG,
+                            functools.partial(channel.send, embeds=embeds))
 
-  allServersData = []
-  for identifier in serverConfigs:
-    serverConfig = serverConfigs[identifier]
-    serverData = serverStatus[identifier]
 
-    serverTurnedOffline = False
-    serverTurnedOnline = False
+async def get_server_status(identifiers):
+  """
+  Retrieves the server status from each of the given servers
+  """
+  global firstStart
 
-    # Retrieve the server XML
-    try:
-      url = serverData.status_xml_url()
-      response = http.request('GET', url, timeout=urllib3.util.Timeout(2))
-      # Parse data from the server XML
-      try:
-        data = xmltodict.parse(response.data)
+  # Retrieve the XML of all servers in parallel. The results are processed one after another
+  # afterwards so the notifications are sent in the same order as before
+  outcomes = await statusPoller.poll(
+    [serverStatus[identifier] for identifier in identifiers])
 
+  allServersData = []
+  for outcome in outcomes:
+    serverData = outcome.serverData
+    identifier = serverData.serverConfig.identifier
+    # Skip servers which were removed while the XML was being fetched
+    if serverStatus.get(identifier) is not serverData:
+      continue
+    if outcome.failed:
+      allServersData.append(serverData)
+      continue
+    if outcome.changed:
+      # Update the database
+      store.mark_dirty("serverStatus", identifier, serverData.to_json)
+    modChanges = None
+    if outcome.modsChanged:
+      # Mod lists are stored once per hash, no matter how many servers use them
+      store.mark_dirty("modLists", serverData.mods.hash,
+                       serverData.mods.to_json)
+      previousMods = outcome.previousMods
+      if previousMods is not None and not previousMods.is_loaded():
+        # The mods changed while the bot was not running
         try:
-          # Check if the server is offline (but the host is online. In this case we get an empty XML):
-          serverElement = data["Server"]
-          if "@name" not in serverElement:
-            if serverData.is_online():
-              serverTurnedOffline = True
-            serverData.set_offline()
-            serverData.update_players([])
-          else:
-            if not serverData.is_online():
-              serverTurnedOnline = True
-            # Update the cache with the status values
-            serverData.update_attributes(
-              status="Online",
-              name=serverConfig.flag + " " + serverElement["@name"],
-              map=serverElement["@mapName"],
-              maxPlayers=serverElement["Slots"]["@capacity"])
-
-            serverData.update_players(serverElement["Slots"]["Player"])
-
-            # Update the database
-            db["serverStatus"][serverConfig.identifier] = serverData.to_json()
+          modsJson = (await load_mod_lists()).get(previousMods.hash)
         except:
-          print("Failed updating online state from XML: %s" %
-                traceback.format_exc())
-          continue
-      except:
-        print("Failed parsing XML data from %s" % url)
-        allServersData.append(serverData)
+          # The loader reported it already. The other servers still need to be processed
+          modsJson = None
+        previousMods = ModList.from_json(
+          previousMods.hash, modsJson) if modsJson is not None else None
+      # There is nothing to compare to for servers which were just added
+      if previousMods is not None:
+        modChanges = diff_mods(previousMods, serverData.mods)
+
+    serverTurnedOnline = outcome.turnedOnline
+    serverTurnedOffline = outcome.turnedOffline
+    subscribers = serverRegistry.subscribers(identifier)
+
+    # Every guild which watches the server gets its own member log messages
+    memberLogs = []
+    for serverConfig in subscribers:
+      if not serverConfig.has_member_log_channel():
         continue
-    except:
-      if serverData.is_online():
-        serverTurnedOffline = True
-      serverData.set_offline()
-      allServersData.append(serverData)
-
-    if serverConfig.has_member_log_channel():
       try:
-        channel = client.get_channel(serverConfig.memberLogChannelId)
+        channel = get_messageable_channel(serverConfig.memberLogChannelId)
       except:
         # This could e.g. happen in case of Cloudflare rate limiting
         print("Failed to retrieve member log channel ID. Skipping")
         continue
-    else:
-      channel = None
+      if channel is not None:
+        memberLogs.append((channel, serverData.display_name(serverConfig),
+                           int(serverConfig.color, 16)))
 
-    color = int(serverConfig.color, 16)
     # Send a message if the server just went online (before the player list)
     if serverTurnedOnline:
       print("Server %s is now online" % serverData.name)
-      if channel is not None:
-        embed = discord.Embed(description="🟢 **%s** is now online" %
-                              serverData.name,
+      for channel, name, color in memberLogs:
+        embed = discord.Embed(description="🟢 **%s** is now online" % name,
+                              color=color)
+        memberLogBatcher.add(channel, embed)
+
+    # Tell players which mods they need to download before joining
+    if modChanges:
+      print("The mods of %s changed" % serverData.name)
+      modDescription = describe_mod_changes(modChanges)
+      for channel, name, color in memberLogs:
+        embed = discord.Embed(description="🧩 The mods on **%s** changed:\n%s" %
+                              (name, modDescription),
                               color=color)
-        message = await channel.send(embed=embed)
+        memberLogBatcher.add(channel, embed)
 
     # Send a message to discord for every recently logged out player
     for playerStatus in serverData.recentlyLoggedOut:
       print("%s is no longer on %s" %
             (playerStatus.playerName, serverData.name))
-      if channel is not None:
+      for channel, name, color in memberLogs:
         embed = discord.Embed(description="👋 **%s** is no longer on **%s**" %
-                              (playerStatus.playerName, serverData.name),
+                              (playerStatus.playerName, name),
                               color=discord.Colour.dark_red())
-        message = await channel.send(embed=embed)
+        memberLogBatcher.add(channel, embed)
 
     # Send a message to discord for every recently logged in player
     for playerStatus in serverData.recentlyLoggedIn:
       print("%s is now online on %s" %
             (playerStatus.playerName, serverData.name))
-      if channel is not None:
+      for channel, name, color in memberLogs:
         embed = discord.Embed(description="👤 **%s** is now online on **%s**" %
-                              (playerStatus.playerName, serverData.name),
+                              (playerStatus.playerName, name),
                               color=color)
-        message = await channel.send(embed=embed)
+        memberLogBatcher.add(channel, embed)
 
     # Send a message to discord for every player who recently changed to admin
     for playerStatus in serverData.recentlyChangedToAdmin:
       print("%s is now an admin on %s" %
             (playerStatus.playerName, serverData.name))
-      if channel is not None:
+      for channel, name, color in memberLogs:
         embed = discord.Embed(
           description="🎩 **%s** is now an admin on **%s**" %
-          (playerStatus.playerName, serverData.name),
+          (playerStatus.playerName, name),
           color=color)
-        message = await channel.send(embed=embed)
+        memberLogBatcher.add(channel, embed)
 
     # Send a message if the server just went offline (after the player list)
     if serverTurnedOffline:
       print("Server %s is now offline" % serverData.name)
-      if channel is not None:
-        embed = discord.Embed(description="🔴 **%s** is now offline" %
-                              serverData.name,
+      for channel, name, color in memberLogs:
+        embed = discord.Embed(description="🔴 **%s** is now offline" % name,
                               color=color)
-        message = await channel.send(embed=embed)
-
-    # Update the voice channel name
-    if serverConfig.has_voice_channel() and serverData.allows_channel_rename(
-    ) and (len(serverData.recentlyLoggedOut) > 0
-           or len(serverData.recentlyLoggedIn) > 0 or serverTurnedOffline
-           or serverTurnedOnline or firstStart):
+        memberLogBatcher.add(channel, embed)
+
+    # Update the voice channel names
+    renameChannels = (len(serverData.recentlyLoggedOut) > 0
+                      or len(serverData.recentlyLoggedIn) > 0
+                      or serverTurnedOffline or serverTurnedOnline
+                      or firstStart)
+    for serverConfig in subscribers:
+      if not renameChannels or not serverConfig.has_voice_channel():
+        continue
       try:
-        serverData.update_channel_rename_timestamp()
-        voiceChannel = client.get_channel(int(serverConfig.voiceChannelId))
+        voiceChannelId = int(serverConfig.voiceChannelId)
+        if not serverData.allows_channel_rename(voiceChannelId):
+          continue
+        voiceChannel = client.get_channel(voiceChannelId)
+        if voiceChannel is not None:
+          rename = voiceChannel.edit
+        elif not client.is_ready():
+          # The channel cache is empty while the bot is disconnected. The rename is sent once it
+          # reconnected
+          rename = functools.partial(client.http.edit_channel, voiceChannelId)
+        else:
+          print("WARN: Could not find voice channel %s for server %s" %
+                (voiceChannelId, serverData.name))
+          continue
         onlineSign = "🟢" if serverData.is_online() else "🔴"
-        await voiceChannel.edit(
-          name="%s %s: %s/%s" %
-          (onlineSign, serverConfig.voiceChannelName,
-           serverData.online_player_count(), serverData.maxPlayers))
+        discordScheduler.submit(
+          channel_edit_route(voiceChannelId),
+          PRIORITY_RENAME,
+          functools.partial(
+            rename,
+            name="%s %s: %s/%s" %
+            (onlineSign, serverConfig.voiceChannelName,
+             serverData.online_player_count(), serverData.maxPlayers)),
+          key=("rename", voiceChannelId))
+        serverData.update_channel_rename_timestamp(voiceChannelId)
       except:
         print(
           "WARN: Could not locate or change voice channel %s for server %s" %
           (serverConfig.voiceChannelId, serverData.name))
         print(traceback.format_exc())
 
+    if playerHistory is not None:
+      try:
+        playerHistory.record_poll(
+          identifier,
+          time.time(),
+          serverData.online_player_count() if serverData.is_online() else 0,
+          loggedIn=[p.playerName for p in serverData.recentlyLoggedIn],
+          loggedOut=[p.playerName for p in serverData.recentlyLoggedOut])
+      except:
+        print("WARN: Could not record the player history of %s: %s" %
+              (identifier, traceback.format_exc()))
+
+    if serverData.recentlyLoggedOut:
+      record_playtime(identifier, serverData.recentlyLoggedOut)
+
+    if heatmapStore is not None and outcome.positionCells is not None:
+      if heatmapStore.add(identifier, serverData.map, outcome.positionCells):
+        asyncio.ensure_future(load_heatmap(identifier))
+
+    pollScheduler.record_result(
+      identifier,
+      reachable=outcome.reachable,
+      notBefore=outcome.notBefore,
+      onlineCount=serverData.online_player_count()
+      if serverData.is_online() else 0,
+      playersChanged=len(serverData.recentlyLoggedIn) > 0
+      or len(serverData.recentlyLoggedOut) > 0)
+
     allServersData.append(serverData)
 
+  send_member_log_messages()
+  if playtimeLoaded:
+    for key in playtimeLedger.prune(time.time()):
+      changedPlaytimeKeys.discard(key)
+      store.delete("playtime", key)
+    mark_playtime_dirty()
   firstStart = False
   return allServersData
 
 
+def record_playtime(identifier, loggedOut):
+  """Adds the sessions of players who logged out, using the online time of their last poll"""
+  scopes = [identifier] + list(
+    set(playtime_guild_scope(serverConfig.guildId)
+        for serverConfig in serverRegistry.subscribers(identifier)))
+  now = time.time()
+  for player in loggedOut:
+    changedPlaytimeKeys.update(
+      playtimeLedger.record_session(scopes, player.playerName,
+                                    player.onlineTime, now))
+
+
+def mark_playtime_dirty(force=False):
+  """Hands the boards which changed to the store, at most every PLAYTIME_FLUSH_INTERVAL seconds"""
+  global playtimeMarkedAt
+  if not playtimeLoaded or not changedPlaytimeKeys or (
+      not force
+      and time.monotonic() - playtimeMarkedAt < PLAYTIME_FLUSH_INTERVAL):
+    return
+  for key in changedPlaytimeKeys:
+    store.mark_dirty("playtime", key,
+                     functools.partial(playtimeLedger.board_json, key))
+  changedPlaytimeKeys.clear()
+  playtimeMarkedAt = time.monotonic()
+
+
+def playtime_guild_scope(guildId):
+  return "guild %s" % guildId
+
+
+async def load_playtime():
+  """Adds the stored playtime to the sessions which were recorded since the start"""
+  global playtimeLoaded
+  try:
+    entries = await asyncio.get_event_loop().run_in_executor(
+      None, store.load, "playtime")
+  except:
+    print("WARN: Could not load the playtime, retrying in the next cycle: %s" %
+          traceback.format_exc())
+    return
+  # The boards which had sessions before the load differ from the stored ones
+  changedPlaytimeKeys.update(playtimeLedger.load(entries))
+  playtimeLoaded = True
+
+
+async def flush_player_history():
+  """Syncs the player history to disk as often as the store writes to the database"""
+  while True:
+    await asyncio.sleep(store.flushInterval)
+    try:
+      await asyncio.get_event_loop().run_in_executor(None, playerHistory.flush)
+    except:
+      print("WARN: Could not flush the player history: %s" %
+            traceback.format_exc())
+
+
 @client.event
 async def on_ready():
   """
   Tells us when the bot is logged in to discord (in the replit console)
   """
 
-  # Enable slash commands like /fss_add
-  await tree.sync(guild=discord.Object(id=MY_GUILD))
+  # Send what was queued while the bot was disconnected
+  discordScheduler.resume()
+
+  # Scan servers regulary. on_ready is called again after every reconnect, but one loop is enough
+  global pollTask
+  if pollTask is None or pollTask.done():
+    pollTask = client.loop.create_task(update_status_embeds())
+
+  # Write changes to the database regularly. This is started before anything below can fail
+  global storeFlushTask
+  if storeFlushTask is None:
+    storeFlushTask = client.loop.create_task(store.run())
+    if heatmapStore is not None:
+      client.loop.create_task(save_heatmaps())
+    if playerHistory is not None:
+      client.loop.create_task(flush_player_history())
+    client.loop.create_task(measure_event_loop_lag())
+    client.loop.create_task(loopWatchdog.run())
+
+  # Enable slash commands like /fss_add in every guild. Syncing counts against the rate limits,
+  # so it only happens if the commands changed
+  global syncedCommandTreeFingerprint
+  try:
+    fingerprint = command_tree_fingerprint()
+  except:
+    # Syncing too often is better than not registering the commands at all
+    print("WARN: Could not fingerprint the slash commands, syncing them: %s" %
+          traceback.format_exc())
+    fingerprint = None
+  try:
+    if fingerprint is None or fingerprint != syncedCommandTreeFingerprint:
+      # The database is only asked after a restart
+      if fingerprint is None or fingerprint != store.get_value(
+          "commandTreeFingerprint"):
+        await sync_command_tree()
+        if fingerprint is not None:
+          store.set_value("commandTreeFingerprint", fingerprint)
+      syncedCommandTreeFingerprint = fingerprint
+  except:
+    print("WARN: Could not sync the slash commands: %s" %
+          traceback.format_exc())
 
+  # Discord's own reconnects are not announced
+  global startAnnounced, recovering
   if (statusChannelId is not None):
     statusChannel = client.get_channel(statusChannelId)
+    try:
+      if statusChannel is None:
+        print("WARN: Could not find the status channel %s" % statusChannelId)
+      elif recovering:
+        await statusChannel.send(content="Bot recovered from exception")
+        print("Bot recovered from exception")
+        recovering = False
+        store.set_value("recovery", False)
+      elif not startAnnounced:
+        await statusChannel.send(content="Bot was restarted")
+        print("Bot was restarted")
+    except:
+      print("WARN: Could not post to the status channel: %s" %
+            traceback.format_exc())
+  startAnnounced = True
 
-    if db["recovery"] == True:
-      await statusChannel.send(content="Bot recovered from exception")
-      print("Bot recovered from exception")
-      db["recovery"] = False
-    else:
-      await statusChannel.send(content="Bot was restarted")
-      print("Bot was restarted")
 
-  # Scan servers regulary
-  client.loop.create_task(update_status_embeds())
+@client.event
+async def on_disconnect():
+  # Keep the discord requests until the connection is back
+  discordScheduler.pause()
 
 
-# Build a ditionary of server configuration objects from the database
-if db.get("servers") == None:
-  db["servers"] = {}
+@client.event
+async def on_resumed():
+  discordScheduler.resume()
 
-serversInDb = db["servers"]
-serverConfigs = {}
-for serverIdentifier in serversInDb:
-  serverJson = serversInDb[serverIdentifier]
-  serverObj = ServerConfiguration.from_json(serverJson)
-  serverConfigs[serverObj.identifier] = serverObj
 
-serverStatus = {}
-if db.get("serverStatus") == None:
-  db["serverStatus"] = {}
-  for serverIdentifier in serverConfigs:
-    db["serverStatus"][serverIdentifier] = ServerStatus(
-      serverConfigs[serverIdentifier]).to_json()
-
-serverStatusInDb = db["serverStatus"]
-for serverIdentifier in serversInDb:
-  if serverStatusInDb.get(serverIdentifier):
-    serverStatus[serverIdentifier] = ServerStatus.from_json(
-      serverStatusInDb[serverIdentifier], serverConfigs[serverIdentifier])
-    print("Restored server status for %s" %
-          serverStatus[serverIdentifier].name)
-  else:
-    serverStatus[serverIdentifier] = ServerStatus(
-      serverConfigs[serverIdentifier])
-    print("No status stored for server identifier %s" % serverIdentifier)
+async def run_bot(token):
+  """
+  Keeps the bot connected to discord. Whenever the client fails, it is reset and reconnects
+  after a growing delay, while the servers are still polled and the discord requests are queued.
+  Returns once reconnecting failed too often in a row
+  """
+  global recovering
+  failedAttempts = 0
+  while True:
+    startTime = time.monotonic()
+    try:
+      print("Running client")
+      await client.start(token)
+    except:
+      print(traceback.format_exc())
 
-statusChannelId = db.get("statuschannel")
-statusChannel = None
+    # This point is usually reached when too many replit bots used the same IP and cloudflare
+    # treats it as one spam bot
+    discordScheduler.pause()
+    if not client.is_closed():
+      await client.close()
+    client.clear()
+    if time.monotonic() - startTime >= STABLE_CONNECTION_TIME:
+      failedAttempts = 0
+    failedAttempts += 1
+    recovering = True
+    if failedAttempts >= MAX_RECONNECT_ATTEMPTS:
+      return
+    delay = min(RECONNECT_MAX_DELAY,
+                RECONNECT_MIN_DELAY * 2**(failedAttempts - 1))
+    print("WARN: Lost the connection to discord (attempt %d of %d), "
+          "reconnecting in %d seconds" %
+          (failedAttempts, MAX_RECONNECT_ATTEMPTS, delay))
+    await asyncio.sleep(delay)
+
+
+def command_tree_fingerprint():
+  """Hashes the payload which syncing the slash commands sends to discord"""
+  commands = [
+    # discord.py 2.4 and newer need the tree to build the payload, 2.1 takes no arguments
+    command.to_dict(tree)
+    if "tree" in inspect.signature(command.to_dict).parameters else
+    command.to_dict() for command in sorted(tree.get_commands(),
+                                            key=lambda command: command.name)
+  ]
+  return hashlib.sha1(
+    json.dumps(commands, sort_keys=True).encode("utf-8")).hexdigest()
+
+
+async def sync_command_tree():
+  print("INFO: The slash commands changed, syncing them")
+  await tree.sync()
+  try:
+    # The commands used to be registered for the original guild only. Remove those, since they
+    # would show up twice otherwise
+    legacyGuild = discord.Object(id=LEGACY_GUILD_ID)
+    tree.clear_commands(guild=legacyGuild)
+    await tree.sync(guild=legacyGuild)
+  except discord.HTTPException:
+    print("WARN: Could not remove the commands of the original guild: %s" %
+          traceback.format_exc())
+
+
+@client.event
+async def on_guild_channel_delete(channel):
+  """
+  Stops using a channel for status embeds, member logs or renames once it has been deleted
+  """
+  for serverConfig in serverRegistry.for_channel(channel.id) + \
+      serverRegistry.for_voice_channel(channel.id):
+    if serverConfig.has_status_embed() and int(
+        serverConfig.statusChannelId) == channel.id:
+      message = statusMessages.pop(serverConfig.key, None)
+      if message is not None:
+        statusEmbedTracker.forget(message.id)
+      serverConfig.set_status_embed(None, None)
+    if serverConfig.has_member_log_channel() and int(
+        serverConfig.memberLogChannelId) == channel.id:
+      serverConfig.set_member_log_channel(None)
+    if serverConfig.has_voice_channel() and int(
+        serverConfig.voiceChannelId) == channel.id:
+      serverConfig.set_voice_channel(None, None)
+    serverRegistry.reindex(serverConfig)
+    store_server_config(serverConfig)
+    print("INFO: Channel %s of server %s was deleted" %
+          (channel.id, serverConfig.key))
+
+
+def load_servers():
+  """
+  Fills the server registry and the last known status of each server from the database
+  """
+  serversInDb = store.load("servers")
+  for serverKey in serversInDb:
+    serverObj = ServerConfiguration.from_json(serversInDb[serverKey],
+                                              defaultGuildId=LEGACY_GUILD_ID)
+    serverRegistry.add(serverObj)
+    # Servers used to be stored by their identifier only
+    if serverKey != serverObj.key:
+      store.delete("servers", serverKey)
+      store_server_config(serverObj)
+
+  # Statuses are shared by all guilds which watch the same server
+  serverStatusInDb = store.load("serverStatus")
+  for serverIdentifier in serverRegistry.hosts():
+    serverConfig = serverRegistry.primary(serverIdentifier)
+    if serverStatusInDb.get(serverIdentifier):
+      serverStatus[serverIdentifier] = ServerStatus.from_json(
+        serverStatusInDb[serverIdentifier], serverConfig)
+      # Only the hash for now, the mod list itself is loaded after the first cycle
+      modsHash = serverStatusInDb[serverIdentifier].get("modsHash")
+      if modsHash is not None:
+        serverStatus[serverIdentifier].mods = ModList(modsHash, None)
+    else:
+      serverStatus[serverIdentifier] = ServerStatus(serverConfig)
+      store.mark_dirty("serverStatus", serverIdentifier,
+                       serverStatus[serverIdentifier].to_json)
+      print("No status stored for server identifier %s" % serverIdentifier)
+  print("Restored %d server statuses" % len(serverStatusInDb))
 
-# Check if bot was started manually or tried recovery by killing the shell
-if db.get("recovery") == None:
-  db["recovery"] = False
 
-# Run the bot
-discord_token = os.environ['DISCORD_TOKEN']
-while True:
+async def load_mod_lists():
+  """
+  Restores the mod lists of the servers from the database, so changes can be reported after a
+  restart. Only happens once, no matter how often this is called, unless it failed. Returns the
+  stored mod lists by their hash, or raises the error of the last attempt until a retry is due
+  """
+  global modListsLoadTask
+  failed = modListsLoadTask is not None and modListsLoadTask.done() and (
+    modListsLoadTask.cancelled() or modListsLoadTask.exception() is not None)
+  if modListsLoadTask is None or (failed
+                                  and time.monotonic() >= modListsRetryAt):
+    modListsLoadTask = asyncio.ensure_future(_load_mod_lists())
+  return await asyncio.shield(modListsLoadTask)
+
+
+async def preload_mod_lists():
+  """Loads the mod lists in the background. If that fails, they are loaded again when needed"""
+  try:
+    await load_mod_lists()
+  except:
+    pass
+
+
+async def _load_mod_lists():
+  global modListsLoadFailures, modListsRetryAt
   try:
-    print("Running client")
-    client.run(discord_token)
+    modListsInDb = await asyncio.get_event_loop().run_in_executor(
+      None, store.load, "modLists")
   except:
-    print(traceback.format_exc())
+    modListsLoadFailures += 1
+    delay = min(MOD_LISTS_RETRY_DELAY * 2**(modListsLoadFailures - 1),
+                MOD_LISTS_MAX_RETRY_DELAY)
+    modListsRetryAt = time.monotonic() + delay
+    print("WARN: Could not load the mod lists, retrying in %d seconds: %s" %
+          (delay, traceback.format_exc()))
+    raise
+  modListsLoadFailures = 0
+  usedModsHashes = set()
+  for serverData in serverStatus.values():
+    if serverData.mods is None:
+      continue
+    usedModsHashes.add(serverData.mods.hash)
+    if not serverData.mods.is_loaded() and serverData.mods.hash in modListsInDb:
+      serverData.mods = modListCache.get(
+        serverData.mods.hash) or modListCache.add(
+          ModList.from_json(serverData.mods.hash,
+                            modListsInDb[serverData.mods.hash]))
+
+  # Drop mod lists which no server uses anymore
+  for modsHash in modListsInDb:
+    if modsHash not in usedModsHashes:
+      store.delete("modLists", modsHash)
+  return modListsInDb
+
+
+serverRegistry = ServerRegistry()
+# Host identifier => status, shared by all guilds which watch that host
+serverStatus = {}
+statusChannelId = None
+statusChannel = None
+
+if __name__ == "__main__":
+  # Set FSS_METRICS_PORT to expose runtime metrics in the Prometheus format. They are only
+  # reachable from this machine unless FSS_METRICS_HOST is set, e.g. to 0.0.0.0
+  metricsPort = os.environ.get("FSS_METRICS_PORT", "")
+  if metricsPort:
+    start_metrics_server(int(metricsPort),
+                         os.environ.get("FSS_METRICS_HOST", "127.0.0.1"))
+
+  load_servers()
+  statusChannelId = store.get_value("statuschannel")
+
+  # Check if bot was started manually or tried recovery by killing the shell
+  if store.get_value("recovery") == None:
+    store.set_value("recovery", False)
+  recovering = store.get_value("recovery") == True
+
+  # Run the bot
+  discord_token = os.environ['DISCORD_TOKEN']
+  while True:
+    try:
+      asyncio.get_event_loop().run_until_complete(run_bot(discord_token))
+    except:
+      print(traceback.format_exc())
 
-  # This point is usually reached when too many replit bots used the same IP
-  # and cloudflare treats it as one spam bot
-  print("Killing shell in hopes of getting a new IP")
-  db["recovery"] = True
-  os.system('kill 1')
+    # Reconnecting did not help. Restarting the shell usually gives the bot a new IP
+    print("Killing shell in hopes of getting a new IP")
+    if FLUSH_ON_SHUTDOWN:
+      mark_playtime_dirty(force=True)
+      store.flush_sync()
+      if heatmapStore is not None:
+        heatmapStore.save()
+      if playerHistory is not None:
+        playerHistory.flush()
+    store.set_value("recovery", True)
+    os.system('kill 1')
@@ -0,0 +1,83 @@
+import discord
+
+# Every event is sent as a separate message
+BATCHING_OFF = "off"
+# Events are sent as separate embeds, but up to ten embeds share one message
+BATCHING_EMBEDS = "embeds"
+# Events are combined into a single multi-line embed
+BATCHING_COMPACT = "compact"
+
+# Limits imposed by discord
+MAX_EMBEDS_PER_MESSAGE = 10
+MAX_CHARACTERS_PER_MESSAGE = 6000
+MAX_DESCRIPTION_LENGTH = 4096
+
+
+class MemberLogBatcher:
+  """
+  Collects the member log events of a polling cycle for all channels, so they can be sent in
+  as few messages as possible. Events keep their order within a channel.
+  """
+
+  def __init__(self, mode=BATCHING_EMBEDS):
+    if mode not in (BATCHING_OFF, BATCHING_EMBEDS, BATCHING_COMPACT):
+      raise ValueError("Unknown member log batching mode: %s" % mode)
+    self.mode = mode
+    # Channel ID => (channel, list of embeds)
+    self.pendingEvents = {}
+
+  def add(self, channel, embed):
+    self.pendingEvents.setdefault(channel.id, (channel, []))[1].append(embed)
+
+  def take_messages(self):
+    """
+    Returns a list of (channel, embeds) tuples, one for each message which needs to be sent,
+    and forgets about the collected events.
+    """
+    messages = []
+    for channel, embeds in self.pendingEvents.values():
+      if self.mode == BATCHING_OFF:
+        messages.extend((channel, [embed]) for embed in embeds)
+      elif self.mode == BATCHING_EMBEDS:
+        messages.extend((channel, batch) for batch in _pack_embeds(embeds))
+      else:
+        messages.extend((channel, [embed]) for embed in _combine_embeds(embeds))
+    self.pendingEvents = {}
+    return messages
+
+
+def _pack_embeds(embeds):
+  """Splits the embeds into batches which fit into a single message each"""
+  batch = []
+  batchLength = 0
+  for embed in embeds:
+    if batch and (len(batch) == MAX_EMBEDS_PER_MESSAGE
+                  or batchLength + len(embed) > MAX_CHARACTERS_PER_MESSAGE):
+      yield batch
+      batch = []
+      batchLength = 0
+    batch.append(embed)
+    batchLength += len(embed)
+  if batch:
+    yield batch
+
+
+def _combine_embeds(embeds):
+  """Combines the descriptions of the embeds into as few multi-line embeds as possible"""
+  lines = []
+  length = 0
+  color = None
+  for embed in embeds:
+    description = embed.description or ""
+    if lines and length + 1 + len(description) > MAX_DESCRIPTION_LENGTH:
+      yield discord.Embed(description="\n".join(lines), color=color)
+      lines = []
+    if not lines:
+      # The combined embed uses the color of its first event
+      color = embed.color
+      length = len(description)
+    else:
+      length += 1 + len(description)
+    lines.append(description)
+  if lines:
+    yield discord.Embed(description="\n".join(lines), color=color)
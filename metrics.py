@@ -0,0 +1,262 @@
+import asyncio
+import bisect
+import hashlib
+import threading
+import time
+
+# Default histogram buckets, in seconds
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5,
+                   5.0, 10.0)
+
+
+def _escape(value):
+  return str(value).replace("\\", "\\\\").replace("\n",
+                                                  "\\n").replace('"', '\\"')
+
+
+def _format_labels(labelNames, labelValues, extra=()):
+  pairs = list(zip(labelNames, labelValues)) + list(extra)
+  if not pairs:
+    return ""
+  return "{%s}" % ",".join('%s="%s"' % (name, _escape(value))
+                           for name, value in pairs)
+
+
+def server_label(host):
+  """
+  Identifies a server in the labels without revealing its address, since the servers of all
+  guilds show up in the same metrics
+  """
+  return hashlib.sha1(host.encode("utf-8")).hexdigest()[:12]
+
+
+class _Timer:
+
+  def __init__(self, histogram, labelValues):
+    self.histogram = histogram
+    self.labelValues = labelValues
+
+  def __enter__(self):
+    self.start = time.perf_counter()
+    return self
+
+  def __exit__(self, *args):
+    self.histogram.observe(time.perf_counter() - self.start,
+                           *self.labelValues)
+
+
+class _Metric:
+
+  def __init__(self, registry, name, description, labelNames):
+    self.lock = registry.lock
+    self.name = name
+    self.description = description
+    self.labelNames = tuple(labelNames)
+    self.values = {}
+
+  def remove(self, *labelValues):
+    with self.lock:
+      self.values.pop(labelValues, None)
+
+  def take(self):
+    """Returns the values recorded since the last call as JSON and starts over"""
+    with self.lock:
+      values = self.values
+      self.values = {}
+    return [[list(labels), value] for labels, value in values.items()]
+
+
+class Counter(_Metric):
+  type = "counter"
+
+  def inc(self, *labelValues, amount=1):
+    with self.lock:
+      self.values[labelValues] = self.values.get(labelValues, 0) + amount
+
+  def merge(self, entries):
+    """Adds values which were taken from the same metric in another process"""
+    for labels, value in entries:
+      self.inc(*labels, amount=value)
+
+  def render(self):
+    return [
+      "%s%s %s" % (self.name, _format_labels(self.labelNames, labels), value)
+      for labels, value in self.values.items()
+    ]
+
+
+class Gauge(Counter):
+  type = "gauge"
+
+  def set(self, value, *labelValues):
+    with self.lock:
+      self.values[labelValues] = value
+
+  def merge(self, entries):
+    for labels, value in entries:
+      self.set(value, *labels)
+
+
+class Histogram(_Metric):
+  type = "histogram"
+
+  def __init__(self, registry, name, description, labelNames, buckets):
+    _Metric.__init__(self, registry, name, description, labelNames)
+    self.buckets = tuple(buckets)
+
+  def observe(self, value, *labelValues):
+    with self.lock:
+      entry = self.values.get(labelValues)
+      if entry is None:
+        # One count per bucket plus +Inf, then the sum
+        entry = [0] * (len(self.buckets) + 1) + [0.0]
+        self.values[labelValues] = entry
+      entry[bisect.bisect_left(self.buckets, value)] += 1
+      entry[-1] += value
+
+  def time(self, *labelValues):
+    """Returns a context manager which observes the time spent inside of it"""
+    return _Timer(self, labelValues)
+
+  def merge(self, entries):
+    with self.lock:
+      for labels, takenEntry in entries:
+        entry = self.values.setdefault(tuple(labels),
+                                       [0] * (len(self.buckets) + 1) + [0.0])
+        for index, value in enumerate(takenEntry):
+          entry[index] += value
+
+  def render(self):
+    lines = []
+    for labels, entry in self.values.items():
+      cumulative = 0
+      for bound, count in zip(self.buckets + ("+Inf", ), entry[:-1]):
+        cumulative += count
+        lines.append("%s_bucket%s %s" %
+                     (self.name,
+                      _format_labels(self.labelNames, labels,
+                                     [("le", bound)]), cumulative))
+      lines.append("%s_sum%s %s" %
+                   (self.name, _format_labels(self.labelNames,
+                                              labels), entry[-1]))
+      lines.append("%s_count%s %s" %
+                   (self.name, _format_labels(self.labelNames,
+                                              labels), cumulative))
+    return lines
+
+
+class MetricsRegistry:
+  """
+  Collects metrics and renders them in the Prometheus text format. All metrics share one lock,
+  since they are updated from the event loop and from worker threads.
+  """
+
+  def __init__(self):
+    self.lock = threading.Lock()
+    self.metrics = []
+
+  def counter(self, name, description, labelNames=()):
+    return self._add(Counter(self, name, description, labelNames))
+
+  def gauge(self, name, description, labelNames=()):
+    return self._add(Gauge(self, name, description, labelNames))
+
+  def histogram(self,
+                name,
+                description,
+                labelNames=(),
+                buckets=DEFAULT_BUCKETS):
+    return self._add(
+      Histogram(self, name, description, labelNames, buckets))
+
+  def _add(self, metric):
+    self.metrics.append(metric)
+    return metric
+
+  def take(self, metrics):
+    """
+    Returns what the given metrics recorded since the last call, and resets them. Worker processes
+    send this to the bot, which adds it to its own metrics with merge()
+    """
+    return {
+      metric.name: taken
+      for metric, taken in ((metric, metric.take()) for metric in metrics)
+      if taken
+    }
+
+  def merge(self, takenMetrics):
+    for metric in self.metrics:
+      if metric.name in takenMetrics:
+        metric.merge(takenMetrics[metric.name])
+
+  def render(self):
+    lines = []
+    with self.lock:
+      for metric in self.metrics:
+        lines.append("# HELP %s %s" % (metric.name, metric.description))
+        lines.append("# TYPE %s %s" % (metric.name, metric.type))
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+registry = MetricsRegistry()
+
+FETCH_SECONDS = registry.histogram("fss_fetch_seconds",
+                                   "Time spent fetching the status XML",
+                                   ["server"])
+PARSE_SECONDS = registry.histogram("fss_parse_seconds",
+                                   "Time spent parsing the status XML",
+                                   ["server"])
+DIFF_SECONDS = registry.histogram(
+  "fss_diff_seconds", "Time spent comparing the player list to the previous one",
+  ["server"])
+FEED_BYTES = registry.gauge("fss_feed_bytes",
+                            "Size of the last fetched status XML", ["server"])
+DISCORD_REQUESTS = registry.counter("fss_discord_requests_total",
+                                    "Discord API requests by result",
+                                    ["route", "result"])
+DISCORD_REQUEST_SECONDS = registry.histogram(
+  "fss_discord_request_seconds", "Duration of discord API requests",
+  ["route"])
+DISCORD_RATE_LIMITS = registry.counter(
+  "fss_discord_rate_limits_total", "429 responses received from discord",
+  ["route"])
+CYCLE_SECONDS = registry.histogram(
+  "fss_cycle_seconds", "Duration of a polling cycle including embed updates")
+EVENT_LOOP_LAG_SECONDS = registry.gauge(
+  "fss_event_loop_lag_seconds", "How late the last event loop tick was")
+DB_WRITES = registry.counter("fss_db_writes_total",
+                             "Batches written to the database",
+                             ["namespace", "result"])
+
+
+async def measure_event_loop_lag(interval=1.0):
+  """Regularly checks how much later than requested a sleep wakes up"""
+  while True:
+    start = time.perf_counter()
+    await asyncio.sleep(interval)
+    EVENT_LOOP_LAG_SECONDS.set(
+      max(0.0, time.perf_counter() - start - interval))
+
+
+def start_metrics_server(port, host="127.0.0.1"):
+  """Serves /metrics with Flask in a background thread, so the event loop is never blocked"""
+  from flask import Flask, Response
+
+  app = Flask("fss_metrics")
+
+  @app.route("/metrics")
+  def metrics_endpoint():
+    return Response(registry.render(),
+                    mimetype="text/plain; version=0.0.4")
+
+  thread = threading.Thread(target=app.run,
+                            kwargs={
+                              "host": host,
+                              "port": port,
+                              "threaded": True,
+                              "use_reloader": False
+                            },
+                            daemon=True)
+  thread.start()
+  return thread
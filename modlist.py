@@ -0,0 +1,164 @@
+import hashlib
+import weakref
+import xml.etree.ElementTree as ET
+
+# The longest mod change description, so it fits into an embed together with its title
+MAX_DESCRIPTION_LENGTH = 3800
+
+
+class Mod:
+  """
+  A single mod as listed in the Mods section of the status XML
+  """
+  __slots__ = ("name", "author", "version", "hash", "title")
+
+  def __init__(self, name, author, version, hash, title):
+    self.name = name
+    self.author = author
+    self.version = version
+    self.hash = hash
+    self.title = title
+
+  def to_json(self):
+    return [self.name, self.author, self.version, self.hash, self.title]
+
+
+class ModList:
+  """
+  The mods of a server. Identified by the hash of the raw Mods section, so servers which run the
+  same modpack share one instance.
+  """
+  __slots__ = ("hash", "mods", "__weakref__")
+
+  def __init__(self, hash, mods):
+    self.hash = hash
+    # Mod name => Mod. None if only the hash was restored from the database so far
+    self.mods = mods
+
+  def is_loaded(self):
+    return self.mods is not None
+
+  def __len__(self):
+    return len(self.mods)
+
+  def to_json(self):
+    return [mod.to_json() for mod in self.mods.values()]
+
+  @staticmethod
+  def from_json(hash, j):
+    return ModList(hash, {entry[0]: Mod(*entry) for entry in j})
+
+
+class ModChanges:
+  """
+  Describes how the mods of a server changed
+  """
+
+  def __init__(self, added=(), removed=(), updated=()):
+    self.added = list(added)
+    self.removed = list(removed)
+    # (previous Mod, current Mod) pairs
+    self.updated = list(updated)
+
+  def __bool__(self):
+    return bool(self.added or self.removed or self.updated)
+
+
+def extract_mods_section(data):
+  """
+  Returns the raw bytes of the Mods section of the status XML, or None if there is none. This
+  only searches the bytes, nothing gets parsed.
+  """
+  # The section is close to the end of the feed, after the vehicles
+  start = data.rfind(b"<Mods")
+  if start < 0:
+    return None
+  end = data.find(b"</Mods>", start)
+  if end >= 0:
+    return data[start:end + len(b"</Mods>")]
+  # A server without mods has an empty element
+  end = data.find(b"/>", start)
+  return data[start:end + 2] if end >= 0 else None
+
+
+def parse_mods_section(section):
+  mods = {}
+  for element in ET.fromstring(section).iter("Mod"):
+    attributes = element.attrib
+    name = attributes.get("name", "")
+    mods[name] = Mod(name, attributes.get("author", ""),
+                     attributes.get("version", ""), attributes.get("hash", ""),
+                     element.text or name)
+  return mods
+
+
+def diff_mods(previous, current):
+  """Compares two ModList objects"""
+  if previous.hash == current.hash:
+    return ModChanges()
+  previousNames = previous.mods.keys()
+  currentNames = current.mods.keys()
+  return ModChanges(
+    added=[current.mods[name] for name in currentNames - previousNames],
+    removed=[previous.mods[name] for name in previousNames - currentNames],
+    updated=[(previous.mods[name], current.mods[name])
+             for name in currentNames & previousNames
+             if previous.mods[name].version != current.mods[name].version
+             or previous.mods[name].hash != current.mods[name].hash])
+
+
+def describe_mod_changes(changes):
+  """Builds the text of a member log message about changed mods"""
+  lines = []
+  for mod in sorted(changes.added, key=lambda mod: mod.name):
+    lines.append("➕ %s %s" % (mod.title, mod.version))
+  for previousMod, mod in sorted(changes.updated,
+                                 key=lambda mods: mods[1].name):
+    if previousMod.version != mod.version:
+      lines.append("🔄 %s %s → %s" %
+                   (mod.title, previousMod.version, mod.version))
+    else:
+      lines.append("🔄 %s %s (changed without a new version)" %
+                   (mod.title, mod.version))
+  for mod in sorted(changes.removed, key=lambda mod: mod.name):
+    lines.append("➖ %s" % mod.title)
+
+  description = ""
+  for index, line in enumerate(lines):
+    if len(description) + len(line) + 1 > MAX_DESCRIPTION_LENGTH:
+      description += "... and %d more" % (len(lines) - index)
+      break
+    description += line + "\n"
+  return description.rstrip("\n")
+
+
+class ModListCache:
+  """
+  Parses the Mods section of a status XML only if no server is known to run that exact mod
+  list already. Entries are dropped once no server uses them anymore.
+  """
+
+  def __init__(self):
+    # Section hash => ModList
+    self.modLists = weakref.WeakValueDictionary()
+    self.parseCount = 0
+
+  def add(self, modList):
+    """Makes a mod list which was restored from the database known to the cache"""
+    return self.modLists.setdefault(modList.hash, modList)
+
+  def get(self, hash):
+    return self.modLists.get(hash)
+
+  def lookup(self, data):
+    """Returns the ModList of the given status XML, or None if it does not list any mods"""
+    section = extract_mods_section(data)
+    if section is None:
+      return None
+    hash = hashlib.sha1(section).hexdigest()
+    modList = self.modLists.get(hash)
+    if modList is None:
+      modList = ModList(hash, parse_mods_section(section))
+      self.modLists[hash] = modList
+      self.parseCount += 1
+    return modList
@@ -0,0 +1,304 @@
+import asyncio
+import json
+import sqlite3
+import threading
+import traceback
+from metrics import DB_WRITES
+
+# The key under which the snapshot of the snapshot namespaces is stored
+SNAPSHOT_KEY = "snapshot"
+
+
+class ReplitDbBackend:
+  """
+  Stores everything in the replit database. Each namespace is stored as a single key, so a flush
+  costs one remote write per namespace.
+  """
+
+  def __init__(self):
+    from replit import db
+    self.db = db
+    # Namespace => entries, so a write does not need to read the namespace first
+    self.namespaces = {}
+
+  def load(self, namespace):
+    # Read the raw JSON so we get plain dictionaries instead of observed ones
+    try:
+      entries = json.loads(self.db.get_raw(namespace)) or {}
+    except KeyError:
+      entries = {}
+    self.namespaces[namespace] = entries
+    return dict(entries)
+
+  def write(self, namespace, updates, deletions):
+    if namespace not in self.namespaces:
+      self.load(namespace)
+    entries = dict(self.namespaces[namespace])
+    for key in deletions:
+      entries.pop(key, None)
+    entries.update(updates)
+    self.db[namespace] = entries
+    self.namespaces[namespace] = entries
+
+  def get_value(self, key, default=None):
+    return self.db.get(key, default)
+
+  def set_value(self, key, value):
+    self.db[key] = value
+
+  def get_raw_value(self, key):
+    try:
+      return self.db.get_raw(key)
+    except KeyError:
+      return None
+
+  def set_raw_value(self, key, text):
+    self.db.set_raw(key, text)
+
+  def close(self):
+    pass
+
+
+class SqliteBackend:
+  """
+  Stores everything in a local SQLite file. Useful for running the bot outside of replit.
+  """
+
+  def __init__(self, path):
+    self.lock = threading.Lock()
+    self.connection = sqlite3.connect(path, check_same_thread=False)
+    with self.lock, self.connection:
+      self.connection.execute(
+        "CREATE TABLE IF NOT EXISTS entries (namespace TEXT NOT NULL, key TEXT NOT NULL, "
+        "value TEXT NOT NULL, PRIMARY KEY (namespace, key))")
+
+  def load(self, namespace):
+    with self.lock:
+      rows = self.connection.execute(
+        "SELECT key, value FROM entries WHERE namespace = ?",
+        (namespace, )).fetchall()
+    return {key: json.loads(value) for key, value in rows}
+
+  def write(self, namespace, updates, deletions):
+    with self.lock, self.connection:
+      self.connection.executemany(
+        "DELETE FROM entries WHERE namespace = ? AND key = ?",
+        [(namespace, key) for key in deletions])
+      self.connection.executemany(
+        "INSERT OR REPLACE INTO entries (namespace, key, value) VALUES (?, ?, ?)",
+        [(namespace, key, json.dumps(value))
+         for key, value in updates.items()])
+
+  def get_value(self, key, default=None):
+    text = self.get_raw_value(key)
+    return json.loads(text) if text is not None else default
+
+  def set_value(self, key, value):
+    self.write("", {key: value}, [])
+
+  def get_raw_value(self, key):
+    with self.lock:
+      row = self.connection.execute(
+        "SELECT value FROM entries WHERE namespace = '' AND key = ?",
+        (key, )).fetchone()
+    return row[0] if row is not None else None
+
+  def set_raw_value(self, key, text):
+    with self.lock, self.connection:
+      self.connection.execute(
+        "INSERT OR REPLACE INTO entries (namespace, key, value) VALUES ('', ?, ?)",
+        (key, text))
+
+  def close(self):
+    with self.lock:
+      self.connection.close()
+
+
+def create_backend(name, sqlitePath="fss.sqlite3"):
+  if name == "replit":
+    return ReplitDbBackend()
+  if name == "sqlite":
+    return SqliteBackend(sqlitePath)
+  raise ValueError("Unknown storage backend: %s" % name)
+
+
+class WriteBehindStore:
+  """
+  Sits in front of a storage backend and collects changed objects in memory. They are written
+  in batches in the background, off the event loop. Objects whose serialized form did not change
+  since the last write are skipped.
+
+  The entries of the snapshot namespaces are not stored per namespace, but together in a single
+  snapshot value, so everything which is needed at startup can be read at once.
+  """
+
+  def __init__(self, backend, flushInterval=30, snapshotNamespaces=()):
+    self.backend = backend
+    self.flushInterval = flushInterval
+    self.snapshotNamespaces = tuple(snapshotNamespaces)
+    # The snapshot as read from the backend, until its namespaces have been loaded
+    self.snapshot = None
+    # Namespace => {key => JSON string} of what the stored snapshot contains
+    self.snapshotEntries = {
+      namespace: {}
+      for namespace in self.snapshotNamespaces
+    }
+    # True if the snapshot needs to be written even though none of its entries changed
+    self.snapshotDirty = False
+    # (namespace, key) => function which returns the JSON compatible value to be stored
+    self.dirty = {}
+    # (namespace, key) of entries which need to be deleted
+    self.deleted = set()
+    # (namespace, key) => JSON string which was stored last
+    self.stored = {}
+    self.flushLock = threading.Lock()
+
+  def load(self, namespace):
+    if namespace in self.snapshotNamespaces:
+      return self._load_from_snapshot(namespace)
+    entries = self.backend.load(namespace)
+    for key, value in entries.items():
+      self.stored[(namespace, key)] = _dump(value)
+    return entries
+
+  def _load_from_snapshot(self, namespace):
+    if self.snapshot is None:
+      text = self.backend.get_raw_value(SNAPSHOT_KEY)
+      self.snapshot = json.loads(text) if text else {}
+    entries = self.snapshot.pop(namespace, None)
+    if entries is None:
+      # Written before snapshots existed, so read the namespace itself once
+      entries = self.backend.load(namespace)
+      self.snapshotDirty = True
+    for key, value in entries.items():
+      dumped = _dump(value)
+      self.stored[(namespace, key)] = dumped
+      self.snapshotEntries[namespace][key] = dumped
+    return entries
+
+  def mark_dirty(self, namespace, key, serialize):
+    """Remembers that an object changed. serialize gets called on the next flush"""
+    self.deleted.discard((namespace, key))
+    self.dirty[(namespace, key)] = serialize
+
+  def delete(self, namespace, key):
+    self.dirty.pop((namespace, key), None)
+    self.deleted.add((namespace, key))
+
+  def get_value(self, key, default=None):
+    """Reads a single value directly from the backend"""
+    return self.backend.get_value(key, default)
+
+  def set_value(self, key, value):
+    """Writes a single value directly to the backend"""
+    self.backend.set_value(key, value)
+
+  async def run(self):
+    """Flushes the changes regularly"""
+    while True:
+      await asyncio.sleep(self.flushInterval)
+      await self.flush()
+
+  async def flush(self):
+    """Writes all changes in a background thread"""
+    batches = self._take_batches()
+    if batches or self.snapshotDirty:
+      failures = await asyncio.get_event_loop().run_in_executor(
+        None, self._write, batches)
+      self._retry_later(failures)
+
+  def flush_sync(self):
+    """Writes all changes immediately, e.g. on shutdown"""
+    batches = self._take_batches()
+    if batches or self.snapshotDirty:
+      self._retry_later(self._write(batches))
+
+  def _take_batches(self):
+    # Objects are serialized on the calling thread, since they might be changed by the event loop
+    batches = {}
+    for (namespace, key), serialize in self.dirty.items():
+      value = serialize()
+      dumped = _dump(value)
+      if self.stored.get((namespace, key)) == dumped:
+        continue
+      batches.setdefault(namespace, ({}, set()))[0][key] = (value, dumped)
+    for namespace, key in self.deleted:
+      batches.setdefault(namespace, ({}, set()))[1].add(key)
+    self.dirty = {}
+    self.deleted = set()
+    return batches
+
+  def _write(self, batches):
+    """Writes the batches and returns the ones which failed"""
+    failures = {}
+    with self.flushLock:
+      snapshotBatches = {}
+      for namespace, (updates, deletions) in batches.items():
+        if namespace in self.snapshotNamespaces:
+          snapshotBatches[namespace] = (updates, deletions)
+          continue
+        try:
+          self.backend.write(
+            namespace, {key: value
+                        for key, (value, _) in updates.items()}, deletions)
+        except Exception:
+          DB_WRITES.inc(namespace, "error")
+          print("WARN: Failed writing %s: %s" %
+                (namespace, traceback.format_exc()))
+          failures[namespace] = (updates, deletions)
+          continue
+        DB_WRITES.inc(namespace, "ok")
+        self._mark_stored(namespace, updates, deletions)
+      if snapshotBatches or self.snapshotDirty:
+        failures.update(self._write_snapshot(snapshotBatches))
+    return failures
+
+  def _write_snapshot(self, batches):
+    entries = {
+      namespace: dict(self.snapshotEntries[namespace])
+      for namespace in self.snapshotNamespaces
+    }
+    for namespace, (updates, deletions) in batches.items():
+      for key in deletions:
+        entries[namespace].pop(key, None)
+      for key, (_, dumped) in updates.items():
+        entries[namespace][key] = dumped
+
+    # The entries are serialized already, so they only need to be joined
+    text = "{%s}" % ",".join("%s:{%s}" % (json.dumps(namespace), ",".join(
+      "%s:%s" % (json.dumps(key), dumped)
+      for key, dumped in namespaceEntries.items()))
+                             for namespace, namespaceEntries in entries.items())
+    try:
+      self.backend.set_raw_value(SNAPSHOT_KEY, text)
+    except Exception:
+      DB_WRITES.inc(SNAPSHOT_KEY, "error")
+      print("WARN: Failed writing the snapshot: %s" % traceback.format_exc())
+      return batches
+
+    DB_WRITES.inc(SNAPSHOT_KEY, "ok")
+    self.snapshotEntries = entries
+    self.snapshotDirty = False
+    for namespace, (updates, deletions) in batches.items():
+      self._mark_stored(namespace, updates, deletions)
+    return {}
+
+  def _mark_stored(self, namespace, updates, deletions):
+    for key, (_, dumped) in updates.items():
+      self.stored[(namespace, key)] = dumped
+    for key in deletions:
+      self.stored.pop((namespace, key), None)
+
+  def _retry_later(self, failures):
+    # Newer changes which were made during the write take precedence
+    for namespace, (updates, deletions) in failures.items():
+      for key, (value, _) in updates.items():
+        if (namespace, key) not in self.deleted:
+          self.dirty.setdefault((namespace, key), lambda value=value: value)
+      for key in deletions:
+        if (namespace, key) not in self.dirty:
+          self.deleted.add((namespace, key))
+
+
+def _dump(value):
+  return json.dumps(value, sort_keys=True)
@@ -0,0 +1,203 @@
+import os
+import re
+import shutil
+import numpy as np
+
+# Minute resolution is kept for this many minutes, hourly averages are kept forever
+MINUTES_KEPT = 48 * 60
+
+MINUTE_RECORD = np.dtype([("minute", "<u4"), ("count", "<u2")])
+HOUR_RECORD = np.dtype([("hour", "<u4"), ("samples", "<u2"), ("sum", "<u4"),
+                        ("max", "<u2")])
+SESSION_RECORD = np.dtype([("time", "<u4"), ("event", "u1"),
+                           ("player", "<u4")])
+
+EVENT_LOGIN = 1
+EVENT_LOGOUT = 2
+
+
+class _ServerHistory:
+  """
+  The files which store the history of a single server:
+  - minutes.bin: a ring buffer with the number of online players per minute
+  - hours.bin: hourly aggregates, appended whenever an hour is complete
+  - sessions.bin: login and logout events
+  - players.txt: the player names referenced by sessions.bin, one per line
+  """
+
+  def __init__(self, directory):
+    os.makedirs(directory, exist_ok=True)
+    self.directory = directory
+
+    minutesPath = os.path.join(directory, "minutes.bin")
+    if not os.path.exists(minutesPath):
+      np.zeros(MINUTES_KEPT, dtype=MINUTE_RECORD).tofile(minutesPath)
+    self.minutes = np.memmap(minutesPath, dtype=MINUTE_RECORD, mode="r+")
+
+    self.hoursPath = os.path.join(directory, "hours.bin")
+    self.lastStoredHour = None
+    if os.path.exists(self.hoursPath) and os.path.getsize(
+        self.hoursPath) >= HOUR_RECORD.itemsize:
+      with open(self.hoursPath, "rb") as f:
+        f.seek(-HOUR_RECORD.itemsize, os.SEEK_END)
+        self.lastStoredHour = int(
+          np.frombuffer(f.read(HOUR_RECORD.itemsize), dtype=HOUR_RECORD)[0]["hour"])
+
+    self.sessionsPath = os.path.join(directory, "sessions.bin")
+    self.playersPath = os.path.join(directory, "players.txt")
+    self.playerNames = []
+    if os.path.exists(self.playersPath):
+      with open(self.playersPath, encoding="utf-8") as f:
+        self.playerNames = f.read().splitlines()
+    self.playerIds = {name: i for i, name in enumerate(self.playerNames)}
+    # The appended files which were not synced to disk yet
+    self.unsyncedPaths = set()
+
+    # The minute of the most recent sample
+    self.lastMinute = int(self.minutes["minute"].max())
+
+  def record_count(self, minute, count):
+    # An hour is complete once the first sample of a later hour arrives
+    if self.lastMinute and minute // 60 > self.lastMinute // 60:
+      self._store_hour(self.lastMinute // 60)
+
+    slot = self.minutes[minute % MINUTES_KEPT]
+    if slot["minute"] == minute:
+      # Keep the peak if there are several samples within the same minute
+      count = max(count, int(slot["count"]))
+    self.minutes[minute % MINUTES_KEPT] = (minute, min(count, 65535))
+    self.lastMinute = max(self.lastMinute, minute)
+
+  def record_sessions(self, timestamp, event, playerNames):
+    if not playerNames:
+      return
+    records = np.zeros(len(playerNames), dtype=SESSION_RECORD)
+    records["time"] = timestamp
+    records["event"] = event
+    records["player"] = [self._player_id(name) for name in playerNames]
+    with open(self.sessionsPath, "ab") as f:
+      records.tofile(f)
+    self.unsyncedPaths.add(self.sessionsPath)
+
+  def _player_id(self, playerName):
+    playerId = self.playerIds.get(playerName)
+    if playerId is None:
+      playerId = len(self.playerNames)
+      self.playerNames.append(playerName)
+      self.playerIds[playerName] = playerId
+      with open(self.playersPath, "a", encoding="utf-8") as f:
+        f.write(playerName.replace("\n", " ") + "\n")
+      self.unsyncedPaths.add(self.playersPath)
+    return playerId
+
+  def _store_hour(self, hour):
+    if self.lastStoredHour is not None and hour <= self.lastStoredHour:
+      return
+    records = self.minutes[(self.minutes["minute"] >= hour * 60)
+                           & (self.minutes["minute"] < (hour + 1) * 60)]
+    if len(records) == 0:
+      return
+    counts = records["count"].astype(np.uint32)
+    aggregate = np.array(
+      [(hour, len(counts), counts.sum(), counts.max())], dtype=HOUR_RECORD)
+    with open(self.hoursPath, "ab") as f:
+      aggregate.tofile(f)
+    self.unsyncedPaths.add(self.hoursPath)
+    self.lastStoredHour = hour
+
+  def flush(self):
+    self.minutes.flush()
+    paths, self.unsyncedPaths = self.unsyncedPaths, set()
+    for path in paths:
+      with open(path, "ab") as f:
+        os.fsync(f.fileno())
+
+
+class PlayerHistory:
+  """
+  Stores the number of online players of every server over time, as well as all logins and
+  logouts. The data is kept in compact binary files, one directory per server.
+  """
+
+  def __init__(self, directory):
+    self.directory = directory
+    self.servers = {}
+
+  def _server(self, identifier):
+    history = self.servers.get(identifier)
+    if history is None:
+      history = _ServerHistory(self._path(identifier))
+      self.servers[identifier] = history
+    return history
+
+  def _path(self, identifier):
+    return os.path.join(self.directory, re.sub(r"[^\w.-]", "_", identifier))
+
+  def record_poll(self,
+                  identifier,
+                  timestamp,
+                  onlineCount,
+                  loggedIn=(),
+                  loggedOut=()):
+    """Records the result of a single poll. loggedIn and loggedOut are lists of player names"""
+    history = self._server(identifier)
+    history.record_count(int(timestamp) // 60, onlineCount)
+    history.record_sessions(int(timestamp), EVENT_LOGOUT, list(loggedOut))
+    history.record_sessions(int(timestamp), EVENT_LOGIN, list(loggedIn))
+
+  def query_counts(self, identifier, start, end):
+    """
+    Returns the number of online players between two unix timestamps as a pair of arrays
+    (timestamps, counts). Within the last 48 hours, there is one value per minute with samples.
+    Before that, there is one average value per hour.
+    """
+    history = self._server(identifier)
+    firstMinute = history.lastMinute - MINUTES_KEPT + 1
+    startMinute = int(start) // 60
+    endMinute = int(end) // 60
+
+    timestamps = []
+    counts = []
+    if startMinute < firstMinute and os.path.exists(history.hoursPath):
+      hours = np.fromfile(history.hoursPath, dtype=HOUR_RECORD)
+      # Hours are appended in order, so they can be searched in logarithmic time
+      lower = np.searchsorted(hours["hour"], startMinute // 60, side="left")
+      upper = np.searchsorted(hours["hour"],
+                              min(endMinute + 1, firstMinute) // 60,
+                              side="left")
+      selected = hours[lower:upper]
+      timestamps.append(selected["hour"].astype(np.int64) * 3600)
+      counts.append(selected["sum"] / selected["samples"])
+
+    minutes = history.minutes[(history.minutes["minute"] >= max(
+      startMinute, firstMinute))
+                              & (history.minutes["minute"] <= endMinute)
+                              & (history.minutes["minute"] > 0)]
+    minutes = np.sort(minutes, order="minute")
+    timestamps.append(minutes["minute"].astype(np.int64) * 60)
+    counts.append(minutes["count"].astype(np.float64))
+    return np.concatenate(timestamps), np.concatenate(counts)
+
+  def query_sessions(self, identifier, start, end):
+    """Returns a list of (timestamp, event, playerName) tuples between two unix timestamps"""
+    history = self._server(identifier)
+    if not os.path.exists(history.sessionsPath):
+      return []
+    sessions = np.memmap(history.sessionsPath,
+                         dtype=SESSION_RECORD,
+                         mode="r")
+    lower = np.searchsorted(sessions["time"], start, side="left")
+    upper = np.searchsorted(sessions["time"], end, side="right")
+    return [(int(s["time"]), int(s["event"]),
+             history.playerNames[int(s["player"])])
+            for s in sessions[lower:upper]]
+
+  def remove(self, identifier):
+    """Deletes the history of a server which is not watched anymore"""
+    self.servers.pop(identifier, None)
+    shutil.rmtree(self._path(identifier), ignore_errors=True)
+
+  def flush(self):
+    """Writes everything to disk. Can be called from a thread"""
+    for history in list(self.servers.values()):
+      history.flush()
@@ -0,0 +1,117 @@
+import bisect
+import datetime
+
+# The periods a leaderboard can cover
+PERIOD_DAY = "day"
+PERIOD_WEEK = "week"
+PERIOD_ALL = "all"
+PERIODS = (PERIOD_DAY, PERIOD_WEEK, PERIOD_ALL)
+
+
+def period_key(period, timestamp):
+  """Identifies the day or week (in UTC) a unix timestamp belongs to"""
+  if period == PERIOD_ALL:
+    return PERIOD_ALL
+  date = datetime.datetime.utcfromtimestamp(timestamp)
+  if period == PERIOD_DAY:
+    return "day " + date.strftime("%Y-%m-%d")
+  return "week %d-W%02d" % date.isocalendar()[:2]
+
+
+def board_key(periodKey, scope):
+  return "%s|%s" % (periodKey, scope)
+
+
+class _Board:
+  """
+  The playtime of every player within one scope and period. The ranking is kept sorted, so the
+  top players can be read without sorting.
+  """
+  __slots__ = ("minutes", "ranking")
+
+  def __init__(self):
+    # Player name => minutes
+    self.minutes = {}
+    # (-minutes, player name), best first
+    self.ranking = []
+
+  def add(self, playerName, minutes):
+    previous = self.minutes.get(playerName)
+    if previous is not None:
+      del self.ranking[bisect.bisect_left(self.ranking, (-previous, playerName))]
+      minutes += previous
+    self.minutes[playerName] = minutes
+    bisect.insort(self.ranking, (-minutes, playerName))
+
+  def top(self, count):
+    return [(playerName, -negativeMinutes)
+            for negativeMinutes, playerName in self.ranking[:count]]
+
+  def to_json(self):
+    return dict(self.minutes)
+
+
+class PlaytimeLedger:
+  """
+  Sums up how long players played, per scope (e.g. a server or a guild) and per day, week and in
+  total. A session is added once the player logs out, to the day and week of the logout. Only
+  the boards of the current day and week are kept.
+  """
+
+  def __init__(self):
+    # Board key => _Board
+    self.boards = {}
+
+  def record_session(self, scopes, playerName, minutes, timestamp):
+    """Adds a finished session and returns the keys of the boards which changed"""
+    if minutes <= 0:
+      return []
+    changedKeys = []
+    for period in PERIODS:
+      periodKey = period_key(period, timestamp)
+      for scope in scopes:
+        key = board_key(periodKey, scope)
+        board = self.boards.get(key)
+        if board is None:
+          board = self.boards[key] = _Board()
+        board.add(playerName, minutes)
+        changedKeys.append(key)
+    return changedKeys
+
+  def top(self, scope, period, count, timestamp):
+    """Returns up to count (player name, minutes) pairs, most minutes first"""
+    board = self.boards.get(board_key(period_key(period, timestamp), scope))
+    return board.top(count) if board is not None else []
+
+  def board_json(self, key):
+    board = self.boards.get(key)
+    return board.to_json() if board is not None else {}
+
+  def prune(self, timestamp):
+    """Drops the boards of past days and weeks and returns their keys"""
+    current = set(period_key(period, timestamp) for period in PERIODS)
+    removedKeys = [
+      key for key in self.boards if key.partition("|")[0] not in current
+    ]
+    for key in removedKeys:
+      del self.boards[key]
+    return removedKeys
+
+  def load(self, entries):
+    """
+    Adds the stored boards. Sessions which were recorded before are kept, and the keys of the
+    boards which contain them are returned, since those differ from the stored ones
+    """
+    changedKeys = list(self.boards)
+    for key, minutes in entries.items():
+      board = self.boards.get(key)
+      if board is None:
+        # Sorting once is cheaper than inserting the players one by one
+        board = self.boards[key] = _Board()
+        board.minutes = dict(minutes)
+        board.ranking = sorted((-playerMinutes, playerName)
+                               for playerName, playerMinutes in minutes.items())
+        continue
+      for playerName, playerMinutes in minutes.items():
+        board.add(playerName, playerMinutes)
+    return changedKeys
@@ -0,0 +1,143 @@
+import random
+import time
+
+
+class PollPolicy:
+  """
+  Defines how often a server gets polled, depending on what happened on it recently
+  """
+
+  def __init__(self,
+               defaultInterval=60,
+               activeInterval=20,
+               emptyInterval=180,
+               activityWindow=300,
+               maxBackoffInterval=900,
+               jitter=0.1):
+    # Used for servers with players on them
+    self.defaultInterval = defaultInterval
+    # Used while players are logging in or out
+    self.activeInterval = activeInterval
+    # Used for servers without players, or where the game is not running
+    self.emptyInterval = emptyInterval
+    # How long a server counts as active after the last login or logout, in seconds
+    self.activityWindow = activityWindow
+    # Unreachable servers are polled exponentially less often, up to this interval
+    self.maxBackoffInterval = maxBackoffInterval
+    # The fraction by which every interval is randomly stretched or shortened
+    self.jitter = jitter
+
+
+class PollScheduler:
+  """
+  Keeps track of when each server needs to be polled next
+  """
+
+  def __init__(self, policy=None, clock=time.monotonic, rng=None):
+    self.policy = policy or PollPolicy()
+    self.clock = clock
+    self.rng = rng or random.Random()
+    # Server identifier => clock value at which the server is due
+    self.nextPoll = {}
+    # Server identifier => why the server is polled at that time
+    self.reasons = {}
+    # Server identifier => clock value of the last login or logout
+    self.lastActivity = {}
+    # Server identifier => number of polls in a row which could not reach the server
+    self.failures = {}
+    # Server identifier => clock value at which the last result was recorded
+    self.lastPoll = {}
+
+  def due(self, identifiers):
+    """
+    Returns the given servers which need to be polled now, in the given order. Servers which
+    are not known yet are due immediately.
+    """
+    now = self.clock()
+    dueIdentifiers = [
+      identifier for identifier in identifiers
+      if self.nextPoll.get(identifier, now) <= now
+    ]
+    # Make sure a server does not get polled again before its result was recorded
+    for identifier in dueIdentifiers:
+      self.nextPoll[identifier] = now + self.policy.defaultInterval
+      self.reasons[identifier] = "polling"
+    return dueIdentifiers
+
+  def seconds_until_next_poll(self):
+    if not self.nextPoll:
+      return self.policy.defaultInterval
+    return max(0.0, min(self.nextPoll.values()) - self.clock())
+
+  def record_result(self,
+                    identifier,
+                    reachable,
+                    onlineCount,
+                    playersChanged,
+                    notBefore=None):
+    """
+    Schedules the next poll of a server based on the result of the current one. notBefore is
+    the minimum amount of seconds until the next poll, e.g. until a circuit breaker allows it.
+    """
+    now = self.clock()
+    self.lastPoll[identifier] = now
+    if playersChanged:
+      self.lastActivity[identifier] = now
+
+    if not reachable:
+      failures = self.failures.get(identifier, 0) + 1
+      self.failures[identifier] = failures
+      interval = min(self.policy.defaultInterval * 2**(failures - 1),
+                     self.policy.maxBackoffInterval)
+      reason = "unreachable (%d failures)" % failures
+    else:
+      self.failures.pop(identifier, None)
+      if identifier in self.lastActivity and now - self.lastActivity[
+          identifier] < self.policy.activityWindow:
+        interval = self.policy.activeInterval
+        reason = "active"
+      elif onlineCount == 0:
+        interval = self.policy.emptyInterval
+        reason = "empty"
+      else:
+        interval = self.policy.defaultInterval
+        reason = "players online"
+
+    interval *= 1 + self.rng.uniform(-self.policy.jitter, self.policy.jitter)
+    if notBefore is not None:
+      interval = max(interval, notBefore)
+    self.nextPoll[identifier] = now + interval
+    self.reasons[identifier] = reason
+
+  def seconds_since_last_poll(self, identifier):
+    """Returns None if no result was recorded for the server yet"""
+    lastPoll = self.lastPoll.get(identifier)
+    return self.clock() - lastPoll if lastPoll is not None else None
+
+  def request_poll(self, identifier):
+    """
+    Makes a server due now, e.g. because somebody asked for its status. Unreachable servers keep
+    their backoff. Returns False if no additional poll was scheduled.
+    """
+    now = self.clock()
+    nextPoll = self.nextPoll.get(identifier)
+    if nextPoll is None or nextPoll <= now or self.failures.get(
+        identifier) or self.reasons.get(identifier) == "polling":
+      return False
+    self.nextPoll[identifier] = now
+    self.reasons[identifier] = "requested"
+    return True
+
+  def remove(self, identifier):
+    self.nextPoll.pop(identifier, None)
+    self.reasons.pop(identifier, None)
+    self.lastActivity.pop(identifier, None)
+    self.failures.pop(identifier, None)
+    self.lastPoll.pop(identifier, None)
+
+  def snapshot(self):
+    """Returns a list of (identifier, seconds until the next poll, reason), soonest first"""
+    now = self.clock()
+    return sorted(((identifier, nextPoll - now, self.reasons[identifier])
+                   for identifier, nextPoll in self.nextPoll.items()),
+                  key=lambda entry: entry[1])
@@ -1,20 +1,31 @@
 class ServerConfiguration:
 
-  def __init__(self, ip, port, apiCode, color):
+  def __init__(self, ip, port, apiCode, color, guildId):
     self.ip = ip
     self.port = port
     self.apiCode = apiCode
     self.color = color
+    self.guildId = guildId
     self.identifier = ServerConfiguration.build_identifier(ip, port)
+    # Unique across all guilds
+    self.key = ServerConfiguration.build_key(guildId, self.identifier)
+    self.flag = ""
     self.statusChannelId = None
     self.statusEmbedId = None
+    # The position of the embed within a dashboard message which shows several servers, None if
+    # the message only shows this server
+    self.statusEmbedIndex = None
     self.memberLogChannelId = None
     self.voiceChannelId = None
     self.voiceChannelName = None
 
-  def set_status_embed(self, statusChannelId, statusEmbedId):
+  def set_status_embed(self,
+                       statusChannelId,
+                       statusEmbedId,
+                       statusEmbedIndex=None):
     self.statusChannelId = statusChannelId
     self.statusEmbedId = statusEmbedId
+    self.statusEmbedIndex = statusEmbedIndex
 
   def set_member_log_channel(self, memberLogChannelId):
     self.memberLogChannelId = memberLogChannelId
@@ -26,6 +37,9 @@ class ServerConfiguration:
   def has_status_embed(self):
     return self.statusChannelId is not None and self.statusEmbedId is not None
 
+  def is_on_dashboard(self):
+    return self.has_status_embed() and self.statusEmbedIndex is not None
+
   def has_member_log_channel(self):
     return self.memberLogChannelId is not None
 
@@ -37,9 +51,16 @@ class ServerConfiguration:
     return "%s:%s" % (ip, port)
 
   @staticmethod
-  def from_json(j):
-    cfg = ServerConfiguration(j["ip"], j["port"], j["apiCode"], j["color"])
-    cfg.set_status_embed(j["statusChannelId"], j["statusEmbedId"])
+  def build_key(guildId, identifier):
+    return "%s/%s" % (guildId, identifier)
+
+  @staticmethod
+  def from_json(j, defaultGuildId=None):
+    # Configurations from before multi guild support belong to the guild the bot was made for
+    cfg = ServerConfiguration(j["ip"], j["port"], j["apiCode"], j["color"],
+                              j.get("guildId", defaultGuildId))
+    cfg.set_status_embed(j["statusChannelId"], j["statusEmbedId"],
+                         j.get("statusEmbedIndex"))
     cfg.set_member_log_channel(j["memberLogChannelId"])
     cfg.set_voice_channel(j.get("voiceChannelId"),j.get("voiceChannelName"))
     cfg.flag = j.get("flag", "")
@@ -0,0 +1,101 @@
+from serverconfiguration import ServerConfiguration
+
+
+class ServerRegistry:
+  """
+  Holds the server configurations of all guilds. Every guild can register the same FS22 server,
+  so configurations are stored by their guild-namespaced key, and indexed by guild, by host
+  (ip:port), by channel and by voice channel.
+  """
+
+  def __init__(self):
+    # Configuration key => configuration
+    self.configs = {}
+    # Guild ID => {configuration key => configuration}
+    self.byGuild = {}
+    # Host identifier => {configuration key => configuration}, in registration order
+    self.byHost = {}
+    # Channel ID => {configuration key => configuration}, for status and member log channels
+    self.byChannel = {}
+    # Voice channel ID => {configuration key => configuration}
+    self.byVoiceChannel = {}
+    # Configuration key => the (index, index key) pairs it is stored under
+    self.indexedUnder = {}
+
+  def __len__(self):
+    return len(self.configs)
+
+  def __contains__(self, key):
+    return key in self.configs
+
+  def values(self):
+    return list(self.configs.values())
+
+  def get(self, guildId, identifier):
+    return self.configs.get(
+      ServerConfiguration.build_key(guildId, identifier))
+
+  def add(self, serverConfig):
+    self.configs[serverConfig.key] = serverConfig
+    self._index(serverConfig)
+
+  def remove(self, serverConfig):
+    self._unindex(serverConfig)
+    del self.configs[serverConfig.key]
+
+  def reindex(self, serverConfig):
+    """Needs to be called after the channels of a configuration were changed"""
+    self._unindex(serverConfig)
+    self._index(serverConfig)
+
+  def hosts(self):
+    """Returns the identifiers of all hosts which have at least one subscriber"""
+    return list(self.byHost)
+
+  def subscribers(self, identifier):
+    """Returns all configurations which watch the given host, the oldest first"""
+    return list(self.byHost.get(identifier, {}).values())
+
+  def primary(self, identifier):
+    """Returns the configuration which is used for polling the given host"""
+    subscribers = self.byHost.get(identifier)
+    return next(iter(subscribers.values())) if subscribers else None
+
+  def for_guild(self, guildId):
+    return list(self.byGuild.get(guildId, {}).values())
+
+  def for_channel(self, channelId):
+    return list(self.byChannel.get(_channel_id(channelId), {}).values())
+
+  def for_voice_channel(self, channelId):
+    return list(self.byVoiceChannel.get(_channel_id(channelId), {}).values())
+
+  def _indexes(self, serverConfig):
+    yield self.byGuild, serverConfig.guildId
+    yield self.byHost, serverConfig.identifier
+    channelIds = set()
+    if serverConfig.has_status_embed():
+      channelIds.add(_channel_id(serverConfig.statusChannelId))
+    if serverConfig.has_member_log_channel():
+      channelIds.add(_channel_id(serverConfig.memberLogChannelId))
+    for channelId in channelIds:
+      yield self.byChannel, channelId
+    if serverConfig.has_voice_channel():
+      yield self.byVoiceChannel, _channel_id(serverConfig.voiceChannelId)
+
+  def _index(self, serverConfig):
+    indexedUnder = list(self._indexes(serverConfig))
+    for index, indexKey in indexedUnder:
+      index.setdefault(indexKey, {})[serverConfig.key] = serverConfig
+    self.indexedUnder[serverConfig.key] = indexedUnder
+
+  def _unindex(self, serverConfig):
+    for index, indexKey in self.indexedUnder.pop(serverConfig.key, []):
+      entries = index[indexKey]
+      del entries[serverConfig.key]
+      if not entries:
+        del index[indexKey]
+
+
+def _channel_id(channelId):
+  return int(channelId)
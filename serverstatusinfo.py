@@ -1,98 +1,212 @@
 import datetime
+import sys
+import types
+
+
+def _to_int(value):
+  try:
+    return int(value)
+  except (TypeError, ValueError):
+    return 0
+
+
+def _to_bool(value):
+  # The XML and older database entries use "true" and "false"
+  return value is True or value == "true"
+
+
+def _to_text(value):
+  return "true" if value else "false"
 
 
 class PlayerStatus:
   """
-  Contains information about the current status of a player
+  Contains information about the current status of a player. Instances are never changed, a new
+  one is created whenever the online time or the admin state of a player changes.
   """
+  __slots__ = ("playerName", "onlineTime", "isAdmin")
 
   def __init__(self, playerName, onlineTime, isAdmin):
     self.playerName = playerName
+    # In minutes
     self.onlineTime = onlineTime
     self.isAdmin = isAdmin
 
+  @classmethod
+  def create(cls, playerName, onlineTime, isAdmin):
+    """Creates a player from untyped values, like the ones in the XML or the database"""
+    # The same names show up in every poll, so only keep one copy of each
+    return cls(sys.intern(playerName), _to_int(onlineTime), _to_bool(isAdmin))
+
   @classmethod
   def from_xml(cls, playerElement):
-    return cls(playerElement["#text"], playerElement["@uptime"],
-               playerElement["@isAdmin"])
+    return cls.create(playerElement["#text"], playerElement["@uptime"],
+                      playerElement["@isAdmin"])
+
+  def to_json(self):
+    # Stored as strings, like they were before these fields were typed
+    return {
+      "playerName": self.playerName,
+      "onlineTime": str(self.onlineTime),
+      "isAdmin": _to_text(self.isAdmin)
+    }
 
   @staticmethod
   def from_json(j):
-    return PlayerStatus(j["playerName"], j["onlineTime"], j["isAdmin"])
+    return PlayerStatus.create(j["playerName"], j["onlineTime"], j["isAdmin"])
+
+
+class PlayerChanges:
+  """
+  Describes how the players of a server changed between two polls
+  """
+  __slots__ = ("loggedIn", "loggedOut", "changedToAdmin")
+
+  def __init__(self, loggedIn=(), loggedOut=(), changedToAdmin=()):
+    self.loggedIn = tuple(loggedIn)
+    self.loggedOut = tuple(loggedOut)
+    self.changedToAdmin = tuple(changedToAdmin)
+
+  def __bool__(self):
+    return bool(self.loggedIn or self.loggedOut or self.changedToAdmin)
+
+
+# Shared by all servers where nothing changed
+NO_CHANGES = PlayerChanges()
+# Shared by all servers without players
+NO_PLAYERS = types.MappingProxyType({})
+
+
+def diff_players(previous, current):
+  """
+  Compares two snapshots of player name => PlayerStatus. Logins and logouts are reported in the
+  order of the snapshot they appear in.
+  """
+  previousNames = previous.keys()
+  currentNames = current.keys()
+  loggedIn = ()
+  loggedOut = ()
+  # Usually nobody joined or left, which a single set comparison tells
+  if previousNames != currentNames:
+    joinedNames = currentNames - previousNames
+    if joinedNames:
+      loggedIn = [current[name] for name in current if name in joinedNames]
+    leftNames = previousNames - currentNames
+    if leftNames:
+      loggedOut = [previous[name] for name in previous if name in leftNames]
+
+  changedToAdmin = ()
+  admins = [name for name, player in current.items() if player.isAdmin]
+  if admins:
+    newAdmins = set(admins).difference(
+      name for name, player in previous.items() if player.isAdmin)
+    changedToAdmin = [current[name] for name in admins if name in newAdmins]
+
+  if not loggedIn and not loggedOut and not changedToAdmin:
+    return NO_CHANGES
+  return PlayerChanges(loggedIn, loggedOut, changedToAdmin)
 
 
 class ServerStatus:
   """
   Contains information about the current status of a server
   """
+  __slots__ = ("status", "offlineReason", "serverConfig", "name", "map",
+               "maxPlayers", "players", "changes", "mods", "farmStats",
+               "vehicleCells", "lastChannelRenameTimestamps")
 
   def __init__(self, serverConfig):
     self.status = "Online"
+    # Describes why the server is offline, if known
+    self.offlineReason = None
     self.serverConfig = serverConfig
     self.name = "Unknown"
     self.map = "Unknown"
-    self.maxPlayers = "0"
-    self.players = {}
-    self.recentlyLoggedIn = []
-    self.recentlyLoggedOut = []
-    self.recentlyChangedToAdmin = []
-    self.lastChannelRenameTimestamp = datetime.datetime.now(
-    ) - datetime.timedelta(seconds=400)
+    self.maxPlayers = 0
+    # Player name => PlayerStatus of the last poll. A read-only snapshot which is replaced as a
+    # whole by set_players
+    self.players = NO_PLAYERS
+    # What changed in the last poll
+    self.changes = NO_CHANGES
+    # The ModList of the server, shared with other servers which run the same mods
+    self.mods = None
+    # The FarmStats of the last poll, if the bot collects them
+    self.farmStats = None
+    # The heatmap cells of the vehicles in the last poll, to find the ones which moved
+    self.vehicleCells = None
+    # Voice channel ID => time of the last rename. Several guilds can show the same server
+    self.lastChannelRenameTimestamps = {}
+
+  @property
+  def recentlyLoggedIn(self):
+    return self.changes.loggedIn
+
+  @property
+  def recentlyLoggedOut(self):
+    return self.changes.loggedOut
+
+  @property
+  def recentlyChangedToAdmin(self):
+    return self.changes.changedToAdmin
 
   def update_attributes(self, status, name, map, maxPlayers):
     self.status = status
+    self.offlineReason = None
     self.name = name
     self.map = map
-    self.maxPlayers = maxPlayers
+    self.maxPlayers = _to_int(maxPlayers)
 
-  def set_offline(self):
+  def set_offline(self, reason=None):
     self.status = "Offline"
+    self.offlineReason = reason
 
   def is_online(self):
     return self.status != "Offline"
 
-  def allows_channel_rename(self):
+  def display_name(self, serverConfig):
+    """Retrieves the name of the server as shown to the guild of the given configuration"""
+    return serverConfig.flag + " " + self.name
+
+  def allows_channel_rename(self, channelId):
     """Makes sure we are not being rate limited by discord when renaming a channel"""
-    return (datetime.datetime.now() - self.lastChannelRenameTimestamp
-            ).total_seconds() > 305  # a bit more than five minutes
+    lastRename = self.lastChannelRenameTimestamps.get(channelId)
+    return lastRename is None or (datetime.datetime.now() - lastRename
+                                  ).total_seconds() > 305  # a bit more than five minutes
 
-  def update_channel_rename_timestamp(self):
-    self.lastChannelRenameTimestamp = datetime.datetime.now()
+  def update_channel_rename_timestamp(self, channelId):
+    self.lastChannelRenameTimestamps[channelId] = datetime.datetime.now()
 
-  def update_players(self, playerElements):
-    self.recentlyLoggedIn = []
-    self.recentlyLoggedOut = []
-    self.recentlyChangedToAdmin = []
-    onlinePlayers = {}
+  def clear_recent_changes(self):
+    """Forgets about players who logged in, logged out or became admin in the previous update"""
+    self.changes = NO_CHANGES
 
+  def set_players(self, players):
+    """Replaces the snapshot of online players with the given dict and returns what changed"""
+    self.changes = diff_players(self.players, players)
+    self.players = types.MappingProxyType(players) if players else NO_PLAYERS
+    return self.changes
+
+  def update_players(self, playerElements):
+    """Replaces the online players with the ones from the XML and returns what changed"""
+    previousPlayers = self.players
+    players = {}
     for playerElement in playerElements:
 
       # Skip empty slots
       if playerElement is None or playerElement["@isUsed"] == "false":
         continue
 
-      player = PlayerStatus.from_xml(playerElement)
-
-      # Find out which players just signed in
-      if player.playerName not in self.players:
-        self.recentlyLoggedIn.append(player)
-
-      # Remember all players who are online now
-      onlinePlayers[player.playerName] = player
-
-      # Find out which players are now an admin
-      if player.isAdmin == "true":
-        if player.playerName not in self.players or self.players[
-            player.playerName].isAdmin != "true":
-          self.recentlyChangedToAdmin.append(player)
-
-    # Find out which players just signed out
-    for playerName in self.players:
-      if playerName not in onlinePlayers:
-        self.recentlyLoggedOut.append(self.players[playerName])
-
-    # Store the new dictionary of online players
-    self.players = onlinePlayers
+      playerName = playerElement["#text"]
+      onlineTime = _to_int(playerElement["@uptime"])
+      isAdmin = playerElement["@isAdmin"] == "true"
+      player = previousPlayers.get(playerName)
+      if player is None:
+        player = PlayerStatus(sys.intern(playerName), onlineTime, isAdmin)
+      elif player.onlineTime != onlineTime or player.isAdmin != isAdmin:
+        # Reuse the interned name of the previous object
+        player = PlayerStatus(player.playerName, onlineTime, isAdmin)
+      players[player.playerName] = player
+    return self.set_players(players)
 
   def online_player_count(self):
     """Retrieves the amount of currently online players on this server"""
@@ -111,12 +225,15 @@ class ServerStatus:
   def to_json(self):
     j = {}
     j["status"] = self.status
+    j["offlineReason"] = self.offlineReason
     j["name"] = self.name
     j["map"] = self.map
-    j["maxPlayers"] = self.maxPlayers
+    j["maxPlayers"] = str(self.maxPlayers)
+    # The mod lists themselves are stored separately, by their hash
+    j["modsHash"] = self.mods.hash if self.mods is not None else None
     j["players"] = {}
     for playerName in self.players:
-      j["players"][playerName] = vars(self.players[playerName])
+      j["players"][playerName] = self.players[playerName].to_json()
 
     return j
 
@@ -124,9 +241,15 @@ class ServerStatus:
   def from_json(j, serverConfig):
     ss = ServerStatus(serverConfig)
     ss.status = j["status"]
+    ss.offlineReason = j.get("offlineReason")
     ss.name = j["name"]
     ss.map = j["map"]
-    ss.maxPlayers = j["maxPlayers"]
-    for playerName in j["players"]:
-      ss.players[playerName] = PlayerStatus.from_json(j["players"][playerName])
+    ss.maxPlayers = _to_int(j["maxPlayers"])
+    players = {}
+    for playerJson in j["players"].values():
+      player = PlayerStatus.from_json(playerJson)
+      players[player.playerName] = player
+    ss.set_players(players)
+    # Restoring is not a change
+    ss.clear_recent_changes()
     return ss
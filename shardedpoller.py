@@ -0,0 +1,417 @@
+"""
+Polls the servers in several worker processes. Every worker runs a StatusPoller for its share of
+the servers and reports what changed over its stdin/stdout pipes as one JSON object per line.
+Run by the bot as: python3 shardedpoller.py '<options as JSON>'
+"""
+import asyncio
+import functools
+import itertools
+import json
+import os
+import sys
+import time
+import zlib
+import numpy as np
+from farmstats import FarmStats
+from feedrecorder import FeedRecorder
+from hosthealth import HostHealthTracker
+from metrics import registry, FETCH_SECONDS, FEED_BYTES, PARSE_SECONDS, DIFF_SECONDS
+from modlist import ModList, ModListCache
+from serverconfiguration import ServerConfiguration
+from serverstatusinfo import PlayerStatus, ServerStatus
+from statusfetcher import StatusFetcher
+from statusparser import parse_status_feed, parse_status_feed_xmltodict
+from statuspoller import PollOutcome, StatusPoller
+
+# The longest line which can be exchanged with a worker, in bytes
+MAX_MESSAGE_SIZE = 64 * 1024 * 1024
+# Metrics which are recorded in the workers and sent to the bot with every reply
+WORKER_METRICS = (FETCH_SECONDS, FEED_BYTES, PARSE_SECONDS, DIFF_SECONDS)
+
+
+def shard_of(identifier, shardCount):
+  """Assigns a server to a worker. The assignment is stable across restarts"""
+  return zlib.crc32(identifier.encode("utf-8")) % shardCount
+
+
+def _attributes(serverData):
+  return [
+    serverData.status, serverData.offlineReason, serverData.name,
+    serverData.map, serverData.maxPlayers
+  ]
+
+
+def _player_state(serverData):
+  return {
+    playerName: (player.onlineTime, player.isAdmin)
+    for playerName, player in serverData.players.items()
+  }
+
+
+def _farm_stats_state(serverData):
+  farmStats = serverData.farmStats
+  return farmStats.to_json() if farmStats is not None else None
+
+
+def encode_outcome(outcome,
+                   previousAttributes,
+                   previousPlayers,
+                   previousFarmStats=None):
+  """
+  Builds a change event which only contains what changed compared to the given previous state
+  """
+  serverData = outcome.serverData
+  event = {
+    "identifier": serverData.serverConfig.identifier,
+    "reachable": outcome.reachable,
+    "notBefore": outcome.notBefore,
+  }
+  for flag in ("turnedOnline", "turnedOffline", "changed", "failed"):
+    if getattr(outcome, flag):
+      event[flag] = True
+
+  attributes = _attributes(serverData)
+  if attributes != previousAttributes:
+    event["attributes"] = attributes
+  if serverData.recentlyLoggedIn:
+    event["joined"] = [[player.playerName, player.onlineTime, player.isAdmin]
+                       for player in serverData.recentlyLoggedIn]
+  if serverData.recentlyLoggedOut:
+    event["left"] = [
+      player.playerName for player in serverData.recentlyLoggedOut
+    ]
+  updated = [[playerName, player.onlineTime, player.isAdmin]
+             for playerName, player in serverData.players.items()
+             if playerName in previousPlayers and
+             previousPlayers[playerName] != (player.onlineTime, player.isAdmin)]
+  if updated:
+    event["updated"] = updated
+  # Mod lists are large, so they are only sent when they changed
+  if outcome.modsChanged:
+    event["mods"] = [serverData.mods.hash, serverData.mods.to_json()]
+  farmStats = _farm_stats_state(serverData)
+  if farmStats != previousFarmStats:
+    event["farmStats"] = farmStats
+  if outcome.positionCells is not None and len(outcome.positionCells) > 0:
+    event["positions"] = outcome.positionCells.tolist()
+  return event
+
+
+def apply_event(serverData, event, modCache):
+  """
+  Applies a change event of a worker to the status which is held by the bot. Logins, logouts and
+  new admins are derived from the resulting player list, just like in the worker.
+  """
+  outcome = PollOutcome(serverData,
+                        reachable=event["reachable"],
+                        notBefore=event["notBefore"],
+                        turnedOnline=event.get("turnedOnline", False),
+                        turnedOffline=event.get("turnedOffline", False),
+                        changed=event.get("changed", False),
+                        failed=event.get("failed", False))
+  if "attributes" in event:
+    (serverData.status, serverData.offlineReason, serverData.name,
+     serverData.map, serverData.maxPlayers) = event["attributes"]
+  if "left" in event or "joined" in event or "updated" in event:
+    players = dict(serverData.players)
+    for playerName in event.get("left", ()):
+      players.pop(playerName, None)
+    for entry in event.get("joined", []) + event.get("updated", []):
+      player = PlayerStatus.create(*entry)
+      players[player.playerName] = player
+    serverData.set_players(players)
+  else:
+    serverData.clear_recent_changes()
+
+  if "mods" in event:
+    hash, modsJson = event["mods"]
+    # A restarted worker sends the mods again, even if the bot knows them already
+    if serverData.mods is None or serverData.mods.hash != hash:
+      outcome.modsChanged = True
+      outcome.previousMods = serverData.mods
+      serverData.mods = modCache.get(hash) or modCache.add(
+        ModList.from_json(hash, modsJson))
+    elif not serverData.mods.is_loaded():
+      serverData.mods = modCache.get(hash) or modCache.add(
+        ModList.from_json(hash, modsJson))
+
+  if "farmStats" in event:
+    serverData.farmStats = FarmStats.from_json(
+      event["farmStats"]) if event["farmStats"] is not None else None
+  if "positions" in event:
+    outcome.positionCells = np.array(event["positions"], dtype=np.int32)
+  return outcome
+
+
+class _Worker:
+  """
+  The bot side of a single worker process
+  """
+
+  def __init__(self, index, restartDelay):
+    self.index = index
+    self.process = None
+    self.readTask = None
+    # Identifiers of the servers whose status the worker knows
+    self.tracked = set()
+    # Request ID => future for the events of that request
+    self.pending = {}
+    self.restartDelay = restartDelay
+    self.startableAt = 0
+
+  def is_running(self):
+    return self.process is not None
+
+  def send(self, messages):
+    self.process.stdin.write(b"".join(
+      json.dumps(message).encode("utf-8") + b"\n" for message in messages))
+
+
+class ShardedPoller:
+  """
+  Distributes the servers over several worker processes by hashing their identifiers. Workers
+  which crash or hang are restarted on their own, the other workers keep polling meanwhile.
+  Can be used instead of a StatusPoller.
+  """
+
+  def __init__(self,
+               workerCount,
+               workerOptions,
+               pollTimeout=120,
+               restartDelay=1,
+               maxRestartDelay=60,
+               modCache=None):
+    self.workerOptions = workerOptions
+    # A worker which does not answer within this many seconds is restarted
+    self.pollTimeout = pollTimeout
+    self.baseRestartDelay = restartDelay
+    self.maxRestartDelay = maxRestartDelay
+    self.workers = [_Worker(index, restartDelay) for index in range(workerCount)]
+    self.requestIds = itertools.count()
+    self.modCache = modCache or ModListCache()
+
+  def worker_for(self, identifier):
+    return self.workers[shard_of(identifier, len(self.workers))]
+
+  def forget(self, serverData):
+    """Makes the worker drop the server. It is sent again with the next poll if still needed"""
+    identifier = serverData.serverConfig.identifier
+    worker = self.worker_for(identifier)
+    if worker.is_running() and identifier in worker.tracked:
+      worker.tracked.discard(identifier)
+      worker.send([{"type": "untrack", "identifier": identifier}])
+
+  async def start(self):
+    """Starts all workers. Otherwise they are started with the first poll"""
+    for worker in self.workers:
+      if not worker.is_running():
+        await self._start(worker)
+
+  async def restart_worker(self, index):
+    """Stops a worker. It gets started again for the next poll"""
+    worker = self.workers[index]
+    if worker.is_running():
+      worker.process.kill()
+      await worker.readTask
+
+  async def close(self):
+    for worker in self.workers:
+      if worker.is_running():
+        worker.process.stdin.close()
+        await worker.readTask
+
+  async def poll(self, serverStatuses):
+    """
+    Polls all of the given servers and returns their outcomes in the same order. Servers of a
+    worker which is not available are left out.
+    """
+    byWorker = {}
+    for serverData in serverStatuses:
+      byWorker.setdefault(self.worker_for(serverData.serverConfig.identifier),
+                          []).append(serverData)
+
+    workers = list(byWorker)
+    results = await asyncio.gather(
+      *[self._poll_worker(worker, byWorker[worker]) for worker in workers])
+    outcomes = {}
+    for worker, events in zip(workers, results):
+      statuses = {
+        serverData.serverConfig.identifier: serverData
+        for serverData in byWorker[worker]
+      }
+      for event in events:
+        serverData = statuses.get(event["identifier"])
+        if serverData is not None:
+          outcomes[event["identifier"]] = apply_event(
+            serverData, event, self.modCache)
+
+    return [
+      outcomes[serverData.serverConfig.identifier]
+      for serverData in serverStatuses
+      if serverData.serverConfig.identifier in outcomes
+    ]
+
+  async def _poll_worker(self, worker, serverStatuses):
+    if not worker.is_running():
+      if time.monotonic() < worker.startableAt:
+        return []
+      await self._start(worker)
+
+    messages = []
+    for serverData in serverStatuses:
+      identifier = serverData.serverConfig.identifier
+      if identifier not in worker.tracked:
+        messages.append({
+          "type": "track",
+          "identifier": identifier,
+          "config": vars(serverData.serverConfig),
+          "status": serverData.to_json()
+        })
+        worker.tracked.add(identifier)
+    requestId = next(self.requestIds)
+    messages.append({
+      "type":
+      "poll",
+      "request":
+      requestId,
+      "servers":
+      [serverData.serverConfig.identifier for serverData in serverStatuses]
+    })
+
+    future = asyncio.get_event_loop().create_future()
+    worker.pending[requestId] = future
+    try:
+      worker.send(messages)
+      await worker.process.stdin.drain()
+      events = await asyncio.wait_for(future, self.pollTimeout)
+    except asyncio.TimeoutError:
+      print("WARN: Poll worker %d did not answer in time, restarting it" %
+            worker.index)
+      await self.restart_worker(worker.index)
+      return []
+    except Exception as e:
+      print("WARN: Poll worker %d failed: %s" % (worker.index, e))
+      return []
+    finally:
+      worker.pending.pop(requestId, None)
+
+    # The worker is healthy, so restart it quickly the next time it fails
+    worker.restartDelay = self.baseRestartDelay
+    return events
+
+  async def _start(self, worker):
+    options = dict(self.workerOptions, shard=worker.index)
+    worker.process = await asyncio.create_subprocess_exec(
+      sys.executable,
+      os.path.abspath(__file__),
+      json.dumps(options),
+      stdin=asyncio.subprocess.PIPE,
+      stdout=asyncio.subprocess.PIPE,
+      limit=MAX_MESSAGE_SIZE)
+    worker.tracked = set()
+    worker.readTask = asyncio.ensure_future(self._read(worker))
+    print("INFO: Started poll worker %d (pid %d)" %
+          (worker.index, worker.process.pid))
+
+  async def _read(self, worker):
+    process = worker.process
+    try:
+      while True:
+        line = await process.stdout.readline()
+        if not line:
+          break
+        message = json.loads(line)
+        # The fetch and parse metrics are recorded in the worker
+        registry.merge(message.get("metrics", {}))
+        future = worker.pending.get(message["request"])
+        if future is not None and not future.done():
+          future.set_result(message["events"])
+    except Exception as e:
+      print("WARN: Could not read from poll worker %d: %s" %
+            (worker.index, e))
+      process.kill()
+
+    returnCode = await process.wait()
+    worker.process = None
+    worker.tracked = set()
+    for future in worker.pending.values():
+      if not future.done():
+        future.set_exception(
+          ConnectionError("worker exited with code %s" % returnCode))
+    # Back off if the worker keeps crashing
+    worker.startableAt = time.monotonic() + worker.restartDelay
+    worker.restartDelay = min(worker.restartDelay * 2, self.maxRestartDelay)
+    print("INFO: Poll worker %d exited with code %s" %
+          (worker.index, returnCode))
+
+
+async def run_worker(options):
+  """Processes the requests of the bot until it closes stdin"""
+  health = HostHealthTracker(failureThreshold=options["failureThreshold"],
+                             maxBackoff=options["maxBackoff"])
+  poller = StatusPoller(
+    StatusFetcher(maxConcurrency=options["maxConcurrency"],
+                  connectTimeout=options["connectTimeout"],
+                  readTimeout=options["readTimeout"],
+                  health=health), health,
+    functools.partial(
+      parse_status_feed_xmltodict
+      if options["parser"] == "xmltodict" else parse_status_feed,
+      sections=options.get("sections", ["Slots"])),
+    options["offlineAfterTimeouts"],
+    trackPositions=options.get("trackPositions", False),
+    # Every worker records its servers into its own directory
+    recorder=FeedRecorder(
+      os.path.join(options["recordDirectory"], "shard-%d" % options["shard"]),
+      options["recordFileSize"], options["recordFiles"])
+    if options.get("recordDirectory") else None)
+
+  # Keep stdout for the replies. Everything which gets printed goes to stderr instead
+  replies = os.fdopen(os.dup(sys.stdout.fileno()), "wb")
+  os.dup2(sys.stderr.fileno(), sys.stdout.fileno())
+
+  loop = asyncio.get_event_loop()
+  requests = asyncio.StreamReader(limit=MAX_MESSAGE_SIZE)
+  await loop.connect_read_pipe(lambda: asyncio.StreamReaderProtocol(requests),
+                               sys.stdin)
+
+  statuses = {}
+  while True:
+    line = await requests.readline()
+    if not line:
+      break
+    message = json.loads(line)
+    if message["type"] == "track":
+      statuses[message["identifier"]] = ServerStatus.from_json(
+        message["status"], ServerConfiguration.from_json(message["config"]))
+    elif message["type"] == "untrack":
+      serverData = statuses.pop(message["identifier"], None)
+      if serverData is not None:
+        poller.forget(serverData)
+    elif message["type"] == "poll":
+      serverStatuses = [
+        statuses[identifier] for identifier in message["servers"]
+        if identifier in statuses
+      ]
+      previousStates = [(_attributes(serverData), _player_state(serverData),
+                         _farm_stats_state(serverData))
+                        for serverData in serverStatuses]
+      outcomes = await poller.poll(serverStatuses)
+      events = [
+        encode_outcome(outcome, *previousState)
+        for outcome, previousState in zip(outcomes, previousStates)
+      ]
+      replies.write(
+        json.dumps({
+          "request": message["request"],
+          "events": events,
+          "metrics": registry.take(WORKER_METRICS)
+        }).encode("utf-8") + b"\n")
+      replies.flush()
+
+  await poller.close()
+
+
+if __name__ == "__main__":
+  asyncio.get_event_loop().run_until_complete(
+    run_worker(json.loads(sys.argv[1])))
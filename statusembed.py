@@ -0,0 +1,100 @@
+import hashlib
+import time
+
+
+def render_status_description(serverData):
+  """Builds the description of the status embed of a server"""
+  lines = [
+    "**Map: **" + serverData.map,
+    "**Status: **" + serverData.status +
+    (" (%s)" % serverData.offlineReason if serverData.offlineReason else ""),
+    "**Mods Link: **" + serverData.mods_link() +
+    (" (%d mods)" % len(serverData.mods) if serverData.mods is not None
+     and serverData.mods.is_loaded() else ""),
+    "**Players Online: **%s/%s" %
+    (serverData.online_player_count(), serverData.maxPlayers),
+  ]
+
+  if not serverData.players:
+    lines.append("**Players: **(none)")
+  else:
+    lines.append("**Players: **")
+    for playerName in serverData.players:
+      lines.append(" - %s (%s min)" %
+                   (playerName, serverData.players[playerName].onlineTime))
+  return "\r\n".join(lines)
+
+
+def embed_fingerprint(title, description, color):
+  return hashlib.sha1(
+    ("%s\0%s\0%s" % (title, description, color)).encode("utf-8")).digest()
+
+
+def dashboard_fingerprint(embeds):
+  """Fingerprints the (title, description, color) of every embed of a dashboard message"""
+  return hashlib.sha1(b"".join(
+    embed_fingerprint(title, description, color)
+    for title, description, color in embeds)).digest()
+
+
+# Replaces the lines which were cut off by fit_descriptions
+TRUNCATION_LINE = " - ..."
+
+
+def fit_descriptions(descriptions, budget):
+  """
+  Cuts off the last lines of the longest descriptions until all of them fit into budget
+  characters together, since discord limits the text of all embeds of a message
+  """
+  lines = [description.split("\r\n") for description in descriptions]
+  shortened = [False] * len(lines)
+
+  def join(index):
+    return "\r\n".join(lines[index] +
+                       ([TRUNCATION_LINE] if shortened[index] else []))
+
+  lengths = [len(description) for description in descriptions]
+  while lengths and sum(lengths) > budget:
+    longest = max(range(len(lines)), key=lengths.__getitem__)
+    if len(lines[longest]) <= 1:
+      break
+    lines[longest].pop()
+    shortened[longest] = True
+    lengths[longest] = len(join(longest))
+  return [join(index) for index in range(len(lines))]
+
+
+class StatusEmbedTracker:
+  """
+  Remembers what was last sent to each status embed, so an embed is only edited if its
+  content changed, or if the "Last Update" field has not been refreshed for a while. An edit
+  only counts once discord confirmed it, so failed edits are tried again.
+  """
+
+  def __init__(self, lastUpdateRefreshInterval=600):
+    self.lastUpdateRefreshInterval = lastUpdateRefreshInterval
+    # Message ID => (fingerprint, time.monotonic() of the last edit)
+    self.sentEmbeds = {}
+    # Message ID => fingerprint of the edit which was queued but not confirmed yet
+    self.pendingEmbeds = {}
+
+  def needs_update(self, messageId, fingerprint):
+    if self.pendingEmbeds.get(messageId) == fingerprint:
+      return False
+    sentEmbed = self.sentEmbeds.get(messageId)
+    if sentEmbed is None or sentEmbed[0] != fingerprint:
+      return True
+    return time.monotonic(
+    ) - sentEmbed[1] >= self.lastUpdateRefreshInterval
+
+  def mark_pending(self, messageId, fingerprint):
+    self.pendingEmbeds[messageId] = fingerprint
+
+  def mark_updated(self, messageId, fingerprint):
+    self.sentEmbeds[messageId] = (fingerprint, time.monotonic())
+    if self.pendingEmbeds.get(messageId) == fingerprint:
+      del self.pendingEmbeds[messageId]
+
+  def forget(self, messageId):
+    self.sentEmbeds.pop(messageId, None)
+    self.pendingEmbeds.pop(messageId, None)
@@ -0,0 +1,141 @@
+import asyncio
+import hashlib
+import aiohttp
+from urllib.parse import urlsplit
+from metrics import FETCH_SECONDS, FEED_BYTES, server_label
+from hosthealth import CircuitOpenError, HostHealthTracker, classify_failure, FAILURE_CIRCUIT_OPEN
+
+
+class FetchResult:
+  """
+  Contains the outcome of fetching the status XML of a single server
+  """
+
+  def __init__(self,
+               url,
+               data=None,
+               error=None,
+               unchanged=False,
+               failureCategory=None):
+    self.url = url
+    self.host = urlsplit(url).netloc
+    self.data = data
+    self.error = error
+    # One of the FAILURE_* constants of hosthealth if the request failed
+    self.failureCategory = failureCategory
+    # True if the feed is identical to the one which was fetched in the previous cycle
+    self.unchanged = unchanged
+
+  def succeeded(self):
+    return self.error is None
+
+
+class StatusFetcher:
+  """
+  Fetches the status XML of many servers in parallel without blocking the event loop.
+  Connections are kept alive between cycles, and feeds which did not change since the
+  previous cycle are reported as unchanged so they don't need to be processed again.
+  """
+
+  def __init__(self,
+               maxConcurrency=10,
+               connectTimeout=2,
+               readTimeout=3,
+               keepAliveTimeout=120,
+               health=None):
+    self.maxConcurrency = maxConcurrency
+    self.connectTimeout = connectTimeout
+    self.readTimeout = readTimeout
+    self.keepAliveTimeout = keepAliveTimeout
+    self.session = None
+    self.sessionLoop = None
+    # ETag and Last-Modified header values per URL, for servers which provide them
+    self.validators = {}
+    # A hash of the last successfully fetched feed per URL
+    self.fingerprints = {}
+    # Hosts which are down are skipped until they are due for a probe
+    self.health = health or HostHealthTracker()
+
+  def _get_session(self):
+    # A session can only be used in the event loop it was created in
+    loop = asyncio.get_event_loop()
+    if self.session is None or self.session.closed or self.sessionLoop is not loop:
+      self.sessionLoop = loop
+      # Keep idle connections open for longer than a polling cycle so they can be reused
+      connector = aiohttp.TCPConnector(
+        limit=self.maxConcurrency, keepalive_timeout=self.keepAliveTimeout)
+      self.session = aiohttp.ClientSession(
+        connector=connector,
+        timeout=aiohttp.ClientTimeout(total=self.connectTimeout +
+                                      self.readTimeout,
+                                      sock_connect=self.connectTimeout,
+                                      sock_read=self.readTimeout))
+    return self.session
+
+  async def close(self):
+    if self.session is not None:
+      await self.session.close()
+      self.session = None
+
+  def forget(self, url):
+    """Makes sure the next feed retrieved from the given URL is reported as changed"""
+    self.validators.pop(url, None)
+    self.fingerprints.pop(url, None)
+
+  async def fetch_all(self, urls):
+    """Fetches all URLs concurrently and returns one FetchResult per URL, in the same order"""
+    session = self._get_session()
+    semaphore = asyncio.Semaphore(self.maxConcurrency)
+    return await asyncio.gather(
+      *[self._fetch(session, semaphore, url) for url in urls])
+
+  async def _fetch(self, session, semaphore, url):
+    host = urlsplit(url).netloc
+    # Don't waste time and a concurrency slot on hosts which are known to be down
+    if not self.health.allow_request(host):
+      return FetchResult(url,
+                         error=CircuitOpenError(host),
+                         failureCategory=FAILURE_CIRCUIT_OPEN)
+
+    async with semaphore:
+      try:
+        with FETCH_SECONDS.time(server_label(host)):
+          async with session.get(url,
+                                 headers=self._conditional_headers(url)) as response:
+            # The server confirmed that nothing changed
+            if response.status == 304 and url in self.fingerprints:
+              self.health.record_success(host)
+              return FetchResult(url, unchanged=True)
+            data = await response.read()
+            self._remember_validators(url, response)
+      except Exception as e:
+        # Unreachable host, refused connection, timeout etc.
+        failureCategory = classify_failure(e)
+        self.health.record_failure(host, failureCategory)
+        self.forget(url)
+        return FetchResult(url, error=e, failureCategory=failureCategory)
+
+    self.health.record_success(host)
+    FEED_BYTES.set(len(data), server_label(host))
+
+    fingerprint = hashlib.sha1(data).digest()
+    unchanged = self.fingerprints.get(url) == fingerprint
+    self.fingerprints[url] = fingerprint
+    return FetchResult(url, data=data, unchanged=unchanged)
+
+  def _conditional_headers(self, url):
+    headers = {}
+    etag, lastModified = self.validators.get(url, (None, None))
+    if etag is not None:
+      headers["If-None-Match"] = etag
+    if lastModified is not None:
+      headers["If-Modified-Since"] = lastModified
+    return headers
+
+  def _remember_validators(self, url, response):
+    etag = response.headers.get("ETag")
+    lastModified = response.headers.get("Last-Modified")
+    if etag is None and lastModified is None:
+      self.validators.pop(url, None)
+    else:
+      self.validators[url] = (etag, lastModified)
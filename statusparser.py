@@ -0,0 +1,167 @@
+import xml.etree.ElementTree as ET
+import xmltodict
+
+# The amount of bytes which are fed into the incremental parser at once
+CHUNK_SIZE = 16 * 1024
+
+
+class StatusFeed:
+  """
+  Contains the parts of dedicated-server-stats.xml which are required by the bot
+  """
+
+  def __init__(self):
+    # The attributes of the Server element, like name and mapName
+    self.server = {}
+    # The attributes of the Slots element, like capacity
+    self.slots = {}
+    # The Player elements, in the same format xmltodict would produce
+    self.players = []
+    # The vehicles as VehicleColumns, if the Vehicles section was requested
+    self.vehicles = None
+    # The attributes of the Farm elements, if the Farms section was requested
+    self.farms = None
+
+  def is_server_running(self):
+    """If the game is not running, the host still answers, but with an empty Server element"""
+    return "name" in self.server
+
+
+class VehicleColumns:
+  """
+  The attributes of all vehicles and their fill levels, one list per attribute, so they can be
+  turned into arrays at once. The values are the strings from the XML
+  """
+
+  def __init__(self):
+    self.categories = []
+    self.farmIds = []
+    # Coordinates relative to the center of the map
+    self.xs = []
+    self.zs = []
+    # Every fill level of every vehicle, together with the farm which owns the vehicle
+    self.fillTypes = []
+    self.fillLevels = []
+    self.fillFarmIds = []
+
+  def add_vehicle(self, attributes):
+    self.categories.append(attributes.get("category", ""))
+    self.farmIds.append(attributes.get("farmId", "0"))
+    self.xs.append(attributes.get("x", "nan"))
+    self.zs.append(attributes.get("z", "nan"))
+
+  def add_fill(self, attributes):
+    self.fillTypes.append(attributes.get("type", ""))
+    self.fillLevels.append(attributes.get("level", "0"))
+    self.fillFarmIds.append(self.farmIds[-1])
+
+
+def parse_status_feed(data, sections=("Slots", )):
+  """
+  Incrementally parses the status XML and stops as soon as all requested sections were read.
+  Everything else in the feed (vehicles, mods, farms, ...) is skipped without building a tree.
+  Slots, Vehicles and Farms can be requested.
+  """
+  feed = StatusFeed()
+  if "Vehicles" in sections:
+    feed.vehicles = VehicleColumns()
+  if "Farms" in sections:
+    feed.farms = []
+  parser = ET.XMLPullParser(events=("start", "end"))
+  remainingSections = set(sections)
+  depth = 0
+  section = None
+
+  for offset in range(0, len(data), CHUNK_SIZE):
+    parser.feed(data[offset:offset + CHUNK_SIZE])
+    for event, element in parser.read_events():
+      if event == "start":
+        depth += 1
+        if depth == 1 and element.tag == "Server":
+          feed.server = dict(element.attrib)
+        elif depth == 2:
+          section = element.tag
+          if section == "Slots":
+            feed.slots = dict(element.attrib)
+        elif section == "Vehicles" and feed.vehicles is not None:
+          if depth == 3 and element.tag == "Vehicle":
+            feed.vehicles.add_vehicle(element.attrib)
+          elif depth == 5 and element.tag == "Fill":
+            feed.vehicles.add_fill(element.attrib)
+        elif section == "Farms" and feed.farms is not None and depth == 3 \
+            and element.tag == "Farm":
+          feed.farms.append(dict(element.attrib))
+        continue
+
+      # End events
+      depth -= 1
+      if section == "Slots" and depth == 2 and element.tag == "Player":
+        feed.players.append(_player_element(element))
+      elif section == "Vehicles" and depth == 2:
+        # Maps can have thousands of vehicles, so don't keep the ones which were read
+        element.clear()
+      elif depth == 1:
+        section = None
+        remainingSections.discard(element.tag)
+        # Don't keep finished sections in memory
+        element.clear()
+        if not remainingSections:
+          return feed
+
+  # Raises an error if the document was incomplete
+  parser.close()
+  return feed
+
+
+def parse_status_feed_xmltodict(data, sections=("Slots", )):
+  """Parses the whole status XML using xmltodict. Slower, but kept as a fallback"""
+  feed = StatusFeed()
+  if "Vehicles" in sections:
+    feed.vehicles = VehicleColumns()
+  if "Farms" in sections:
+    feed.farms = []
+  serverElement = xmltodict.parse(data)["Server"]
+  if not serverElement:
+    return feed
+
+  feed.server = _attributes(serverElement)
+  slotsElement = serverElement.get("Slots")
+  if slotsElement:
+    feed.slots = _attributes(slotsElement)
+    feed.players = _children(slotsElement, "Player")
+  if feed.vehicles is not None:
+    for vehicleElement in _children(serverElement.get("Vehicles"), "Vehicle"):
+      feed.vehicles.add_vehicle(_attributes(vehicleElement))
+      for fillElement in _children(vehicleElement.get("Fills"), "Fill"):
+        feed.vehicles.add_fill(_attributes(fillElement))
+  if feed.farms is not None:
+    feed.farms = [
+      _attributes(farmElement)
+      for farmElement in _children(serverElement.get("Farms"), "Farm")
+    ]
+  return feed
+
+
+def _children(elementDict, tag):
+  if not elementDict:
+    return []
+  children = elementDict.get(tag) or []
+  # xmltodict does not create a list if there is only a single child
+  if not isinstance(children, list):
+    children = [children]
+  # Elements without attributes and content are None
+  return [child for child in children if child is not None]
+
+
+def _player_element(element):
+  playerElement = {"@" + key: value for key, value in element.attrib.items()}
+  if element.text is not None:
+    playerElement["#text"] = element.text
+  return playerElement
+
+
+def _attributes(elementDict):
+  return {
+    key[1:]: value
+    for key, value in elementDict.items() if key.startswith("@")
+  }
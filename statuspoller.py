@@ -0,0 +1,205 @@
+import time
+import traceback
+import numpy as np
+from farmstats import compute_farm_stats
+from heatmap import bin_positions, moved_cells
+from hosthealth import FAILURE_DESCRIPTIONS, TIMEOUT_FAILURES
+from metrics import PARSE_SECONDS, DIFF_SECONDS, server_label
+from modlist import ModListCache
+
+
+class PollOutcome:
+  """
+  Describes what happened to a single server while it was polled
+  """
+
+  def __init__(self,
+               serverData,
+               reachable,
+               notBefore=None,
+               turnedOnline=False,
+               turnedOffline=False,
+               changed=False,
+               failed=False,
+               modsChanged=False,
+               previousMods=None,
+               positionCells=None):
+    self.serverData = serverData
+    self.reachable = reachable
+    # The host must not be polled again for this many seconds, if set
+    self.notBefore = notBefore
+    self.turnedOnline = turnedOnline
+    self.turnedOffline = turnedOffline
+    # True if the status needs to be written to the database
+    self.changed = changed
+    # True if the feed could not be processed. Nothing but the embed is updated in this case
+    self.failed = failed
+    # True if the server now runs a different mod list than previousMods
+    self.modsChanged = modsChanged
+    self.previousMods = previousMods
+    # The heatmap cells of the players and moving vehicles, if positions are tracked
+    self.positionCells = positionCells
+
+
+class StatusPoller:
+  """
+  Fetches the status XML of servers, parses it and updates the ServerStatus objects with it.
+  The bot uses this directly, the workers of a ShardedPoller use it for their share of servers.
+  """
+
+  def __init__(self,
+               fetcher,
+               health,
+               parseStatusFeed,
+               offlineAfterTimeouts=2,
+               modCache=None,
+               trackPositions=False,
+               recorder=None):
+    self.fetcher = fetcher
+    self.health = health
+    self.parseStatusFeed = parseStatusFeed
+    # A single timeout could just be a slow response, so a server only counts as offline after
+    # this many timeouts in a row
+    self.offlineAfterTimeouts = offlineAfterTimeouts
+    # Servers which run the same mods share one parsed mod list
+    self.modCache = modCache or ModListCache()
+    # Adds the heatmap cells of players and vehicles to the outcomes
+    self.trackPositions = trackPositions
+    # A FeedRecorder which gets every fetch result, if set
+    self.recorder = recorder
+
+  def forget(self, serverData):
+    """Needs to be called when the server is removed or its API code changed"""
+    self.fetcher.forget(serverData.status_xml_url())
+
+  async def close(self):
+    await self.fetcher.close()
+    if self.recorder is not None:
+      self.recorder.close()
+
+  async def poll(self, serverStatuses):
+    """Polls all of the given servers in parallel, and returns their outcomes in the same order"""
+    fetchResults = await self.fetcher.fetch_all(
+      [serverData.status_xml_url() for serverData in serverStatuses])
+    if self.recorder is not None:
+      self.recorder.record_poll(
+        time.time(),
+        [serverData.serverConfig.identifier for serverData in serverStatuses],
+        fetchResults)
+    return [
+      self._process(serverData, fetchResult)
+      for serverData, fetchResult in zip(serverStatuses, fetchResults)
+    ]
+
+  def _process(self, serverData, fetchResult):
+    outcome = PollOutcome(serverData,
+                          reachable=fetchResult.succeeded(),
+                          notBefore=self.health.seconds_until_probe(
+                            fetchResult.host))
+
+    if fetchResult.succeeded() and fetchResult.unchanged:
+      # Nothing changed since the last cycle, so there is nothing to parse, compare or store
+      serverData.clear_recent_changes()
+    elif fetchResult.succeeded():
+      url = fetchResult.url
+      # Parse data from the server XML
+      try:
+        with PARSE_SECONDS.time(server_label(fetchResult.host)):
+          feed = self.parseStatusFeed(fetchResult.data)
+      except:
+        print("Failed parsing XML data from %s" % url)
+        self.fetcher.forget(url)
+        outcome.failed = True
+        return outcome
+
+      try:
+        # Check if the server is offline (but the host is online. In this case we get an empty XML):
+        if not feed.is_server_running():
+          if serverData.is_online():
+            outcome.turnedOffline = True
+          serverData.set_offline("game not running")
+          with DIFF_SECONDS.time(server_label(fetchResult.host)):
+            serverData.update_players([])
+          serverData.farmStats = None
+        else:
+          if not serverData.is_online():
+            outcome.turnedOnline = True
+          # Update the cache with the status values
+          serverData.update_attributes(status="Online",
+                                       name=feed.server["name"],
+                                       map=feed.server["mapName"],
+                                       maxPlayers=feed.slots["capacity"])
+
+          with DIFF_SECONDS.time(server_label(fetchResult.host)):
+            serverData.update_players(feed.players)
+          self._update_mods(serverData, fetchResult, outcome)
+          self._update_farm_stats(serverData, fetchResult, feed)
+          if self.trackPositions:
+            self._update_positions(serverData, fetchResult, feed, outcome)
+          outcome.changed = True
+      except:
+        print("Failed updating online state from XML: %s" %
+              traceback.format_exc())
+        self.fetcher.forget(url)
+        outcome.failed = True
+    elif fetchResult.failureCategory in TIMEOUT_FAILURES and self.health.consecutive_failures(
+        fetchResult.host) < self.offlineAfterTimeouts:
+      # Keep the previous state until the host times out again
+      print("INFO: %s timed out, keeping its previous state" %
+            fetchResult.host)
+      serverData.clear_recent_changes()
+    else:
+      if serverData.is_online():
+        outcome.turnedOffline = True
+      # While the circuit is open, show why the host failed before
+      serverData.set_offline(
+        FAILURE_DESCRIPTIONS.get(self.health.last_failure(fetchResult.host)))
+
+    return outcome
+
+  def _update_farm_stats(self, serverData, fetchResult, feed):
+    # Only if the parser was asked to read the vehicles and farms
+    if feed.vehicles is None or feed.farms is None:
+      return
+    try:
+      serverData.farmStats = compute_farm_stats(feed.vehicles, feed.farms)
+    except:
+      print("WARN: Could not summarize the vehicles of %s: %s" %
+            (fetchResult.host, traceback.format_exc()))
+
+  def _update_positions(self, serverData, fetchResult, feed, outcome):
+    try:
+      mapSize = float(feed.server.get("mapSize", 2048))
+      positions = [(playerElement["@x"], playerElement["@z"])
+                   for playerElement in feed.players
+                   if "@x" in playerElement and "@z" in playerElement]
+      cells = bin_positions([x for x, _ in positions],
+                            [z for _, z in positions], mapSize)
+      if feed.vehicles is not None:
+        vehicleCells = bin_positions(feed.vehicles.xs, feed.vehicles.zs,
+                                     mapSize)
+        cells = np.concatenate(
+          [cells, moved_cells(serverData.vehicleCells, vehicleCells)])
+        serverData.vehicleCells = vehicleCells
+      outcome.positionCells = cells
+    except:
+      print("WARN: Could not read the positions on %s: %s" %
+            (fetchResult.host, traceback.format_exc()))
+
+  def _update_mods(self, serverData, fetchResult, outcome):
+    # The mods are only parsed if no other server is known to run the same ones
+    try:
+      modList = self.modCache.lookup(fetchResult.data)
+    except:
+      print("WARN: Could not read the mods of %s: %s" %
+            (fetchResult.host, traceback.format_exc()))
+      return
+    previousMods = serverData.mods
+    if modList is not None and (previousMods is None
+                                or previousMods.hash != modList.hash):
+      serverData.mods = modList
+      outcome.modsChanged = True
+      outcome.previousMods = previousMods
+    elif modList is not None and not previousMods.is_loaded():
+      # Only the hash was restored, and the mods did not change since then
+      serverData.mods = modList
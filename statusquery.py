@@ -0,0 +1,48 @@
+import itertools
+from statusembed import render_status_description
+
+
+class StatusQueryCache:
+  """
+  Keeps the rendered answers of /fss_status, so a burst of requests for the same server only
+  renders it once. An answer is only rendered again after the status of the server changed.
+  """
+
+  def __init__(self):
+    self.versions = itertools.count(1)
+    # Server identifier => (version, status description)
+    self.descriptions = {}
+    # Configuration key => (version, title, color, rendered answer)
+    self.answers = {}
+
+  def update(self, identifier, description):
+    """Called with the description of every server after it was polled"""
+    current = self.descriptions.get(identifier)
+    if current is None or current[1] != description:
+      self.descriptions[identifier] = (next(self.versions), description)
+
+  def get(self, serverConfig, serverData, render):
+    """
+    Returns the answer for a server as shown to the guild of the given configuration.
+    render(title, description, color) is only called if nothing has been cached for it yet.
+    """
+    identifier = serverConfig.identifier
+    if identifier not in self.descriptions:
+      # The server was not polled since the bot started
+      self.update(identifier, render_status_description(serverData))
+    version, description = self.descriptions[identifier]
+
+    # The title and color can differ between guilds, and change without a poll
+    title = serverData.display_name(serverConfig)
+    color = int(serverConfig.color, 16)
+    answer = self.answers.get(serverConfig.key)
+    if answer is None or answer[:3] != (version, title, color):
+      answer = (version, title, color, render(title, description, color))
+      self.answers[serverConfig.key] = answer
+    return answer[3]
+
+  def forget(self, serverConfig):
+    self.answers.pop(serverConfig.key, None)
+
+  def forget_server(self, identifier):
+    self.descriptions.pop(identifier, None)
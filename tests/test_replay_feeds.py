@@ -0,0 +1,32 @@
+"""
+Replays a recorded poll of two servers (one churning, one unreachable) through the bot and checks
+the member log messages it would have sent
+"""
+import asyncio
+import os
+import sys
+
+ROOT = os.path.join(os.path.dirname(__file__), "..")
+FIXTURES = os.path.join(os.path.dirname(__file__), "fixtures")
+
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, "benchmarks"))
+
+
+def test_replay_member_log(tmp_path, monkeypatch):
+  # Keep the bot away from the real database, history and heatmaps
+  monkeypatch.setenv("FSS_STORAGE_BACKEND", "sqlite")
+  monkeypatch.setenv("FSS_SQLITE_PATH", str(tmp_path / "replay.sqlite3"))
+  monkeypatch.setenv("FSS_HISTORY_DIR", "")
+  monkeypatch.setenv("FSS_HEATMAP_DIR", "")
+  monkeypatch.setenv("FSS_RECORD_DIR", "")
+  import replay_feeds
+
+  messages, pollCount = asyncio.new_event_loop().run_until_complete(
+    replay_feeds.replay([os.path.join(FIXTURES, "feeds-churn.gz")]))
+
+  with open(os.path.join(FIXTURES, "feeds-churn.expected.txt"),
+            encoding="utf-8") as f:
+    expected = f.read()
+  assert pollCount == 3
+  assert "\n".join(messages) + "\n" == expected